@@ -138,38 +138,6 @@ async def update_ui(request: Request):
         logger.error(f"Error in update-ui: {str(e)}", exc_info=True)
         return JSONResponse({"error": str(e)}, status_code=500)
 
-@app.post("/typing-complete/{message_id}")
-async def typing_complete(message_id: str, request: Request):
-    try:
-        data = await request.json()
-        response = data.get("response")
-        if not response:
-            logger.error(f"Không nhận được response từ JavaScript cho message_id={message_id}")
-            return JSONResponse({"error": "Không nhận được response"}, status_code=400)
-
-        client_id = data.get("client_id")
-        chat_component = CHAT_COMPONENTS.get(client_id)
-        if not chat_component:
-            logger.error(f"Không tìm thấy ChatComponent cho message_id={message_id}, client_id={client_id}")
-            return JSONResponse({"error": "Không tìm thấy ChatComponent"}, status_code=500)
-
-        username = chat_component.client_state.get("username", "")
-        # Cập nhật nội dung tin nhắn trong self.messages
-        for msg in chat_component.messages:
-            if msg["id"] == message_id:
-                msg["content"] = response
-                break
-        else:
-            logger.error(f"Không tìm thấy tin nhắn với message_id={message_id} trong self.messages")
-            return JSONResponse({"error": "Không tìm thấy tin nhắn"}, status_code=400)
-
-        logger.info(f"{username}: Hoàn tất hiệu ứng đánh máy cho message_id={message_id}")
-        return JSONResponse({"success": "Cập nhật thành công"})
-
-    except Exception as e:
-        logger.error(f"Lỗi xử lý typing-complete cho message_id={message_id}: {str(e)}", exc_info=True)
-        return JSONResponse({"error": str(e)}, status_code=500)
-        
 async def handle_error(e: Exception, username: str, action: str, core: Core) -> dict:
     error_msg = f"Lỗi {action}: {str(e)}"
     if await core.sqlite_handler.has_permission(username, "admin_access"):
@@ -349,14 +317,14 @@ async def auth_page(request: Request):
                     ui.notify(state_result["error"], type="negative")
                     return {"success": False, "error": state_result["error"]}
                 logger.info(f"Đăng ký thành công cho {data['username']}, session_token={session_token[:10]}...")
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
+                async def write_op(conn):
                     created_at = int(time.time())
                     await conn.execute(
                         "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
                         "VALUES (?, ?, ?, ?, ?, ?)",
                         (str(uuid.uuid4()), "users", hashlib.sha256(data["username"].encode()).hexdigest(), "SYNC", created_at, json.dumps({"username": data["username"], "action": "register"}))
                     )
-                    await conn.commit()
+                await core.sqlite_handler.enqueue_write(write_op)
                 set_auth_cookies_js(session_token, data["username"])
                 return {"success": True, "message": "Đăng ký thành công"}
             ui.notify(result["error"], type="negative")
@@ -513,12 +481,16 @@ async def api_sync(request: Request):
         if not await check_firestore_availability(request, core):
             return JSONResponse({"error": "Firestore không khả dụng!"}, status_code=503)
         async with asyncio.timeout(60):
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+            async with core.db_pool.reader() as conn:
                 async with conn.execute(
                     "SELECT MAX(timestamp) FROM sync_log WHERE action IN ('sync_to_sqlite', 'sync_from_sqlite')"
                 ) as cursor:
                     last_sync = await cursor.fetchone()
-                    if last_sync and last_sync[0] and (int(time.time()) - last_sync[0]) < Config.SYNC_MIN_INTERVAL:
+                    last_sync = max(
+                        (last_sync[0] if last_sync and last_sync[0] else 0),
+                        core.sync_daemon.last_success_at or 0
+                    )
+                    if last_sync and (int(time.time()) - last_sync) < Config.SYNC_MIN_INTERVAL:
                         logger.info(f"Bỏ qua đồng bộ: lần đồng bộ trước cách đây dưới {Config.SYNC_MIN_INTERVAL} giây")
                         return JSONResponse({"success": f"Đồng bộ gần đây, chờ {Config.SYNC_MIN_INTERVAL} giây"}, status_code=429)
         check_disk_space()
@@ -546,22 +518,31 @@ async def api_sync(request: Request):
         error_result = await handle_error(e, username, "đồng bộ", core)
         return JSONResponse({"error": error_result["error"]}, status_code=error_result["status_code"])
 
+@fastapi_app.get("/api/sync/status")
+async def api_sync_status(request: Request):
+    try:
+        session_token, username, client_state = await handle_session(request, core)
+        if not await core.sqlite_handler.has_permission(username, "sync_data"):
+            return JSONResponse({"error": "Chỉ admin có thể xem trạng thái đồng bộ!"}, status_code=403)
+        return JSONResponse({
+            "success": True,
+            **core.sync_daemon.status(),
+            "listener": core.firestore_listener.status()
+        })
+    except ValueError as ve:
+        logger.warning(f"Lỗi trạng thái đồng bộ: {str(ve)}")
+        return JSONResponse({"error": str(ve)}, status_code=400)
+    except Exception as e:
+        error_result = await handle_error(e, "", "trạng thái đồng bộ", core)
+        return JSONResponse({"error": error_result["error"]}, status_code=error_result["status_code"])
+
 async def check_firestore_availability(request: Request, core: Core) -> bool:
-    logger.debug("Kiểm tra tính khả dụng của Firestore")
+    # Đọc trạng thái do health monitor cập nhật, không gọi Firestore trên mỗi request
     if not core.firestore_handler.firestore_available:
         request.state.firestore_warning = "Firestore không khả dụng, ứng dụng chạy ở chế độ cục bộ."
-        logger.info("Firestore không khả dụng, chạy với SQLite cục bộ")
-        return False
-    try:
-        test_doc_ref = core.firestore_handler.db.collection("test").document("ping")
-        await test_doc_ref.set({"timestamp": int(time.time())})
-        await test_doc_ref.delete()
-        logger.debug("Firestore kiểm tra thành công")
-        return True
-    except Exception as e:
-        logger.warning(f"Lỗi kiểm tra Firestore: {str(e)}", exc_info=True)
-        request.state.firestore_warning = "Firestore không khả dụng, chạy ở chế độ cục bộ."
+        logger.debug("Firestore không khả dụng, chạy với SQLite cục bộ")
         return False
+    return True
 
 @fastapi_app.middleware("http")
 async def auth_middleware(request: Request, call_next):
@@ -775,7 +756,7 @@ async def api_register(data: RegisterData, response: Response, request: Request)
                 )
                 if not state_result["success"]:
                     return JSONResponse({"error": state_result["error"]}, status_code=400)
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     created_at = int(time.time())
                     await conn.execute(
                         "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
@@ -789,7 +770,7 @@ async def api_register(data: RegisterData, response: Response, request: Request)
                             json.dumps({"username": data.username, "action": "register"})
                         )
                     )
-                    await conn.commit()
+                await core.sqlite_handler.enqueue_write(write_op)
                 set_auth_cookies(response, session_token, data.username)
                 logger.info(f"Đăng ký thành công cho {data.username}, session_token={session_token[:10]}...")
                 return JSONResponse({"success": "Đăng ký thành công", "redirect": "/dashboard"})
@@ -808,7 +789,7 @@ async def api_register(data: RegisterData, response: Response, request: Request)
 async def update_and_save_client_state(core: Core, session_token: str, username: str, firestore_available: bool) -> dict:
     
     try:
-        async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+        async with core.db_pool.reader() as conn:
             # Kiểm tra session
             async with conn.execute(
                 "SELECT username FROM sessions WHERE session_token = ?",
@@ -819,43 +800,38 @@ async def update_and_save_client_state(core: Core, session_token: str, username:
                     logger.warning(f"Username mismatch: expected {username}, got {session_row[0]} in sessions")
                     username = session_row[0]
 
-            # Lấy role từ bảng users
-            async with conn.execute(
-                "SELECT role FROM users WHERE username = ?",
-                (username,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                role = row[0] if row else "user"
-
-            # Lấy client_state hiện tại
-            client_state = await core.get_client_state(session_token, username)
-            if client_state.get("username") and client_state["username"] != username:
-                logger.warning(f"Username mismatch: client_state={client_state['username']}, expected={username}")
-                client_state["username"] = username
-
-            # Lấy language từ client_state hoặc app.storage.user
-            language = client_state.get("language", app.storage.user.get("language", "vi"))
-
-            client_state.update({
-                "authenticated": True,
-                "session_token": session_token,
-                "username": username,
-                "firestore_available": firestore_available,
-                "timestamp": int(time.time()),
-                "role": role,
-                "language": language,
-                "login_attempts": client_state.get("login_attempts", 0),
-                "selected_tab": client_state.get("selected_tab", "Chat"),
-                "registered_tabs": client_state.get("registered_tabs", [])
-            })
-            sanitized_state = sanitize_state(client_state)
-            if len(json.dumps(sanitized_state).encode()) > 1_048_576:
-                logger.error(f"Kích thước client_state vượt quá 1MB cho {username}")
-                return {"success": False, "error": "Trạng thái phiên quá lớn"}
-            await core.save_client_state(session_token, sanitized_state)
-            app.storage.user["language"] = sanitized_state["language"]
-            logger.info(f"Đã lưu client_state với language={sanitized_state['language']} cho {username}")
-            return {"success": True, "client_state": sanitized_state}
+        # Lấy role từ cache role (truy vấn bảng users khi cache miss)
+        role = await core.sqlite_handler.get_user_role(username) or "user"
+
+        # Lấy client_state hiện tại
+        client_state = await core.get_client_state(session_token, username)
+        if client_state.get("username") and client_state["username"] != username:
+            logger.warning(f"Username mismatch: client_state={client_state['username']}, expected={username}")
+            client_state["username"] = username
+
+        # Lấy language từ client_state hoặc app.storage.user
+        language = client_state.get("language", app.storage.user.get("language", "vi"))
+
+        client_state.update({
+            "authenticated": True,
+            "session_token": session_token,
+            "username": username,
+            "firestore_available": firestore_available,
+            "timestamp": int(time.time()),
+            "role": role,
+            "language": language,
+            "login_attempts": client_state.get("login_attempts", 0),
+            "selected_tab": client_state.get("selected_tab", "Chat"),
+            "registered_tabs": client_state.get("registered_tabs", [])
+        })
+        sanitized_state = sanitize_state(client_state)
+        if len(json.dumps(sanitized_state).encode()) > 1_048_576:
+            logger.error(f"Kích thước client_state vượt quá 1MB cho {username}")
+            return {"success": False, "error": "Trạng thái phiên quá lớn"}
+        await core.save_client_state(session_token, sanitized_state)
+        app.storage.user["language"] = sanitized_state["language"]
+        logger.info(f"Đã lưu client_state với language={sanitized_state['language']} cho {username}")
+        return {"success": True, "client_state": sanitized_state}
     except Exception as e:
         logger.error(f"Lỗi khi lưu client_state cho {username}: {str(e)}", exc_info=True)
         return {"success": False, "error": str(e)}
@@ -17,6 +17,11 @@ class Config:
     # Cấu hình SQLite
     SQLITE_DB_PATH = os.environ.get("SQLITE_DB_PATH", "/tmp/app.db")
     MAX_SQLITE_SIZE = 100_000_000
+    SQLITE_POOL_READERS = int(os.environ.get("SQLITE_POOL_READERS", 4))
+    SQLITE_POOL_TIMEOUT = 30.0
+    SQLITE_STATEMENT_CACHE = 256
+    SQLITE_WRITE_BATCH_SIZE = 64
+    SQLITE_WRITE_MAX_LATENCY = 0.005
 
     # Thêm cấu hình system prompt
     
@@ -44,6 +49,10 @@ class Config:
     # Cấu hình phiên và xác thực
     SESSION_MAX_AGE = 2_592_000
     MAX_LOGIN_ATTEMPTS = 5
+    SESSION_CACHE_SIZE = 2048
+    SESSION_CACHE_TTL = 30
+    ROLE_CACHE_SIZE = 4096
+    ROLE_CACHE_TTL = 300
     ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "admin123")
     ADMIN_BOT_PASSWORD = os.environ.get("ADMIN_BOT_PASSWORD", "Bot@Admin1234")
@@ -54,6 +63,23 @@ class Config:
     BATCH_SIZE = 500
     SYNC_LOG_MAX_AGE = 604_800
     SYNC_MIN_INTERVAL = 30
+    FIRESTORE_BATCH_MAX_OPS = 500  # giới hạn thao tác mỗi WriteBatch của Firestore
+    FIRESTORE_MAX_INFLIGHT_COMMITS = 4
+    SYNC_WATERMARK_SLACK = 300  # giây lùi mốc phiên bản khi kéo delta từ Firestore
+    SYNC_VERSION_FIELD = "sync_version"  # trường server timestamp ghi kèm mỗi lần đẩy, làm mốc kéo delta
+    SYNC_PROGRESS_INTERVAL = 0.5  # giây tối thiểu giữa hai lần báo tiến độ đồng bộ
+    SYNC_MAX_PARALLEL_COLLECTIONS = 3  # số collection đồng bộ song song
+    SYNC_DAEMON_ENABLED = os.environ.get("SYNC_DAEMON_ENABLED", "true").lower() == "true"
+    SYNC_DAEMON_USERNAME = ADMIN_USERNAME  # tài khoản (cần quyền sync_data) chạy đồng bộ nền
+    SYNC_COALESCE_DELAY = 5  # giây gom các thay đổi dồn dập trước khi đồng bộ nền
+    SYNC_MAX_BACKOFF = 900  # giây chờ tối đa giữa hai lần đồng bộ nền khi lỗi liên tiếp
+    SYNC_LISTENER_ENABLED = os.environ.get("SYNC_LISTENER_ENABLED", "false").lower() == "true"
+    SYNC_LISTENER_COLLECTIONS = ("qa_data", "chat_messages", "users")  # collection nhận thay đổi qua on_snapshot
+    SYNC_LISTENER_FLUSH_DELAY = 0.5  # giây gom thay đổi từ listener trước khi ghi SQLite
+    FIRESTORE_HEALTH_INTERVAL = 30
+    FIRESTORE_HEALTH_MAX_BACKOFF = 300
+    FIRESTORE_HEALTH_TIMEOUT = 5.0
+    FIRESTORE_HEALTH_COLLECTION = "test"
 
     # Cấu hình log và file tạm
     MAX_LOG_SIZE = 10_000_000
@@ -66,16 +92,51 @@ class Config:
     QA_SEARCH_THRESHOLD = 0.6
     TRAINING_SEARCH_THRESHOLD = 0.6
     QA_HISTORY_LIMIT = 10
+    FUZZY_MATCH_WORKERS = int(os.environ.get("FUZZY_MATCH_WORKERS", 2))
+    FUZZY_SCAN_CHUNK = 5000  # số bản ghi qa_data chấm điểm mỗi lượt
+    QA_INDEX_MAX_USERS = 256  # số user giữ chỉ mục QA trong bộ nhớ (LRU)
+    QA_INDEX_MAX_CANDIDATES = 500  # số ứng viên từ chỉ mục đưa vào chấm điểm fuzzy
+    QA_FTS_WEIGHTS = (10.0, 4.0, 1.0)  # trọng số bm25 cho question, answer, category
+    QA_FTS_NEAR_DISTANCE = 10
+    QA_FTS_CANDIDATES = 200  # số kết quả bm25 tối đa xét ngưỡng khi có limit
+    QA_ANSWER_CACHE_SIZE = 4096  # cache câu trả lời QA theo câu hỏi chuẩn hóa
+    QA_ANSWER_CACHE_TTL = 600
+    VECTOR_SEARCH_ENABLED = os.environ.get("VECTOR_SEARCH_ENABLED", "true").lower() == "true"
+    EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "hashed")
+    EMBEDDING_DIM = 256
+    EMBEDDING_BATCH_SIZE = 1000  # số bản ghi embed và ghi SQLite mỗi lượt
+    VECTOR_SEARCH_THRESHOLD = 0.45  # cosine tối thiểu để đưa QA vào ngữ cảnh Hybrid
+    ANN_MIN_ROWS = 20_000  # từ số bản ghi này mỗi user dùng chỉ mục IVF thay vì quét toàn bộ
+    ANN_INDEX_DIR = os.path.join(os.path.dirname(SQLITE_DB_PATH) or ".", "qa_ann")
+    ANN_LISTS_FACTOR = 1.0  # số cụm IVF = hệ số x sqrt(số vector)
+    ANN_NPROBE = 32  # số cụm quét mỗi truy vấn
+    ANN_COMPACT_RATIO = 0.1  # compact khi delta + đã xóa vượt tỉ lệ này của phần nền
+    ANN_COMPACT_MIN_DELTA = 1000
+    ANN_RETRAIN_GROWTH = 2.0  # huấn luyện lại tâm cụm khi kích thước đổi quá số lần này
+    RETRIEVAL_RRF_K = 60
+    RETRIEVAL_STAGE_LIMIT = 10  # số ứng viên mỗi stage đưa vào fusion
+    RETRIEVAL_STAGE_WEIGHTS = {"fts": 1.0, "fuzzy": 1.0, "vector": 1.0}
+    RETRIEVAL_STAGE_BUDGETS = {"fts": 0.3, "fuzzy": 0.8, "vector": 0.5}  # giây chờ mỗi stage
+    # Khoảng điểm thô (0-100) ứng với 0-1 sau hiệu chỉnh; threshold QA so trên thang này
+    RETRIEVAL_CALIBRATION = {"fts": (0.0, 100.0), "fuzzy": (0.0, 100.0), "vector": (30.0, 75.0)}
     CHAT_HISTORY_LIMIT = 500
 
     # Danh sách bảng
     SPECIAL_TABLES = {"collection_schemas", "users", "sessions", "client_states"}
     PROTECTED_TABLES = {"protected_placeholder"}
-    SYSTEM_TABLES = {"sync_log", "sqlite_sequence"}
+    SYSTEM_TABLES = {"sync_log", "sqlite_sequence", "llm_cache", "qa_embeddings", "sync_manifest", "sync_checkpoints"}
 
     # Cấu hình AI (Grok)
     GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
     GROK_VISION_ENABLED = False
+    GROK_STREAM_ENABLED = True
+    GROK_STREAM_FLUSH_INTERVAL = 0.05  # giây giữa hai lần đẩy delta lên UI
+    LLM_METRICS_WINDOW = 500
+    LLM_CACHE_TTL = 86_400  # giây
+    LLM_CACHE_MAX_ENTRIES = 5000
+    LLM_CACHE_BYPASS_MODES = set(
+        mode for mode in os.environ.get("LLM_CACHE_BYPASS_MODES", "").split(",") if mode
+    )  # ví dụ "Grok" để luôn gọi API ở chế độ Grok
     
     # Cấu hình bảo mật
     ALLOWED_FILE_EXTENSIONS = {".txt", ".pdf", ".jpg", ".png"}
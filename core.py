@@ -12,9 +12,22 @@ import uuid
 import hashlib
 import json
 import os
+import copy
 from passlib.context import CryptContext
 from config import Config
 from utils.logging import get_logger
+from utils.sqlite_pool import SQLitePool
+from utils.cache import TTLCache
+from utils.metrics import LatencyStats
+from utils.fuzzy_matcher import FuzzyMatcher
+from utils.qa_index import QAIndexManager, QA_INDEX_FIELDS, normalize_qa_text
+from utils.fts_query import compile_qa_query, token_coverage
+from utils.llm_cache import LLMResponseCache
+from utils.vector_store import QAVectorStore
+from utils.retrieval import reciprocal_rank_fusion
+from utils.firestore_batch import FirestoreBatchWriter, content_hash
+from utils.sync_daemon import SyncDaemon
+from utils.firestore_listener import FirestoreListener
 from utils.core_common import (
     sanitize_field_name,
     validate_name,
@@ -23,19 +36,23 @@ from utils.core_common import (
     retry_firestore_operation
 )
 from utils.core_common import validate_name
-from google.cloud.firestore_v1 import FieldFilter  # Thêm import
-from typing import Dict, Optional, Any, Callable, List
+from google.cloud.firestore_v1 import FieldFilter, SERVER_TIMESTAMP  # Thêm import
+from typing import Dict, Optional, Any, Callable, List, Tuple
 from fastapi.responses import JSONResponse, RedirectResponse
 try:
-    from google.cloud.firestore_v1 import AsyncClient
+    from google.cloud.firestore_v1 import AsyncClient, Client
     from google.oauth2.service_account import Credentials
     from google.api_core.retry_async import AsyncRetry
 except ImportError:
     AsyncClient = None
+    Client = None
     Credentials = None
     AsyncRetry = None
 import datetime
 
+# Collection lọc theo user khi kéo từ Firestore: tên collection -> trường chủ sở hữu
+USER_SCOPED_COLLECTIONS = {"chat_messages": "username", "qa_data": "created_by"}
+
 
 
 class DatabaseError(Exception):
@@ -46,6 +63,183 @@ class DatabaseError(Exception):
     
 class SQLiteHandler:
     """Xử lý các thao tác SQLite."""
+
+    # FTS5 cho qa_data: bảng qa_fts tự lưu bản sao đã gấp đ/Đ -> d/D của các cột,
+    # tokenizer unicode61 remove_diacritics 2 bỏ các dấu còn lại khi lập chỉ mục.
+    QA_FTS_SCHEMA = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+            question, answer, category,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS qa_data_ai AFTER INSERT ON qa_data BEGIN
+            INSERT INTO qa_fts(rowid, question, answer, category) VALUES (
+                new.rowid,
+                replace(replace(new.question, 'đ', 'd'), 'Đ', 'D'),
+                replace(replace(new.answer, 'đ', 'd'), 'Đ', 'D'),
+                replace(replace(new.category, 'đ', 'd'), 'Đ', 'D')
+            );
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS qa_data_ad AFTER DELETE ON qa_data BEGIN
+            DELETE FROM qa_fts WHERE rowid = old.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS qa_data_au AFTER UPDATE ON qa_data BEGIN
+            DELETE FROM qa_fts WHERE rowid = old.rowid;
+            INSERT INTO qa_fts(rowid, question, answer, category) VALUES (
+                new.rowid,
+                replace(replace(new.question, 'đ', 'd'), 'Đ', 'D'),
+                replace(replace(new.answer, 'đ', 'd'), 'Đ', 'D'),
+                replace(replace(new.category, 'đ', 'd'), 'Đ', 'D')
+            );
+        END
+        """,
+    ]
+
+    # Nạp các bản ghi qa_data chưa có trong qa_fts
+    QA_FTS_BACKFILL = """
+        INSERT INTO qa_fts(rowid, question, answer, category)
+        SELECT rowid,
+               replace(replace(question, 'đ', 'd'), 'Đ', 'D'),
+               replace(replace(answer, 'đ', 'd'), 'Đ', 'D'),
+               replace(replace(category, 'đ', 'd'), 'Đ', 'D')
+        FROM qa_data
+        WHERE rowid NOT IN (SELECT rowid FROM qa_fts)
+    """
+
+    # Migration schema theo PRAGMA user_version: (version, mô tả, danh sách câu lệnh SQL
+    # hoặc coroutine nhận kết nối). Chỉ thêm migration mới vào cuối, không sửa migration cũ.
+    MIGRATIONS = [
+        (1, "Thêm index cho các truy vấn nóng", [
+            "CREATE INDEX IF NOT EXISTS idx_chat_messages_session_ts ON chat_messages(session_token, username, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_chat_messages_username_ts ON chat_messages(username, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_action_ts ON sync_log(action, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_table_action ON sync_log(table_name, action)",
+            "CREATE INDEX IF NOT EXISTS idx_qa_data_created_by_ts ON qa_data(created_by, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_sessions_username_token ON sessions(username, session_token)",
+            "CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(session_token)",
+        ]),
+        (2, "Thêm cột username/session_token có index cho sync_log", [
+            lambda conn: SQLiteHandler._add_column_if_missing(conn, "sync_log", "username", "TEXT"),
+            lambda conn: SQLiteHandler._add_column_if_missing(conn, "sync_log", "session_token", "TEXT"),
+            # Backfill từ details JSON của các bản ghi cũ
+            """
+            UPDATE sync_log SET
+                username = COALESCE(username, json_extract(details, '$.username')),
+                session_token = COALESCE(session_token, json_extract(details, '$.session_token'))
+            WHERE json_valid(details)
+            """,
+            # Writer nào không truyền cột sẽ được điền từ details
+            """
+            CREATE TRIGGER IF NOT EXISTS sync_log_fill_user AFTER INSERT ON sync_log
+            WHEN new.username IS NULL AND json_valid(new.details)
+            BEGIN
+                UPDATE sync_log SET
+                    username = COALESCE(new.username, json_extract(new.details, '$.username')),
+                    session_token = COALESCE(new.session_token, json_extract(new.details, '$.session_token'))
+                WHERE rowid = new.rowid;
+            END
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_username ON sync_log(username, action, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_session_token ON sync_log(session_token)",
+        ]),
+        (3, "Dựng lại qa_fts với tokenizer bỏ dấu tiếng Việt", [
+            "DROP TRIGGER IF EXISTS qa_data_ai",
+            "DROP TRIGGER IF EXISTS qa_data_ad",
+            "DROP TRIGGER IF EXISTS qa_data_au",
+            "DROP TABLE IF EXISTS qa_fts",
+            *QA_FTS_SCHEMA,
+            QA_FTS_BACKFILL,
+        ]),
+        (4, "Thêm bảng llm_cache cho cache phản hồi LLM", [
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                latency_ms REAL,
+                created_at INTEGER NOT NULL,
+                last_hit_at INTEGER NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache(last_hit_at)",
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)",
+        ]),
+        (5, "Thêm bảng qa_embeddings lưu vector float32 của qa_data", [
+            """
+            CREATE TABLE IF NOT EXISTS qa_embeddings (
+                id TEXT PRIMARY KEY,
+                created_by TEXT,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                timestamp INTEGER NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_qa_embeddings_user ON qa_embeddings(created_by, model)",
+            # Embedding đi theo vòng đời bản ghi: xóa khi bản ghi bị xóa hoặc đổi nội dung
+            """
+            CREATE TRIGGER IF NOT EXISTS qa_data_embedding_ad AFTER DELETE ON qa_data BEGIN
+                DELETE FROM qa_embeddings WHERE id = old.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS qa_data_embedding_au AFTER UPDATE OF question, answer ON qa_data BEGIN
+                DELETE FROM qa_embeddings WHERE id = old.id;
+            END
+            """,
+        ]),
+        (6, "Thêm bảng sync_manifest lưu hash nội dung đã đẩy lên Firestore", [
+            """
+            CREATE TABLE IF NOT EXISTS sync_manifest (
+                table_name TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                local_hash TEXT,
+                pushed_at INTEGER,
+                PRIMARY KEY (table_name, doc_id)
+            ) WITHOUT ROWID
+            """,
+        ]),
+        (7, "Thêm hash và phiên bản hai phía cho sync_manifest", [
+            lambda conn: SQLiteHandler._add_column_if_missing(conn, "sync_manifest", "remote_hash", "TEXT"),
+            lambda conn: SQLiteHandler._add_column_if_missing(conn, "sync_manifest", "remote_version", "INTEGER"),
+            lambda conn: SQLiteHandler._add_column_if_missing(conn, "sync_manifest", "pulled_at", "INTEGER"),
+            "UPDATE sync_manifest SET remote_hash = local_hash WHERE remote_hash IS NULL",
+            "CREATE INDEX IF NOT EXISTS idx_sync_manifest_remote_version ON sync_manifest(table_name, remote_version)",
+        ]),
+        (8, "Thêm bảng sync_checkpoints lưu mốc đồng bộ theo collection", [
+            """
+            CREATE TABLE IF NOT EXISTS sync_checkpoints (
+                collection TEXT NOT NULL,
+                direction TEXT NOT NULL,
+                scope TEXT NOT NULL DEFAULT '',
+                last_key TEXT,
+                last_timestamp INTEGER,
+                updated_at INTEGER,
+                PRIMARY KEY (collection, direction, scope)
+            ) WITHOUT ROWID
+            """,
+        ]),
+        (9, "Thêm trường sắp xếp của con trỏ cho sync_checkpoints", [
+            lambda conn: SQLiteHandler._add_column_if_missing(conn, "sync_checkpoints", "cursor_field", "TEXT"),
+        ]),
+        (10, "Chuyển mốc kéo delta từ timestamp ứng dụng sang phiên bản server (sync_version)", [
+            "UPDATE sync_manifest SET remote_version = NULL",
+            "DELETE FROM sync_checkpoints WHERE cursor_field = 'timestamp'",
+        ]),
+    ]
+
+    # Quyền cụ thể cho các vai trò khác admin
+    ROLE_PERMISSIONS = {
+        "user": frozenset({"chat_access", "read_records"}),
+        # Thêm các vai trò và quyền khác nếu cần
+    }
     
     def __init__(self, logger, core):
         self.logger = logger
@@ -53,7 +247,20 @@ class SQLiteHandler:
         self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
         self.protected_collections = Config.PROTECTED_TABLES | Config.SPECIAL_TABLES | Config.SYSTEM_TABLES
         self.write_queue = asyncio.Queue()
+        self.worker_task = None
+        # Future của các thao tác ghi worker đã bắt đầu chạy trong nhóm hiện tại
+        self._started_writes = set()
         self.running = False
+        # Cache trạng thái phiên theo (username, session_token)
+        self.session_cache = TTLCache(Config.SESSION_CACHE_SIZE, Config.SESSION_CACHE_TTL)
+        # Cache role theo username cho has_permission
+        self.role_cache = TTLCache(Config.ROLE_CACHE_SIZE, Config.ROLE_CACHE_TTL)
+        # Chỉ mục QA trong bộ nhớ theo user cho fuzzy search
+        self.qa_index = QAIndexManager()
+        # Cache câu trả lời QA theo (username, câu hỏi chuẩn hóa, limit, threshold);
+        # qa_generation tăng mỗi lần qa_data thay đổi để bỏ kết quả tra cứu đã cũ
+        self.qa_answer_cache = TTLCache(Config.QA_ANSWER_CACHE_SIZE, Config.QA_ANSWER_CACHE_TTL)
+        self.qa_generation = 0
         
     
     async def init_sqlite(self, max_attempts: int = 5, retry_delay: float = 1.0):
@@ -155,48 +362,14 @@ class SQLiteHandler:
                                 )
                             """)
 
-                            # Tạo virtual table FTS5 cho qa_data
-                            await conn.execute("""
-                                CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
-                                    question, answer, category,
-                                    content='qa_data', content_rowid='rowid'
-                                )
-                            """)
-
-                            # Trigger sync sau INSERT
-                            await conn.execute("""
-                                CREATE TRIGGER IF NOT EXISTS qa_data_ai AFTER INSERT ON qa_data BEGIN
-                                    INSERT INTO qa_fts(rowid, question, answer, category)
-                                    VALUES (new.rowid, new.question, new.answer, new.category);
-                                END;
-                            """)
-
-                            # Trigger sync sau DELETE
-                            await conn.execute("""
-                                CREATE TRIGGER IF NOT EXISTS qa_data_ad AFTER DELETE ON qa_data BEGIN
-                                    INSERT INTO qa_fts(qa_fts, rowid, question, answer, category)
-                                    VALUES('delete', old.rowid, old.question, old.answer, old.category);
-                                END;
-                            """)
-
-                            # Trigger sync sau UPDATE
-                            await conn.execute("""
-                                CREATE TRIGGER IF NOT EXISTS qa_data_au AFTER UPDATE ON qa_data BEGIN
-                                    INSERT INTO qa_fts(qa_fts, rowid, question, answer, category)
-                                    VALUES('delete', old.rowid, old.question, old.answer, old.category);
-                                    INSERT INTO qa_fts(rowid, question, answer, category)
-                                    VALUES(new.rowid, new.question, new.answer, new.category);
-                                END;
-                            """)
+                            # Tạo virtual table FTS5 và trigger đồng bộ cho qa_data
+                            for statement in self.QA_FTS_SCHEMA:
+                                await conn.execute(statement)
 
                             # Migrate data cũ
-                            await conn.execute("""
-                                INSERT OR IGNORE INTO qa_fts(rowid, question, answer, category)
-                                SELECT rowid, question, answer, category FROM qa_data
-                                WHERE rowid NOT IN (SELECT rowid FROM qa_fts WHERE qa_fts != 'delete')
-                            """)
+                            await conn.execute(self.QA_FTS_BACKFILL)
 
-                            self.logger.info("Đã setup FTS5 cho qa_data với INTEGER rowid (full-text search)")
+                            self.logger.info("Đã setup FTS5 cho qa_data (bỏ dấu tiếng Việt, full-text search)")
 
                             # Tạo bảng chat_config
                             await conn.execute("""
@@ -381,7 +554,9 @@ class SQLiteHandler:
                                     "action": "TEXT",
                                     "timestamp": "INTEGER",
                                     "details": "TEXT",
-                                    "last_sync": "INTEGER"
+                                    "last_sync": "INTEGER",
+                                    "username": "TEXT",
+                                    "session_token": "TEXT"
                                 },
                                 "qa_data": {
                                     "rowid": "INTEGER",
@@ -438,6 +613,7 @@ class SQLiteHandler:
                                 )
 
                             await conn.commit()
+                            await self._apply_migrations(conn)
                             self.logger.info(
                                 "Khởi tạo SQLite thành công với các bảng và dữ liệu mặc định"
                             )
@@ -459,7 +635,42 @@ class SQLiteHandler:
             self.logger.error(f"Timeout khi khởi tạo SQLite: {str(e)}")
             raise DatabaseError(f"Timeout khi khởi tạo SQLite: {str(e)}")
 
-    
+    @staticmethod
+    async def _add_column_if_missing(conn, table: str, column: str, dtype: str) -> None:
+        async with conn.execute(f'PRAGMA table_info("{table}")') as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if column not in columns:
+            await conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {dtype}')
+
+    async def _apply_migrations(self, conn) -> int:
+        """Áp dụng các migration có version lớn hơn PRAGMA user_version hiện tại."""
+        async with conn.execute("PRAGMA user_version") as cursor:
+            current_version = (await cursor.fetchone())[0]
+        applied = 0
+        for version, description, steps in self.MIGRATIONS:
+            if version <= current_version:
+                continue
+            self.logger.info(f"Áp dụng migration SQLite v{version}: {description}")
+            try:
+                for step in steps:
+                    if callable(step):
+                        await step(conn)
+                    else:
+                        await conn.execute(step)
+                await conn.execute(f"PRAGMA user_version = {int(version)}")
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                self.logger.error(f"Lỗi migration SQLite v{version}: {str(e)}", exc_info=True)
+                raise DatabaseError(f"Lỗi migration v{version}: {str(e)}")
+            applied += 1
+        if applied:
+            await conn.execute("ANALYZE")
+            self.logger.info(f"Đã áp dụng {applied} migration, schema version hiện tại: {self.MIGRATIONS[-1][0]}")
+        await conn.execute("PRAGMA optimize")
+        await conn.commit()
+        return applied
+
     async def register_user(self, username: str, password: str, bot_password: Optional[str] = None) -> Dict:
         try:
             async with asyncio.timeout(60):  # Timeout 1 phút
@@ -470,7 +681,7 @@ class SQLiteHandler:
                 if bot_password and not validate_password_strength(bot_password):
                     return {"error": "Mật khẩu bot không đáp ứng yêu cầu bảo mật"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     async with conn.execute(
                         "SELECT COUNT(*) FROM users WHERE username = ?",
                         (username,)
@@ -568,13 +779,15 @@ class SQLiteHandler:
                         )
                     )
 
-                    await conn.commit()
                     self.logger.info(f"Đăng ký thành công cho {username}, session_token={session_token[:10]}...")
                     return {
                         "success": "Đăng ký thành công",
                         "session_token": session_token,
                         "role": role
                     }
+                result = await self.enqueue_write(write_op)
+                self.invalidate_role_cache(username)
+                return result
 
         except aiosqlite.IntegrityError as e:
             self.logger.error(f"Lỗi tính toàn vẹn khi đăng ký {username}: {str(e)}")
@@ -599,9 +812,13 @@ class SQLiteHandler:
         Raises:
             DatabaseError: Nếu xảy ra lỗi khi truy vấn cơ sở dữ liệu.
         """
+        cache_key = (username, session_token)
+        cached_state = self.session_cache.get(cache_key)
+        if cached_state is not None:
+            return copy.deepcopy(cached_state)
         try:
             async with asyncio.timeout(60):  # Timeout 1 phút
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     # Lấy trạng thái từ client_states
                     async with conn.execute(
                         "SELECT state, timestamp FROM client_states WHERE username = ? AND session_token = ?",
@@ -631,6 +848,7 @@ class SQLiteHandler:
                                     f"get_client_state: Tìm thấy trạng thái cho {username}, "
                                     f"session_token={session_token[:10]}..., authenticated={state['authenticated']}"
                                 )
+                                self.session_cache.set(cache_key, copy.deepcopy(state))
                                 return state
                             except json.JSONDecodeError as e:
                                 self.logger.error(
@@ -715,7 +933,10 @@ class SQLiteHandler:
                     self.logger.error(f"Kích thước trạng thái vượt quá 1MB cho {username}")
                     raise DatabaseError("Trạng thái phiên quá lớn")
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                self.invalidate_session_cache(username, session_token)
+
+                async def write_op(conn):
+                    nonlocal state, state_json
                     # Kiểm tra session hợp lệ
                     async with conn.execute(
                         "SELECT session_token, expires_at FROM sessions WHERE username = ? AND session_token = ?",
@@ -785,11 +1006,12 @@ class SQLiteHandler:
                                 }, ensure_ascii=False)
                             )
                         )
-                        await conn.commit()
                         self.logger.info(
                             f"Cập nhật trạng thái cho {username}, session_token={session_token[:10]}..., "
                             f"selected_tab={state.get('selected_tab')}"
                         )
+                await self.enqueue_write(write_op)
+                self.invalidate_session_cache(username, session_token)
 
         except json.JSONDecodeError as e:
             self.logger.error(f"Lỗi JSON khi lưu trạng thái cho {username}: {str(e)}")
@@ -839,7 +1061,7 @@ class SQLiteHandler:
         """
         try:
             async with asyncio.timeout(60):
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     state_id = hashlib.sha256(f"{username}_{session_token}".encode()).hexdigest()
                     await conn.execute(
                         "DELETE FROM client_states WHERE username = ? AND session_token = ?",
@@ -858,10 +1080,12 @@ class SQLiteHandler:
                                 json.dumps({"username": username, "action": "clear_client_state"})
                             )
                         )
-                    await conn.commit()
                     self.logger.info(
                         f"Đã xóa trạng thái cho {username}, session_token={session_token[:10]}..."
                     )
+                self.invalidate_session_cache(username, session_token)
+                await self.enqueue_write(write_op)
+                self.invalidate_session_cache(username, session_token)
         except asyncio.TimeoutError as e:
             self.logger.error(f"Timeout khi xóa trạng thái cho {username}: {str(e)}")
             raise DatabaseError(f"Timeout khi xóa trạng thái: {str(e)}")
@@ -881,6 +1105,15 @@ class SQLiteHandler:
             raise DatabaseError(f"Lỗi kiểm tra trạng thái khóa: {str(e)}")
 
     
+    def invalidate_session_cache(self, username: Optional[str] = None, session_token: Optional[str] = None) -> None:
+        """Xóa trạng thái phiên khỏi cache: một phiên, mọi phiên của user, hoặc toàn bộ."""
+        if username is None:
+            self.session_cache.clear()
+        elif session_token is None:
+            self.session_cache.invalidate_where(lambda key: key[0] == username)
+        else:
+            self.session_cache.invalidate((username, session_token))
+
     async def get_collection_schema(self, collection_name: str) -> Dict:
         """Lấy schema của một collection từ SQLite."""
         try:
@@ -888,7 +1121,7 @@ class SQLiteHandler:
                 if not validate_name(collection_name):
                     return {"error": "Tên collection không hợp lệ"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     # Kiểm tra xem bảng có tồn tại
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
@@ -921,6 +1154,79 @@ class SQLiteHandler:
             self.logger.error(f"Lỗi lấy schema cho {collection_name}: {str(e)}")
             return {"error": f"Lỗi lấy schema: {str(e)}"}
 
+    async def get_user_role(self, username: str) -> Optional[str]:
+        """Lấy role của người dùng, ưu tiên cache trong bộ nhớ."""
+        role = self.role_cache.get(username)
+        if role is not None:
+            return role
+        async with self.core.db_pool.reader() as conn:
+            async with conn.execute(
+                "SELECT role FROM users WHERE username = ?",
+                (username,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        if not row:
+            return None
+        self.role_cache.set(username, row[0])
+        return row[0]
+
+    def invalidate_role_cache(self, username: Optional[str] = None) -> None:
+        """Xóa role khỏi cache khi bảng users thay đổi."""
+        if username is None:
+            self.role_cache.clear()
+        else:
+            self.role_cache.invalidate(username)
+
+    def invalidate_qa_answer_cache(self, username: Optional[str] = None) -> None:
+        """Xóa cache câu trả lời QA của một user (hoặc tất cả) khi qa_data thay đổi."""
+        self.qa_generation += 1
+        if username is None:
+            self.qa_answer_cache.clear()
+        else:
+            self.qa_answer_cache.invalidate_where(lambda key: key[0] == username)
+
+    async def refresh_qa_index(self, record_ids: List[str], username: Optional[str] = None) -> None:
+        """Cập nhật tăng dần chỉ mục QA theo trạng thái hiện tại của các bản ghi qa_data.
+
+        Cache câu trả lời QA của username (người thực hiện thay đổi) cũng bị xóa.
+        """
+        if not record_ids:
+            return
+        self.invalidate_qa_answer_cache(username)
+        vector_store = self.core.vector_store
+        if not self.qa_index.has_loaded() and not vector_store.enabled:
+            return
+        try:
+            found = {}
+            async with self.core.db_pool.reader() as conn:
+                for start in range(0, len(record_ids), 500):
+                    chunk = list(record_ids[start:start + 500])
+                    placeholders = ", ".join("?" for _ in chunk)
+                    async with conn.execute(
+                        f"SELECT {', '.join(QA_INDEX_FIELDS)} FROM qa_data WHERE id IN ({placeholders})",
+                        chunk
+                    ) as cursor:
+                        for row in await cursor.fetchall():
+                            record = dict(zip(QA_INDEX_FIELDS, row))
+                            self.qa_index.upsert(record)
+                            found[row[0]] = record
+                            if row[4] != username:
+                                self.invalidate_qa_answer_cache(row[4])
+            removed_ids = [record_id for record_id in record_ids if record_id not in found]
+            for record_id in removed_ids:
+                self.qa_index.remove(record_id)
+            # Embedding chạy nền: hàm này có thể được gọi khi đang giữ kết nối ghi
+            vector_store.schedule_refresh(list(found.values()), removed_ids)
+        except Exception as e:
+            self.logger.warning(f"Lỗi cập nhật chỉ mục QA, dựng lại ở lần dùng sau: {str(e)}")
+            self.reset_qa_indexes()
+
+    def reset_qa_indexes(self, username: Optional[str] = None) -> None:
+        """Bỏ toàn bộ chỉ mục/cache QA trong bộ nhớ khi qa_data thay đổi hàng loạt."""
+        self.qa_index.invalidate(username)
+        self.core.vector_store.invalidate(username)
+        self.invalidate_qa_answer_cache(username)
+
     async def has_permission(self, username: str, action: str) -> bool:
         """Kiểm tra quyền của người dùng."""
         if not validate_name(action):
@@ -929,27 +1235,17 @@ class SQLiteHandler:
 
         try:
             async with asyncio.timeout(30):  # Timeout 30 giây
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
-                    async with conn.execute(
-                        "SELECT role FROM users WHERE username = ?",
-                        (username,)
-                    ) as cursor:
-                        row = await cursor.fetchone()
-                        if not row:
-                            self.logger.warning(f"Không tìm thấy người dùng {username}")
-                            return False
-
-                        role = row[0]
-                        # Admin có mọi quyền
-                        if role == "admin":
-                            return True
-
-                        # Quyền cụ thể cho các vai trò khác
-                        allowed_actions = {
-                            "user": ["chat_access", "read_records"],
-                            # Thêm các vai trò và quyền khác nếu cần
-                        }
-                        return action in allowed_actions.get(role, [])
+                role = await self.get_user_role(username)
+                if role is None:
+                    self.logger.warning(f"Không tìm thấy người dùng {username}")
+                    return False
+
+                # Admin có mọi quyền
+                if role == "admin":
+                    return True
+
+                # Quyền cụ thể cho các vai trò khác
+                return action in self.ROLE_PERMISSIONS.get(role, frozenset())
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"Timeout khi kiểm tra quyền cho {username}: {str(e)}")
@@ -973,8 +1269,8 @@ class SQLiteHandler:
                     self.logger.error(f"{username}: Không thể tạo collection được bảo vệ: {collection_name}")
                     return {"error": f"Không thể tạo collection được bảo vệ: {collection_name}"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
-                    # Kiểm tra xem bảng đã tồn tại
+                # Kiểm tra xem bảng đã tồn tại
+                async with self.core.db_pool.reader() as conn:
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
                         (collection_name,)
@@ -982,21 +1278,33 @@ class SQLiteHandler:
                         if await cursor.fetchone():
                             return {"error": f"Collection {collection_name} đã tồn tại"}
 
-                    # Tạo danh sách cột và schema
-                    columns = ["id TEXT PRIMARY KEY", "timestamp INTEGER NOT NULL"]
-                    schema_fields = {"id": "TEXT", "timestamp": "INTEGER"}
-                    valid_dtypes = ["TEXT", "INTEGER", "REAL", "BLOB"]
-                    for field, info in fields.items():
-                        if field in ["id", "timestamp"]:
-                            self.logger.debug(f"{username}: Bỏ qua field {field} trong schema")
-                            continue
-                        dtype = info.get("type", "TEXT").upper() if isinstance(info, dict) else str(info).upper()
-                        if dtype not in valid_dtypes:
-                            self.logger.warning(f"{username}: Kiểu dữ liệu không hợp lệ cho {field}: {dtype}, mặc định là TEXT")
-                            dtype = "TEXT"
-                        columns.append(f'"{field}" {dtype}')
-                        schema_fields[field] = dtype
+                # Tạo danh sách cột và schema
+                columns = ["id TEXT PRIMARY KEY", "timestamp INTEGER NOT NULL"]
+                schema_fields = {"id": "TEXT", "timestamp": "INTEGER"}
+                valid_dtypes = ["TEXT", "INTEGER", "REAL", "BLOB"]
+                for field, info in fields.items():
+                    if field in ["id", "timestamp"]:
+                        self.logger.debug(f"{username}: Bỏ qua field {field} trong schema")
+                        continue
+                    dtype = info.get("type", "TEXT").upper() if isinstance(info, dict) else str(info).upper()
+                    if dtype not in valid_dtypes:
+                        self.logger.warning(f"{username}: Kiểu dữ liệu không hợp lệ cho {field}: {dtype}, mặc định là TEXT")
+                        dtype = "TEXT"
+                    columns.append(f'"{field}" {dtype}')
+                    schema_fields[field] = dtype
+
+                details = {
+                    "username": username,
+                    "action": "create_collection",
+                    "fields": schema_fields
+                }
+                try:
+                    details_json = json.dumps(details, ensure_ascii=False)
+                except TypeError as e:
+                    self.logger.error(f"{username}: Lỗi mã hóa JSON cho sync_log: {str(e)}")
+                    details_json = json.dumps({"error": "Không thể mã hóa details"}, ensure_ascii=False)
 
+                async def write_op(conn):
                     # Tạo bảng
                     columns_sql = ", ".join(columns)
                     await conn.execute(f'CREATE TABLE "{collection_name}" ({columns_sql})')
@@ -1015,18 +1323,6 @@ class SQLiteHandler:
                     )
 
                     # Ghi log
-                    current_time = int(time.time())
-                    details = {
-                        "username": username,
-                        "action": "create_collection",
-                        "fields": schema_fields
-                    }
-                    try:
-                        details_json = json.dumps(details, ensure_ascii=False)
-                    except TypeError as e:
-                        self.logger.error(f"{username}: Lỗi mã hóa JSON cho sync_log: {str(e)}")
-                        details_json = json.dumps({"error": "Không thể mã hóa details"}, ensure_ascii=False)
-
                     await conn.execute(
                         "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
                         "VALUES (?, ?, ?, ?, ?, ?)",
@@ -1035,14 +1331,14 @@ class SQLiteHandler:
                             collection_name,
                             None,
                             "CREATE_TABLE",
-                            current_time,
+                            int(time.time()),
                             details_json
                         )
                     )
-                    await conn.commit()
 
-                    self.logger.info(f"{username}: Tạo collection {collection_name} với fields {schema_fields}")
-                    return {"success": f"Đã tạo collection {collection_name}"}
+                await self.enqueue_write(write_op)
+                self.logger.info(f"{username}: Tạo collection {collection_name} với fields {schema_fields}")
+                return {"success": f"Đã tạo collection {collection_name}"}
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout khi tạo collection {collection_name}: {str(e)}")
@@ -1065,8 +1361,8 @@ class SQLiteHandler:
                 if not validate_name(collection_name):
                     return {"error": "Tên collection không hợp lệ"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
-                    # Kiểm tra xem bảng có tồn tại
+                # Kiểm tra xem bảng có tồn tại
+                async with self.core.db_pool.reader() as conn:
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
                         (collection_name,)
@@ -1074,8 +1370,11 @@ class SQLiteHandler:
                         if not await cursor.fetchone():
                             return {"error": f"Collection {collection_name} không tồn tại"}
 
+                async def write_op(conn):
                     # Xóa bảng
                     await conn.execute(f'DROP TABLE "{collection_name}"')
+                    if collection_name == "qa_data":
+                        await conn.execute("DELETE FROM qa_embeddings")
 
                     # Xóa lược đồ trong collection_schemas
                     await conn.execute(
@@ -1084,7 +1383,6 @@ class SQLiteHandler:
                     )
 
                     # Ghi log đồng bộ
-                    current_time = int(time.time())
                     await conn.execute(
                         "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
                         "VALUES (?, ?, ?, ?, ?, ?)",
@@ -1093,23 +1391,26 @@ class SQLiteHandler:
                             collection_name,
                             None,
                             "DROP_TABLE",
-                            current_time,
+                            int(time.time()),
                             json.dumps({"username": username, "action": "drop_collection"})
                         )
                     )
-                    await conn.commit()
-                    self.logger.info(f"{username}: Đã xóa collection {collection_name}")
 
-                    # Xóa collection trên Firestore nếu khả dụng
-                    if self.core.firestore_handler.firestore_available:
-                        collection_ref = self.core.firestore_handler.db.collection(collection_name)
-                        async for doc in collection_ref.stream():
-                            await doc.reference.delete()
-                        self.logger.info(f"{username}: Đã xóa tất cả bản ghi trong collection {collection_name} trên Firestore")
-                        sync_result = await self.core.firestore_handler.sync_from_sqlite(batch_size=1)
-                        self.logger.info(f"{username}: Kết quả đồng bộ Firestore sau khi xóa collection: {sync_result}")
+                await self.enqueue_write(write_op)
+                if collection_name == "qa_data":
+                    self.reset_qa_indexes()
+                self.logger.info(f"{username}: Đã xóa collection {collection_name}")
 
-                    return {"success": f"Đã xóa collection {collection_name}"}
+                # Xóa collection trên Firestore nếu khả dụng
+                if self.core.firestore_handler.firestore_available:
+                    collection_ref = self.core.firestore_handler.db.collection(collection_name)
+                    async for doc in collection_ref.stream():
+                        await doc.reference.delete()
+                    self.logger.info(f"{username}: Đã xóa tất cả bản ghi trong collection {collection_name} trên Firestore")
+                    sync_result = await self.core.firestore_handler.sync_from_sqlite(batch_size=1)
+                    self.logger.info(f"{username}: Kết quả đồng bộ Firestore sau khi xóa collection: {sync_result}")
+
+                return {"success": f"Đã xóa collection {collection_name}"}
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout khi xóa collection {collection_name}: {str(e)}")
@@ -1132,7 +1433,10 @@ class SQLiteHandler:
                     self.logger.error(f"{username}: Không thể xóa bản ghi trong collection được bảo vệ: {collection_name}")
                     return {"error": f"Không thể xóa bản ghi trong collection được bảo vệ: {collection_name}"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                deleted_ids = []
+
+                async def write_op(conn):
+                    nonlocal deleted_ids
                     # Kiểm tra bảng có tồn tại
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
@@ -1164,6 +1468,7 @@ class SQLiteHandler:
                     await conn.execute(
                         f'DELETE FROM "{collection_name}" WHERE {where_sql}', params
                     )
+                    deleted_ids = record_ids
 
                     # Ghi log cho từng bản ghi bị xóa
                     current_time = int(time.time())
@@ -1194,11 +1499,13 @@ class SQLiteHandler:
                             )
                         )
 
-                    await conn.commit()
-
                     deleted_count = len(record_ids)
                     self.logger.info(f"{username}: Đã xóa {deleted_count} bản ghi từ {collection_name}")
                     return {"success": f"Đã xóa {deleted_count} bản ghi từ {collection_name}", "deleted_count": deleted_count}
+                result = await self.enqueue_write(write_op)
+                if collection_name == "qa_data":
+                    await self.refresh_qa_index(deleted_ids, username)
+                return result
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout khi xóa bản ghi trong {collection_name}: {str(e)}")
@@ -1216,7 +1523,7 @@ class SQLiteHandler:
                     self.logger.error(f"{username}: Tên collection không hợp lệ: {collection_name}")
                     return {"error": "Tên collection không hợp lệ"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     # Kiểm tra xem bảng có tồn tại
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
@@ -1281,7 +1588,7 @@ class SQLiteHandler:
                 if not validate_name(collection_name):
                     return {"error": "Tên collection không hợp lệ"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     # Kiểm tra xem bảng có tồn tại
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
@@ -1361,9 +1668,12 @@ class SQLiteHandler:
                             json.dumps({"username": username, "action": "update_record"}, ensure_ascii=False)
                         )
                     )
-                    await conn.commit()
                     self.logger.info(f"{username}: Đã cập nhật bản ghi {record_id} trong {collection_name}")
                     return {"success": f"Đã cập nhật bản ghi {record_id} trong {collection_name}", "message": "Cập nhật thành công"}
+                result = await self.enqueue_write(write_op)
+                if collection_name == "qa_data" and "success" in result:
+                    await self.refresh_qa_index([record_id], username)
+                return result
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout khi cập nhật bản ghi {record_id} trong {collection_name}: {str(e)}")
@@ -1385,7 +1695,7 @@ class SQLiteHandler:
                 if not validate_name(collection_name):
                     return {"error": "Tên collection không hợp lệ"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     # Kiểm tra xem bảng có tồn tại
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
@@ -1423,9 +1733,12 @@ class SQLiteHandler:
                             json.dumps({"username": username, "action": "delete_record"}, ensure_ascii=False)
                         )
                     )
-                    await conn.commit()
                     self.logger.info(f"{username}: Đã xóa bản ghi {record_id} trong {collection_name}")
                     return {"success": f"Đã xóa bản ghi {record_id} trong {collection_name}"}
+                result = await self.enqueue_write(write_op)
+                if collection_name == "qa_data" and "success" in result:
+                    await self.refresh_qa_index([record_id], username)
+                return result
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout khi xóa bản ghi {record_id} trong {collection_name}: {str(e)}")
@@ -1445,7 +1758,7 @@ class SQLiteHandler:
                     return {"error": "Mật khẩu không đáp ứng yêu cầu bảo mật"}
 
                 # Connect to SQLite database
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     # Fetch user data
                     async with conn.execute(
                         "SELECT id, password, bot_password, role FROM users WHERE username = ?",
@@ -1522,7 +1835,6 @@ class SQLiteHandler:
                                     json.dumps({"username": username, "action": "update_client_state"})
                                 )
                             )
-                            await conn.commit()
                             self.logger.info(f"Đã cập nhật session và client_state cho {username}, session_token={session_token}")
                             return {
                                 "success": "Đăng nhập thành công",
@@ -1601,13 +1913,15 @@ class SQLiteHandler:
                             json.dumps({"username": username, "action": "create_client_state"})
                         )
                     )
-                    await conn.commit()
                     self.logger.info(f"Xác thực thành công, tạo session mới cho {username}: {session_token}")
                     return {
                         "success": "Đăng nhập thành công",
                         "session_token": session_token,
                         "role": role
                     }
+                result = await self.enqueue_write(write_op)
+                self.invalidate_session_cache(username)
+                return result
 
         except json.JSONDecodeError as e:
             self.logger.error(f"Lỗi JSON khi xác thực cho {username}: {str(e)}")
@@ -1625,7 +1939,7 @@ class SQLiteHandler:
         """Tìm kiếm Q&A trong bảng được chỉ định dựa trên từ khóa trong question hoặc answer."""
         try:
             async with asyncio.timeout(60):  # Timeout 1 phút
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     # Nếu không chỉ định collection, lấy tất cả bảng không được bảo vệ
                     tables = [collection] if collection else [
                         row[0] async for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -1671,7 +1985,7 @@ class SQLiteHandler:
                     self.logger.error(f"Database file {Config.SQLITE_DB_PATH} does not exist")
                     return {"error": "Database file not found", "collections": [], "total": 0}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     # Kiểm tra bảng collection_schemas
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name='collection_schemas'"
@@ -1733,9 +2047,8 @@ class SQLiteHandler:
                     self.logger.error(f"{username}: Dữ liệu quá lớn (vượt quá 1MB) trong {collection_name}")
                     return {"error": "Dữ liệu quá lớn (vượt quá 1MB)"}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
-                    await conn.execute("PRAGMA busy_timeout = 30000")
-
+                async def write_op(conn):
+                    nonlocal data
                     # Kiểm tra và tạo bảng nếu chưa tồn tại
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table' AND name = ?",
@@ -1793,9 +2106,12 @@ class SQLiteHandler:
                             json.dumps({"username": username, "action": "create_record"}, ensure_ascii=False),
                         ),
                     )
-                    await conn.commit()
                     self.logger.info(f"{username}: Đã tạo bản ghi {record_id} trong {collection_name}")
                     return {"success": f"Đã tạo bản ghi trong {collection_name}", "id": record_id}
+                result = await self.enqueue_write(write_op)
+                if collection_name == "qa_data" and "id" in result:
+                    await self.refresh_qa_index([result["id"]], username)
+                return result
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout khi tạo bản ghi trong {collection_name}: {str(e)}")
@@ -1811,42 +2127,120 @@ class SQLiteHandler:
     async def start(self):
         if not self.running:
             self.running = True
-            asyncio.create_task(self._worker())
+            self.worker_task = asyncio.create_task(self._worker())
 
     async def _worker(self):
+        """Worker ghi gộp (group commit): gom các thao tác đang chờ, chạy trong một giao dịch và commit một lần."""
+        loop = asyncio.get_running_loop()
         while self.running:
             try:
-                coro, future = await self.write_queue.get()
+                batch = [await self.write_queue.get()]
+                deadline = loop.time() + Config.SQLITE_WRITE_MAX_LATENCY
+                while len(batch) < Config.SQLITE_WRITE_BATCH_SIZE:
+                    try:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            batch.append(self.write_queue.get_nowait())
+                        else:
+                            batch.append(await asyncio.wait_for(self.write_queue.get(), remaining))
+                    except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                        break
                 try:
-                    result = await coro()
-                    if not future.done():
-                        future.set_result(result)
-                except Exception as e:
-                    if not future.done():
-                        future.set_exception(e)
-                    self.logger.error(f"Lỗi trong worker: {e}")
+                    await self._commit_group(batch)
                 finally:
-                    self.write_queue.task_done()
+                    for _ in batch:
+                        self.write_queue.task_done()
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 self.logger.error(f"Lỗi ngoài worker: {e}")
 
-    async def enqueue_write(self, coro: Callable[[], Any], timeout: int = 120) -> Any:
+    async def _commit_group(self, batch: List) -> None:
+        """Chạy một nhóm thao tác ghi trên kết nối ghi, mỗi thao tác trong một SAVEPOINT riêng."""
+        outcomes = []
+        try:
+            async with self.core.db_pool.writer() as conn:
+                if not conn.in_transaction:
+                    await conn.execute("BEGIN IMMEDIATE")
+                for op, future in batch:
+                    if future.done():
+                        continue
+                    self._started_writes.add(future)
+                    await conn.execute("SAVEPOINT write_op")
+                    try:
+                        result = await op(conn)
+                        await conn.execute("RELEASE SAVEPOINT write_op")
+                        outcomes.append((future, result, None))
+                    except Exception as e:
+                        # Chỉ hoàn tác thao tác lỗi, các thao tác khác trong nhóm vẫn được commit
+                        await conn.execute("ROLLBACK TO SAVEPOINT write_op")
+                        await conn.execute("RELEASE SAVEPOINT write_op")
+                        self.logger.error(f"Lỗi trong worker: {e}")
+                        outcomes.append((future, None, e))
+                await conn.commit()
+        except Exception as e:
+            self.logger.error(f"Lỗi commit nhóm {len(batch)} thao tác ghi: {str(e)}", exc_info=True)
+            error = DatabaseError(f"Lỗi commit nhóm thao tác ghi: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        finally:
+            for _, future in batch:
+                self._started_writes.discard(future)
+
+        self.logger.debug(f"Commit nhóm {len(outcomes)} thao tác ghi")
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def enqueue_write(self, op: Callable[[Any], Any], timeout: int = 120) -> Any:
+        """Đưa thao tác ghi vào hàng đợi group commit.
+
+        `op` nhận kết nối ghi và chỉ thực thi câu lệnh, không tự commit/rollback.
+        Khi hết thời gian chờ (hoặc người gọi bị hủy), thao tác chưa chạy được hủy
+        để worker bỏ qua; thao tác worker đã bắt đầu vẫn có thể được commit.
+        """
+        if not self.running:
+            await self.start()
         future = asyncio.get_running_loop().create_future()
-        await self.write_queue.put((coro, future))
+        await self.write_queue.put((op, future))
         try:
-            return await asyncio.wait_for(future, timeout)
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
         except asyncio.TimeoutError:
-            self.logger.error("Timeout khi chờ kết quả từ worker")
-            raise DatabaseError("Hết thời gian khi chờ kết quả từ worker")
+            if future not in self._started_writes and future.cancel():
+                self.logger.error("Timeout khi chờ worker, đã hủy thao tác ghi chưa chạy")
+                raise DatabaseError("Hết thời gian khi chờ worker, thao tác ghi chưa được thực hiện")
+            self.logger.error("Timeout khi chờ kết quả từ worker, thao tác ghi đang chạy")
+            raise DatabaseError(
+                "Hết thời gian khi chờ kết quả từ worker, thao tác ghi có thể vẫn được áp dụng"
+            )
+        except asyncio.CancelledError:
+            if future not in self._started_writes:
+                future.cancel()
+            raise
 
     async def stop(self):
         self.logger.debug("Dừng worker hàng đợi")
+        if self.running:
+            try:
+                # Chờ các thao tác ghi đang chờ được commit
+                await asyncio.wait_for(self.write_queue.join(), 10)
+            except asyncio.TimeoutError:
+                self.logger.warning("Timeout khi chờ hàng đợi ghi hoàn tất")
         self.running = False
+        if self.worker_task:
+            self.worker_task.cancel()
+            self.worker_task = None
         while not self.write_queue.empty():
             try:
-                await self.write_queue.get()
+                _, future = self.write_queue.get_nowait()
+                if not future.done():
+                    future.set_exception(DatabaseError("Worker ghi đã dừng"))
                 self.write_queue.task_done()
             except:
                 pass
@@ -1858,7 +2252,15 @@ class FirestoreHandler:
         self.logger = logger
         self.core = core
         self.db: Optional[AsyncClient] = None
+        # Client đồng bộ chỉ dùng cho on_snapshot (AsyncClient không hỗ trợ listener)
+        self.watch_db = None
         self.firestore_available = False
+        # Trạng thái sức khỏe Firestore do health monitor cập nhật
+        self.last_latency_ms: Optional[float] = None
+        self.last_probe_at: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        self.health_task: Optional[asyncio.Task] = None
         self._initialize_firestore()
 
     def _serialize_value(self, value):
@@ -1952,19 +2354,181 @@ class FirestoreHandler:
 
     
 
-    async def sync_firestore_batch(self, batch, username: str) -> int:
-        """Đồng bộ một batch bản ghi lên Firestore."""
+    async def probe_health(self) -> bool:
+        """Đọc một tài liệu ping để đo độ trễ Firestore (không ghi, không xóa)."""
+        if not self.db:
+            self.firestore_available = False
+            return False
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(Config.FIRESTORE_HEALTH_TIMEOUT):
+                await self.db.collection(Config.FIRESTORE_HEALTH_COLLECTION).document("ping").get()
+            self.last_latency_ms = round((time.perf_counter() - start) * 1000, 2)
+            self.last_error = None
+            self.consecutive_failures = 0
+            if not self.firestore_available:
+                self.logger.info(f"Firestore khả dụng trở lại, độ trễ {self.last_latency_ms} ms")
+            self.firestore_available = True
+        except Exception as e:
+            self.last_latency_ms = None
+            self.last_error = str(e)
+            self.consecutive_failures += 1
+            if self.firestore_available:
+                self.logger.warning(f"Firestore không khả dụng: {str(e)}")
+            self.firestore_available = False
+        finally:
+            self.last_probe_at = int(time.time())
+        return self.firestore_available
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.probe_health()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Lỗi trong health monitor Firestore: {str(e)}")
+            # Backoff lũy thừa khi probe thất bại liên tiếp
+            delay = Config.FIRESTORE_HEALTH_INTERVAL
+            if self.consecutive_failures:
+                delay = min(
+                    Config.FIRESTORE_HEALTH_INTERVAL * (2 ** (self.consecutive_failures - 1)),
+                    Config.FIRESTORE_HEALTH_MAX_BACKOFF
+                )
+            await asyncio.sleep(delay)
+
+    def start_health_monitor(self) -> None:
+        """Chạy health monitor nền nếu Firestore đã được khởi tạo."""
+        if self.db is None or (self.health_task and not self.health_task.done()):
+            return
+        self.health_task = asyncio.create_task(self._health_loop())
+        self.logger.info("Khởi động health monitor Firestore")
+
+    async def stop_health_monitor(self) -> None:
+        if self.health_task:
+            self.health_task.cancel()
+            try:
+                await self.health_task
+            except asyncio.CancelledError:
+                pass
+            self.health_task = None
+
+    def get_health(self) -> Dict:
+        """Trạng thái sức khỏe Firestore hiện tại (không gọi mạng)."""
+        return {
+            "firestore_available": self.firestore_available,
+            "last_latency_ms": self.last_latency_ms,
+            "last_probe_at": self.last_probe_at,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures
+        }
+
+    async def sync_firestore_batch(self, batch, username: str, writer: FirestoreBatchWriter) -> int:
+        """Xếp một batch bản ghi vào WriteBatch của writer.
+
+        Bản ghi có hash nội dung trùng hash đã đẩy trong sync_manifest được bỏ
+        qua, không cần đọc Firestore. Hash được đọc bằng một lần mượn kết nối
+        ngắn; kết nối được trả trước khi writer.set có thể chờ commit. Trả về số
+        bản ghi được xếp hàng ghi.
+        """
+        async with self.core.db_pool.reader() as conn:
+            pushed = await self._load_manifest_hashes(conn, [(table, doc_id) for table, doc_id, _ in batch])
         count = 0
         for collection_id, doc_id, doc_data in batch:
-            doc_ref = self.db.collection(collection_id).document(doc_id)
-            existing_doc = await doc_ref.get()
-            if existing_doc.exists and existing_doc.to_dict() == doc_data:
+            digest = content_hash(doc_data)
+            if pushed.get((collection_id, doc_id)) == digest:
                 continue
-            await doc_ref.set(doc_data, merge=True)
-            self.logger.debug(f"{username}: Đồng bộ bản ghi {doc_id} trong {collection_id}")
+            # Phiên bản do server Firestore gán, làm mốc kéo delta cho các node khác
+            versioned = {**doc_data, Config.SYNC_VERSION_FIELD: SERVER_TIMESTAMP}
+            await writer.set(collection_id, doc_id, versioned, merge=True, tag=(collection_id, doc_id, digest))
+            self.logger.debug(f"{username}: Xếp hàng đồng bộ bản ghi {doc_id} trong {collection_id}")
             count += 1
         return count
 
+    async def _load_manifest_hashes(self, conn, keys: List[tuple], both_sides: bool = False) -> Dict[tuple, Any]:
+        """Hash đã đẩy lên Firestore của các (table, doc_id) theo sync_manifest.
+
+        Với both_sides=True, trả về tuple (hash phía local, hash phía Firestore).
+        """
+        by_table: Dict[str, List[str]] = {}
+        for table, doc_id in keys:
+            by_table.setdefault(table, []).append(doc_id)
+        hashes = {}
+        for table, doc_ids in by_table.items():
+            for start in range(0, len(doc_ids), 500):
+                chunk = doc_ids[start:start + 500]
+                async with conn.execute(
+                    f"SELECT doc_id, local_hash, remote_hash FROM sync_manifest "
+                    f"WHERE table_name = ? AND doc_id IN ({', '.join('?' for _ in chunk)})",
+                    (table, *chunk)
+                ) as cursor:
+                    for doc_id, local_hash, remote_hash in await cursor.fetchall():
+                        hashes[(table, doc_id)] = (local_hash, remote_hash) if both_sides else local_hash
+        return hashes
+
+    async def _record_manifest(self, conn, committed: List[tuple]) -> None:
+        """Ghi kết quả commit (table, doc_id, hash; hash None = đã xóa) vào sync_manifest.
+
+        Sau commit, Firestore giữ đúng nội dung local nên hai hash bằng nhau.
+        """
+        now = int(time.time())
+        upserts = [(table, doc_id, digest, digest, now) for table, doc_id, digest in committed if digest is not None]
+        deletes = [(table, doc_id) for table, doc_id, digest in committed if digest is None]
+        if upserts:
+            await conn.executemany(
+                """
+                INSERT INTO sync_manifest (table_name, doc_id, local_hash, remote_hash, pushed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (table_name, doc_id) DO UPDATE SET
+                    local_hash = excluded.local_hash,
+                    remote_hash = excluded.remote_hash,
+                    pushed_at = excluded.pushed_at
+                """,
+                upserts
+            )
+        if deletes:
+            await conn.executemany(
+                "DELETE FROM sync_manifest WHERE table_name = ? AND doc_id = ?",
+                deletes
+            )
+
+    async def _record_pulled(self, conn, pulled: List[tuple], unchanged: List[tuple] = ()) -> None:
+        """Ghi các bản ghi (table, doc_id, hash, phiên bản server) vừa kéo về SQLite.
+
+        unchanged gồm (table, doc_id, phiên bản) của tài liệu trùng hash: chỉ nâng
+        remote_version để mốc kéo delta lần sau tiến lên.
+        """
+        if unchanged:
+            await conn.executemany(
+                """
+                UPDATE sync_manifest SET remote_version = ?
+                WHERE table_name = ? AND doc_id = ? AND (remote_version IS NULL OR remote_version < ?)
+                """,
+                [
+                    (version, table, doc_id, version)
+                    for table, doc_id, version in unchanged
+                    if isinstance(version, int)
+                ]
+            )
+        if not pulled:
+            return
+        now = int(time.time())
+        await conn.executemany(
+            """
+            INSERT INTO sync_manifest (table_name, doc_id, local_hash, remote_hash, remote_version, pulled_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (table_name, doc_id) DO UPDATE SET
+                local_hash = excluded.local_hash,
+                remote_hash = excluded.remote_hash,
+                remote_version = excluded.remote_version,
+                pulled_at = excluded.pulled_at
+            """,
+            [
+                (table, doc_id, digest, digest, version if isinstance(version, int) else None, now)
+                for table, doc_id, digest, version in pulled
+            ]
+        )
+
     
 
     
@@ -1972,13 +2536,381 @@ class FirestoreHandler:
     
     
     
+    @staticmethod
+    def _version_of(value: Any) -> Optional[int]:
+        """Phiên bản server (micro giây) từ trường SYNC_VERSION_FIELD của tài liệu, None nếu thiếu."""
+        if isinstance(value, datetime.datetime):
+            return int(value.timestamp() * 1_000_000)
+        return None
+
+    @staticmethod
+    def _version_cursor(version: int) -> datetime.datetime:
+        """Giá trị so sánh Firestore của một phiên bản (micro giây)."""
+        return datetime.datetime.fromtimestamp(version / 1_000_000, tz=datetime.timezone.utc)
+
+    def _build_pull_query(
+        self,
+        collection_name: str,
+        username: str,
+        owner_field: Optional[str],
+        watermark: Optional[int],
+        is_empty: bool
+    ):
+        """Tạo truy vấn kéo một collection, có thứ tự ổn định để phân trang bằng start_after.
+
+        Kéo delta dựa trên SYNC_VERSION_FIELD do server Firestore gán mỗi lần đẩy,
+        không dựa trên timestamp của bản ghi: node offline đẩy bản ghi cũ vẫn nhận
+        phiên bản mới. Bảng đặc biệt/bảo vệ (ghi cả ngoài luồng đẩy) và lần kéo
+        chưa có mốc luôn kéo toàn bộ theo tên tài liệu; tài liệu trùng hash được
+        bỏ qua khi ghi.
+
+        Collection theo user (USER_SCOPED_COLLECTIONS) luôn lọc owner phía server,
+        nên truy vấn delta cần composite index (owner_field ASC, sync_version ASC):
+        chat_messages(username, sync_version) và qa_data(created_by, sync_version).
+
+        Trả về (truy vấn, trường sắp xếp: SYNC_VERSION_FIELD hoặc "__name__").
+        """
+        query = self.db.collection(collection_name)
+        if owner_field:
+            query = query.where(filter=FieldFilter(owner_field, "==", username))
+        if (
+            watermark is None
+            or is_empty
+            or collection_name in Config.SPECIAL_TABLES
+            or collection_name in Config.PROTECTED_TABLES
+        ):
+            return query.order_by("__name__"), "__name__"
+        # Lùi SYNC_WATERMARK_SLACK để không sót commit hiển thị muộn
+        since = self._version_cursor(watermark - Config.SYNC_WATERMARK_SLACK * 1_000_000)
+        return query.where(
+            filter=FieldFilter(Config.SYNC_VERSION_FIELD, ">=", since)
+        ).order_by(Config.SYNC_VERSION_FIELD), Config.SYNC_VERSION_FIELD
+
+    async def _count_pull_query(self, query, collection_name: str, username: str) -> Optional[int]:
+        """Đếm số tài liệu của truy vấn bằng aggregation count(), None nếu không đếm được."""
+        try:
+            result = await query.count().get()
+            return int(result[0][0].value)
+        except Exception as e:
+            self.logger.debug(f"{username}: Không đếm được {collection_name} bằng count(): {str(e)}")
+            return None
+
+    async def _convert_pulled_doc(
+        self,
+        doc,
+        collection_name: str,
+        merged_schema: Dict[str, str],
+        owner_field: Optional[str],
+        username: str
+    ) -> Optional[tuple]:
+        """Chuyển tài liệu Firestore thành (columns, values, id, hash, phiên bản server)."""
+        doc_data = doc.to_dict()
+        if not isinstance(doc_data, dict):
+            return None
+        if owner_field and doc_data.get(owner_field) != username:
+            return None
+        doc_data["id"] = doc.id
+        doc_data["timestamp"] = doc_data.get("timestamp", int(time.time()))
+        valid_fields = [k for k in doc_data if k in merged_schema]
+        if not valid_fields:
+            return None
+        columns = [f'"{sanitize_field_name(k)}"' for k in valid_fields]
+        values = [self._serialize_value(doc_data[k]) for k in valid_fields]
+        digest = content_hash({
+            sanitize_field_name(k): value
+            for k, value in zip(valid_fields, values)
+            if value is not None
+        })
+
+        # Tải file nếu có
+        if collection_name == "chat_messages" and "file_url" in doc_data:
+            file_id = doc_data["file_url"].split("/")[-1]
+            file_path = os.path.join(Config.CHAT_FILE_STORAGE_PATH, file_id)
+            if not os.path.exists(file_path):
+                try:
+                    await self.download_file_from_firestore(doc_data["file_url"], file_path)
+                except Exception as e:
+                    self.logger.error(f"{username}: Lỗi tải file {file_path}: {str(e)}")
+
+        return columns, values, doc_data["id"], digest, self._version_of(doc_data.get(Config.SYNC_VERSION_FIELD))
+
+    async def _apply_pulled_page(
+        self,
+        conn,
+        collection_name: str,
+        page: List[tuple],
+        username: str
+    ) -> tuple:
+        """Ghi một trang tài liệu đã kéo vào SQLite (không commit).
+
+        Bản ghi được gom theo tập cột và ghi bằng executemany; mỗi trang chỉ ghi
+        một dòng sync_log tổng với action "sync_to_sqlite_page", không làm dời
+        mốc last_sync của lần kéo đầy đủ. Trả về (số bản ghi đã ghi, danh sách id qa_data đã ghi).
+        """
+        if not page:
+            return 0, []
+        known = await self._load_manifest_hashes(
+            conn, [(collection_name, item[2]) for item in page], both_sides=True
+        )
+        groups: Dict[tuple, List[tuple]] = {}
+        unchanged = []
+        for item in page:
+            columns, _, record_id, digest, version = item
+            if digest in known.get((collection_name, record_id), ()):
+                # Nội dung giống lần đồng bộ trước, không cần ghi lại
+                unchanged.append((collection_name, record_id, version))
+                continue
+            groups.setdefault(tuple(columns), []).append(item)
+
+        pulled = []
+        for columns, items in groups.items():
+            query = (
+                f'INSERT OR REPLACE INTO "{collection_name}" '
+                f'({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+            )
+            try:
+                await conn.executemany(query, [item[1] for item in items])
+                applied = items
+            except Exception as e:
+                # Ghi lại từng bản ghi để chỉ bỏ qua bản ghi lỗi
+                self.logger.warning(
+                    f"{username}: Lỗi ghi nhóm {len(items)} bản ghi vào {collection_name}, "
+                    f"thử từng bản ghi: {str(e)}"
+                )
+                applied = []
+                for item in items:
+                    try:
+                        await conn.execute(query, item[1])
+                        applied.append(item)
+                    except Exception as row_error:
+                        self.logger.error(
+                            f"{username}: Lỗi khi chèn bản ghi {item[2]} "
+                            f"vào {collection_name}: {str(row_error)}"
+                        )
+            pulled.extend(
+                (collection_name, record_id, digest, version)
+                for _, _, record_id, digest, version in applied
+            )
+
+        if pulled:
+            query = (
+                "INSERT INTO sync_log "
+                "(id, table_name, record_id, action, timestamp, details) "
+                "VALUES (?, ?, ?, ?, ?, ?)"
+            )
+            params = (
+                str(uuid.uuid4()),
+                collection_name,
+                None,
+                "sync_to_sqlite_page",
+                int(time.time()),
+                self._serialize_value({
+                    "username": username,
+                    "synced_records": len(pulled),
+                    "unchanged_records": len(unchanged)
+                }),
+            )
+            self._check_parameters(params, query)
+            await conn.execute(query, params)
+        await self._record_pulled(conn, pulled, unchanged)
+        synced_qa_ids = [doc_id for _, doc_id, _, _ in pulled] if collection_name == "qa_data" else []
+        return len(pulled), synced_qa_ids
+
+    def get_watch_client(self):
+        """Client Firestore hỗ trợ on_snapshot, tạo lười từ FIRESTORE_CREDENTIALS."""
+        if self.watch_db is not None or Client is None or Credentials is None:
+            return self.watch_db
+        try:
+            cred_dict = Config.FIRESTORE_CREDENTIALS
+            if not cred_dict:
+                return None
+            if isinstance(cred_dict, str):
+                cred_dict = json.loads(cred_dict)
+            credentials = Credentials.from_service_account_info(cred_dict)
+            self.watch_db = Client(credentials=credentials, project=cred_dict.get("project_id"))
+        except Exception as e:
+            self.logger.error(f"Lỗi khởi tạo client listener Firestore: {str(e)}")
+            self.watch_db = None
+        return self.watch_db
+
+    def build_listener_query(self, client, collection_name: str, username: str):
+        """Truy vấn lắng nghe một collection (collection theo user lọc theo owner).
+
+        Không lọc theo mốc timestamp: timestamp do ứng dụng ghi nên tài liệu được
+        tạo/sửa lúc tiến trình dừng có thể mang timestamp cũ hơn checkpoint. Snapshot
+        đầu tiên trả lại toàn bộ tài liệu, tài liệu trùng hash bị bỏ qua khi ghi.
+        """
+        query = client.collection(collection_name)
+        owner_field = USER_SCOPED_COLLECTIONS.get(collection_name)
+        if owner_field:
+            query = query.where(filter=FieldFilter(owner_field, "==", username))
+        return query
+
+    async def _load_checkpoints(self, conn, direction: str, scope: str = "") -> Dict[str, tuple]:
+        """Checkpoint (last_key, last_timestamp, cursor_field) theo collection của một chiều đồng bộ."""
+        async with conn.execute(
+            "SELECT collection, last_key, last_timestamp, cursor_field FROM sync_checkpoints "
+            "WHERE direction = ? AND scope = ?",
+            (direction, scope)
+        ) as cursor:
+            return {row[0]: (row[1], row[2], row[3]) for row in await cursor.fetchall()}
+
+    async def _save_checkpoint(
+        self,
+        conn,
+        collection_name: str,
+        direction: str,
+        scope: str,
+        last_key: Optional[str],
+        last_timestamp: Optional[int],
+        cursor_field: Optional[str] = None
+    ) -> None:
+        """Ghi đè checkpoint của (collection, chiều, scope), không commit."""
+        await conn.execute(
+            """
+            INSERT INTO sync_checkpoints
+                (collection, direction, scope, last_key, last_timestamp, cursor_field, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (collection, direction, scope) DO UPDATE SET
+                last_key = excluded.last_key,
+                last_timestamp = excluded.last_timestamp,
+                cursor_field = excluded.cursor_field,
+                updated_at = excluded.updated_at
+            """,
+            (collection_name, direction, scope, last_key, last_timestamp, cursor_field, int(time.time()))
+        )
+
+    async def _clear_checkpoint(self, conn, collection_name: str, direction: str, scope: str = "") -> None:
+        """Xóa checkpoint khi collection đã đồng bộ xong (không commit)."""
+        await conn.execute(
+            "DELETE FROM sync_checkpoints WHERE collection = ? AND direction = ? AND scope = ?",
+            (collection_name, direction, scope)
+        )
+
+    async def apply_listener_changes(self, collection_name: str, changes: List[tuple], username: str) -> Dict:
+        """Áp dụng các thay đổi (loại, snapshot) từ on_snapshot vào SQLite qua hàng đợi ghi.
+
+        ADDED/MODIFIED dùng cùng đường ghi với sync_to_sqlite (bỏ qua tài liệu trùng
+        hash); REMOVED xóa bản ghi local của username (trừ bảng đặc biệt). Checkpoint
+        "listen" được ghi cùng transaction.
+        """
+        async with self.core.db_pool.reader() as conn:
+            async with conn.execute(f'PRAGMA table_info("{collection_name}")') as cursor:
+                schema = {row[1]: row[2] for row in await cursor.fetchall()}
+        if not schema:
+            self.logger.warning(
+                f"{username}: Bảng {collection_name} chưa có trong SQLite, bỏ qua thay đổi từ listener"
+            )
+            return {"synced_records": 0, "removed_records": 0}
+
+        owner_field = USER_SCOPED_COLLECTIONS.get(collection_name)
+        # Mỗi tài liệu chỉ giữ thay đổi cuối cùng trong lô
+        latest: Dict[str, tuple] = {}
+        for kind, snapshot in changes:
+            latest[snapshot.id] = (kind, snapshot)
+        page = []
+        removed = []
+        for doc_id, (kind, snapshot) in latest.items():
+            if kind == "REMOVED":
+                if collection_name not in Config.SPECIAL_TABLES:
+                    removed.append(doc_id)
+                continue
+            item = await self._convert_pulled_doc(snapshot, collection_name, schema, owner_field, username)
+            if item:
+                page.append(item)
+
+        checkpoint = max(
+            (item for item in page if isinstance(item[4], int)),
+            key=lambda item: item[4],
+            default=None
+        )
+        scope = username if owner_field else ""
+
+        async def apply_changes(conn):
+            synced, qa_ids = await self._apply_pulled_page(conn, collection_name, page, username)
+            removed_count = 0
+            for start in range(0, len(removed), 500):
+                chunk = removed[start:start + 500]
+                placeholders = ", ".join("?" for _ in chunk)
+                owner_clause = f' AND "{owner_field}" = ?' if owner_field else ""
+                cursor = await conn.execute(
+                    f'DELETE FROM "{collection_name}" WHERE id IN ({placeholders}){owner_clause}',
+                    (*chunk, username) if owner_field else chunk
+                )
+                removed_count += cursor.rowcount
+                await conn.execute(
+                    f"DELETE FROM sync_manifest WHERE table_name = ? AND doc_id IN ({placeholders})",
+                    (collection_name, *chunk)
+                )
+            if checkpoint:
+                saved = (await self._load_checkpoints(conn, "listen", scope)).get(collection_name)
+                # Mốc chỉ tiến lên, kể cả khi thay đổi đến không theo thứ tự
+                if not saved or saved[1] is None or checkpoint[4] > saved[1]:
+                    await self._save_checkpoint(
+                        conn, collection_name, "listen", scope, checkpoint[2], checkpoint[4],
+                        Config.SYNC_VERSION_FIELD
+                    )
+            return synced, qa_ids, removed_count
+
+        synced, qa_ids, removed_count = await self.core.sqlite_handler.enqueue_write(apply_changes)
+        if collection_name == "qa_data":
+            await self.core.sqlite_handler.refresh_qa_index(qa_ids + removed, username)
+        elif collection_name in Config.SPECIAL_TABLES:
+            self.core.sqlite_handler.invalidate_session_cache()
+            self.core.sqlite_handler.invalidate_role_cache()
+        if synced or removed_count:
+            self.logger.debug(
+                f"{username}: Listener {collection_name}: ghi {synced}, xóa {removed_count} bản ghi"
+            )
+        return {"synced_records": synced, "removed_records": removed_count}
+
+
+    async def _run_collection_tasks(
+        self,
+        names: List[str],
+        worker: Callable[[str], Any],
+        username: str
+    ) -> Dict[str, Dict]:
+        """Chạy worker(name) cho các collection song song, tối đa SYNC_MAX_PARALLEL_COLLECTIONS.
+
+        Bảng bảo vệ/đặc biệt (nhỏ) được xếp chạy trước. Kết quả của mỗi collection
+        kèm "seconds"; lỗi của một collection không dừng các collection khác.
+        """
+        semaphore = asyncio.Semaphore(max(1, Config.SYNC_MAX_PARALLEL_COLLECTIONS))
+        ordered = sorted(
+            names,
+            key=lambda name: (
+                name not in Config.SPECIAL_TABLES and name not in Config.PROTECTED_TABLES,
+                name
+            )
+        )
+
+        async def run(name: str):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    result = await worker(name)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.logger.error(f"{username}: Lỗi đồng bộ collection {name}: {str(e)}")
+                    result = {"error": str(e), "synced_records": 0}
+                result["seconds"] = round(time.perf_counter() - started, 3)
+                self.logger.debug(
+                    f"{username}: Collection {name} xong trong {result['seconds']}s "
+                    f"({result.get('synced_records', 0)} bản ghi)"
+                )
+                return name, result
+
+        return dict(await asyncio.gather(*(run(name) for name in ordered)))
+
     async def sync_to_sqlite(
         self,
         username: str,
         progress_callback: Optional[Callable[[float], None]] = None,
         protected_only: bool = False,
         specific_collections: Optional[List[str]] = None,
-        batch_size: int = 100
+        batch_size: int = Config.BATCH_SIZE
     ) -> Dict:
         if not await self.core.sqlite_handler.has_permission(username, "sync_data"):
             self.logger.error(f"{username}: Không có quyền đồng bộ dữ liệu")
@@ -1991,22 +2923,24 @@ class FirestoreHandler:
 
             check_disk_space()
             async with asyncio.timeout(300):
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
-                    # Xóa các bản ghi DELETE trong sync_log cho chat_messages của username
+                # Xóa các bản ghi DELETE trong sync_log cho chat_messages của username
+                async def clear_chat_deletes(conn):
                     await conn.execute(
                         """
                         DELETE FROM sync_log 
                         WHERE table_name = ? 
                         AND action = 'DELETE' 
-                        AND details LIKE ?
+                        AND username = ?
                         """,
-                        ("chat_messages", f'%{{"username": "{username}"%'),
-                    )
-                    await conn.commit()
-                    self.logger.info(
-                        f"{username}: Đã xóa các bản ghi DELETE trong sync_log cho chat_messages"
+                        ("chat_messages", username),
                     )
 
+                await self.core.sqlite_handler.enqueue_write(clear_chat_deletes)
+                self.logger.info(
+                    f"{username}: Đã xóa các bản ghi DELETE trong sync_log cho chat_messages"
+                )
+
+                async with self.core.db_pool.reader() as conn:
                     # Lấy thời gian đồng bộ lần cuối
                     async with conn.execute(
                         "SELECT MAX(timestamp) FROM sync_log WHERE action = 'sync_to_sqlite'"
@@ -2025,83 +2959,89 @@ class FirestoreHandler:
                             for row in await cursor.fetchall()
                         }
 
-                    async def get_firestore_schemas():
-                        schemas = {}
-                        async for doc in self.db.collection("collection_schemas").stream():
-                            doc_data = doc.to_dict()
-                            if (
-                                isinstance(doc_data, dict)
-                                and "collection_name" in doc_data
-                                and "fields" in doc_data
-                            ):
-                                schemas[doc_data["collection_name"]] = self._deserialize_schema(
-                                    doc_data["fields"]
-                                )
-                        return schemas
-
-                    schemas = await retry_firestore_operation(get_firestore_schemas)
-
-                    # Lấy danh sách collections cần đồng bộ
-                    collections = [coll.id async for coll in self.db.collections()]
-                    if specific_collections:
-                        collections = [coll for coll in collections if coll in specific_collections]
-                    elif protected_only:
-                        collections = [
-                            coll for coll in collections
-                            if coll in Config.PROTECTED_TABLES or coll in Config.SPECIAL_TABLES
-                        ]
-                    else:
-                        collections = [
-                            coll for coll in collections if coll not in Config.PROTECTED_TABLES
-                        ]
+                    # Checkpoint của lần kéo bị ngắt giữa chừng (timeout, khởi động lại)
+                    pull_checkpoints = {
+                        "": await self._load_checkpoints(conn, "pull", ""),
+                        username: await self._load_checkpoints(conn, "pull", username)
+                    }
 
-                    collections = list(set(collections) | set(Config.SPECIAL_TABLES))
-                    collections = [coll for coll in collections if coll not in Config.SYSTEM_TABLES]
-
-                    self.logger.info(f"{username}: Đồng bộ các collection: {collections}")
-
-                    if not collections:
-                        self.logger.info(f"{username}: Không có collection nào để đồng bộ")
-                        if progress_callback:
-                            await progress_callback(1.0)
-                        return {"success": "Không có collection để đồng bộ", "synced_records": 0}
-
-                    total_collections = len(collections)
-                    synced_records = 0
-                    processed_records = 0
-                    total_records = 0
-
-                    # Đếm tổng số bản ghi
-                    for collection_name in collections:
-                        query = self.db.collection(collection_name)
-                        if collection_name == "chat_messages":
-                            query = query.where(filter=FieldFilter("username", "==", username))
-                        elif collection_name == "qa_data":
-                            query = query.where(filter=FieldFilter("created_by", "==", username))
-                        async for _ in query.stream():
-                            total_records += 1
-
-                    # Đồng bộ từng collection
-                    for collection_name in collections:
-                        if not validate_name(collection_name):
-                            self.logger.warning(
-                                f"{username}: Tên collection {collection_name} không hợp lệ, bỏ qua"
+                async def get_firestore_schemas():
+                    schemas = {}
+                    async for doc in self.db.collection("collection_schemas").stream():
+                        doc_data = doc.to_dict()
+                        if (
+                            isinstance(doc_data, dict)
+                            and "collection_name" in doc_data
+                            and "fields" in doc_data
+                        ):
+                            schemas[doc_data["collection_name"]] = self._deserialize_schema(
+                                doc_data["fields"]
                             )
-                            continue
+                    return schemas
+
+                schemas = await retry_firestore_operation(get_firestore_schemas)
+
+                # Lấy danh sách collections cần đồng bộ
+                collections = [coll.id async for coll in self.db.collections()]
+                if specific_collections:
+                    collections = [coll for coll in collections if coll in specific_collections]
+                elif protected_only:
+                    collections = [
+                        coll for coll in collections
+                        if coll in Config.PROTECTED_TABLES or coll in Config.SPECIAL_TABLES
+                    ]
+                else:
+                    collections = [
+                        coll for coll in collections if coll not in Config.PROTECTED_TABLES
+                    ]
 
-                        self.logger.debug(f"{username}: Đồng bộ collection {collection_name}")
+                collections = list(set(collections) | set(Config.SPECIAL_TABLES))
+                collections = [coll for coll in collections if coll not in Config.SYSTEM_TABLES]
 
-                        firestore_schema = schemas.get(
-                            collection_name, {"id": "TEXT", "timestamp": "INTEGER"}
-                        )
-                        local_schema = local_schemas.get(
-                            collection_name, {"id": "TEXT", "timestamp": "INTEGER"}
-                        )
+                self.logger.info(f"{username}: Đồng bộ các collection: {collections}")
 
-                        merged_schema = self.validate_schema_compatibility(
-                            local_schema, firestore_schema
+                if not collections:
+                    self.logger.info(f"{username}: Không có collection nào để đồng bộ")
+                    if progress_callback:
+                        await progress_callback(1.0)
+                    return {"success": "Không có collection để đồng bộ", "synced_records": 0}
+
+                total_collections = len(collections)
+                synced_qa_ids = []
+                collection_progress = {name: 0.0 for name in collections}
+                last_progress = 0.0
+
+                async def report_progress(collection_name: str, fraction: float):
+                    # Giới hạn tần suất gọi progress_callback (mỗi SYNC_PROGRESS_INTERVAL giây)
+                    nonlocal last_progress
+                    collection_progress[collection_name] = fraction
+                    now = time.monotonic()
+                    if progress_callback and now - last_progress >= Config.SYNC_PROGRESS_INTERVAL:
+                        last_progress = now
+                        await progress_callback(sum(collection_progress.values()) / total_collections)
+
+                async def pull_collection(collection_name: str) -> Dict:
+                    if not validate_name(collection_name):
+                        self.logger.warning(
+                            f"{username}: Tên collection {collection_name} không hợp lệ, bỏ qua"
                         )
+                        return {"synced_records": 0, "skipped": True}
+
+                    self.logger.debug(f"{username}: Đồng bộ collection {collection_name}")
+
+                    firestore_schema = schemas.get(
+                        collection_name, {"id": "TEXT", "timestamp": "INTEGER"}
+                    )
+                    local_schema = local_schemas.get(
+                        collection_name, {"id": "TEXT", "timestamp": "INTEGER"}
+                    )
 
+                    merged_schema = self.validate_schema_compatibility(
+                        local_schema, firestore_schema
+                    )
+
+                    # Tạo bảng/thêm cột và cập nhật schema qua hàng đợi ghi
+                    async def apply_schema(conn):
                         async with conn.execute(
                             "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
                             (collection_name,),
@@ -2150,21 +3090,25 @@ class FirestoreHandler:
                         self._check_parameters(params, query)
                         await conn.execute(query, params)
 
-                        async def update_firestore_schema():
-                            await self.db.collection("collection_schemas").document(
-                                hashlib.sha256(collection_name.encode()).hexdigest()
-                            ).set(
-                                {
-                                    "collection_name": collection_name,
-                                    "fields": merged_schema,
-                                    "timestamp": int(time.time()),
-                                },
-                                merge=True,
-                            )
-                            return {"success": "Cập nhật schema Firestore thành công"}
+                    await self.core.sqlite_handler.enqueue_write(apply_schema)
 
-                        await retry_firestore_operation(update_firestore_schema)
+                    async def update_firestore_schema():
+                        await self.db.collection("collection_schemas").document(
+                            hashlib.sha256(collection_name.encode()).hexdigest()
+                        ).set(
+                            {
+                                "collection_name": collection_name,
+                                "fields": merged_schema,
+                                "timestamp": int(time.time()),
+                            },
+                            merge=True,
+                        )
+                        return {"success": "Cập nhật schema Firestore thành công"}
 
+                    await retry_firestore_operation(update_firestore_schema)
+
+                    owner_field = USER_SCOPED_COLLECTIONS.get(collection_name)
+                    async with self.core.db_pool.reader() as conn:
                         # Kiểm tra bảng local
                         async with conn.execute(
                             f'SELECT COUNT(*) FROM "{collection_name}"'
@@ -2176,106 +3120,127 @@ class FirestoreHandler:
                             f'{"rỗng" if is_empty else f"có {row_count} bản ghi"}'
                         )
 
-                        async def fetch_firestore_records():
-                            batch = []
-                            query = self.db.collection(collection_name)
-                            if collection_name == "chat_messages":
-                                query = query.where(filter=FieldFilter("username", "==", username))
-                            elif collection_name == "qa_data":
-                                query = query.where(filter=FieldFilter("created_by", "==", username))
-                            elif (
-                                is_empty
-                                or collection_name in Config.SPECIAL_TABLES
-                                or collection_name in Config.PROTECTED_TABLES
-                            ):
-                                pass
+                        # Mốc phiên bản server đã kéo về (theo sync_manifest, riêng từng
+                        # user với collection lọc theo user)
+                        if owner_field:
+                            watermark_query = (
+                                f'SELECT MAX(m.remote_version) FROM sync_manifest m '
+                                f'JOIN "{collection_name}" t ON t.id = m.doc_id '
+                                f'WHERE m.table_name = ? AND t."{owner_field}" = ?'
+                            )
+                            watermark_params = (collection_name, username)
+                        else:
+                            watermark_query = (
+                                "SELECT MAX(remote_version) FROM sync_manifest WHERE table_name = ?"
+                            )
+                            watermark_params = (collection_name,)
+                        async with conn.execute(watermark_query, watermark_params) as cursor:
+                            watermark = (await cursor.fetchone())[0]
+
+                    scope = username if owner_field else ""
+                    checkpoint = pull_checkpoints[scope].get(collection_name)
+                    if checkpoint and checkpoint[2] == "__name__":
+                        # Lần trước dừng giữa lượt kéo toàn bộ theo tên tài liệu: tiếp tục
+                        # đúng truy vấn đó (mốc phiên bản lúc này chưa phản ánh đủ dữ liệu)
+                        query, cursor_field = self._build_pull_query(
+                            collection_name, username, owner_field, None, True
+                        )
+                    else:
+                        query, cursor_field = self._build_pull_query(
+                            collection_name, username, owner_field, watermark, is_empty
+                        )
+                    # Tổng số tài liệu của collection lấy bằng truy vấn count() (không
+                    # stream tài liệu); nếu không hỗ trợ, tiến độ tính theo số trang
+                    collection_total = await self._count_pull_query(query, collection_name, username)
+                    collection_processed = 0
+                    collection_synced = 0
+                    pages = 0
+                    last_doc = None
+                    resume_query = None
+                    if checkpoint and checkpoint[2] == cursor_field:
+                        if cursor_field == "__name__" and checkpoint[0]:
+                            resume_query = query.start_after({"__name__": checkpoint[0]})
+                        elif cursor_field == Config.SYNC_VERSION_FIELD and checkpoint[1] is not None:
+                            # Bao gồm mốc: tài liệu cùng phiên bản đã kéo sẽ bị bỏ qua theo hash
+                            resume_query = query.start_at({cursor_field: self._version_cursor(checkpoint[1])})
+                        if resume_query is not None:
+                            self.logger.info(
+                                f"{username}: Tiếp tục kéo {collection_name} từ checkpoint "
+                                f"{checkpoint[0] if cursor_field == '__name__' else checkpoint[1]}"
+                            )
+
+                    # Kéo từng trang theo con trỏ start_after; mỗi trang được ghi trong một
+                    # transaction của hàng đợi ghi cùng checkpoint rồi mới lấy trang kế tiếp
+                    # (chỉ giữ một trang trong bộ nhớ)
+                    while True:
+                        async def fetch_firestore_page():
+                            if last_doc is not None:
+                                page_query = query.start_after(last_doc)
                             else:
-                                query = query.where(
-                                    filter=FieldFilter("timestamp", ">", last_sync)
-                                )
+                                page_query = resume_query if resume_query is not None else query
+                            return [doc async for doc in page_query.limit(batch_size).stream()]
 
-                            async for doc in query.stream():
-                                doc_data = doc.to_dict()
-                                if not isinstance(doc_data, dict):
-                                    continue
-                                doc_data["id"] = doc.id
-                                doc_data["timestamp"] = doc_data.get(
-                                    "timestamp", int(time.time())
-                                )
-                                valid_fields = [k for k in doc_data if k in merged_schema]
-                                if not valid_fields:
-                                    continue
-                                columns = [f'"{sanitize_field_name(k)}"' for k in valid_fields]
-                                placeholders = ["?" for _ in valid_fields]
-                                values = [self._serialize_value(doc_data[k]) for k in valid_fields]
-                                batch.append((columns, placeholders, values, doc_data["id"]))
-
-                                # Tải file nếu có
-                                if collection_name == "chat_messages" and "file_url" in doc_data:
-                                    file_id = doc_data["file_url"].split("/")[-1]
-                                    file_path = os.path.join(
-                                        Config.CHAT_FILE_STORAGE_PATH, file_id
-                                    )
-                                    if not os.path.exists(file_path):
-                                        try:
-                                            await self.download_file_from_firestore(
-                                                doc_data["file_url"], file_path
-                                            )
-                                        except Exception as e:
-                                            self.logger.error(
-                                                f"{username}: Lỗi tải file {file_path}: {str(e)}"
-                                            )
-                            return batch
+                        docs = await retry_firestore_operation(fetch_firestore_page)
+                        if not docs:
+                            break
+                        last_doc = docs[-1]
+                        pages += 1
 
-                        batch = await retry_firestore_operation(fetch_firestore_records)
-                        if not isinstance(batch, list):
-                            continue
+                        page = []
+                        for doc in docs:
+                            item = await self._convert_pulled_doc(
+                                doc, collection_name, merged_schema, owner_field, username
+                            )
+                            if item:
+                                page.append(item)
 
-                        # Chèn dữ liệu vào SQLite
-                        if batch:
-                            for columns, placeholders, values, record_id in batch:
-                                try:
-                                    await conn.execute(
-                                        f'INSERT OR REPLACE INTO "{collection_name}" '
-                                        f'({", ".join(columns)}) VALUES ({", ".join(placeholders)})',
-                                        values,
-                                    )
-                                    synced_records += 1
-                                    processed_records += 1
+                        last_version = self._version_of(
+                            (last_doc.to_dict() or {}).get(Config.SYNC_VERSION_FIELD)
+                        )
 
-                                    query = (
-                                        "INSERT INTO sync_log "
-                                        "(id, table_name, record_id, action, timestamp, details) "
-                                        "VALUES (?, ?, ?, ?, ?, ?)"
-                                    )
-                                    params = (
-                                        str(uuid.uuid4()),
-                                        collection_name,
-                                        record_id,
-                                        "sync_to_sqlite",
-                                        int(time.time()),
-                                        self._serialize_value(
-                                            {"username": username, "record_id": record_id}
-                                        ),
-                                    )
-                                    self._check_parameters(params, query)
-                                    await conn.execute(query, params)
+                        async def apply_page(conn):
+                            result = await self._apply_pulled_page(conn, collection_name, page, username)
+                            await self._save_checkpoint(
+                                conn, collection_name, "pull", scope, last_doc.id, last_version,
+                                cursor_field
+                            )
+                            return result
 
-                                    if progress_callback and total_records > 0:
-                                        await progress_callback(processed_records / total_records)
-                                except Exception as e:
-                                    self.logger.error(
-                                        f"{username}: Lỗi khi chèn bản ghi {record_id} "
-                                        f"vào {collection_name}: {str(e)}"
-                                    )
-                                    continue
-                            await conn.commit()
+                        page_synced, page_qa_ids = await self.core.sqlite_handler.enqueue_write(apply_page)
+                        collection_synced += page_synced
+                        synced_qa_ids.extend(page_qa_ids)
+                        collection_processed += len(docs)
 
-                        if progress_callback and total_records > 0:
-                            await progress_callback(processed_records / total_records)
+                        if collection_total:
+                            fraction = min(1.0, collection_processed / collection_total)
+                        else:
+                            fraction = pages / (pages + 1)
+                        await report_progress(collection_name, fraction)
+                        if len(docs) < batch_size:
+                            break
+
+                    async def finish_collection(conn):
+                        await self._clear_checkpoint(conn, collection_name, "pull", scope)
+
+                    await self.core.sqlite_handler.enqueue_write(finish_collection)
+                    self.logger.debug(
+                        f"{username}: Kéo {collection_processed} tài liệu {collection_name} "
+                        f"qua {pages} trang"
+                    )
+                    await report_progress(collection_name, 1.0)
+                    return {
+                        "synced_records": collection_synced,
+                        "documents": collection_processed,
+                        "pages": pages
+                    }
 
-                    # Ghi log đồng bộ tổng
-                    if synced_records > 0:
+                results = await self._run_collection_tasks(collections, pull_collection, username)
+                synced_records = sum(result.get("synced_records", 0) for result in results.values())
+                failed_collections = [name for name, result in results.items() if "error" in result]
+
+                # Ghi log đồng bộ tổng
+                if synced_records > 0:
+                    async def log_sync(conn):
                         query = (
                             "INSERT INTO sync_log "
                             "(id, table_name, record_id, action, timestamp, details) "
@@ -2297,18 +3262,30 @@ class FirestoreHandler:
                         )
                         self._check_parameters(params, query)
                         await conn.execute(query, params)
-                        await conn.commit()
 
-                    self.logger.info(
-                        f"{username}: Đồng bộ {synced_records} bản ghi từ Firestore sang SQLite"
+                    await self.core.sqlite_handler.enqueue_write(log_sync)
+
+                # Trạng thái phiên và role có thể đã bị ghi đè từ Firestore
+                self.core.sqlite_handler.invalidate_session_cache()
+                self.core.sqlite_handler.invalidate_role_cache()
+                await self.core.sqlite_handler.refresh_qa_index(synced_qa_ids, username)
+                self.logger.info(
+                    f"{username}: Đồng bộ {synced_records} bản ghi từ Firestore sang SQLite"
+                )
+                if failed_collections:
+                    self.logger.error(
+                        f"{username}: Lỗi đồng bộ các collection {failed_collections}, "
+                        "sẽ đồng bộ lại ở lần sau"
                     )
-                    if progress_callback:
-                        await progress_callback(1.0)
+                if progress_callback:
+                    await progress_callback(1.0)
 
-                    return {
-                        "success": f"Đồng bộ {synced_records} bản ghi từ Firestore sang SQLite",
-                        "synced_records": synced_records,
-                    }
+                return {
+                    "success": f"Đồng bộ {synced_records} bản ghi từ Firestore sang SQLite",
+                    "synced_records": synced_records,
+                    "collections": results,
+                    "failed_collections": failed_collections,
+                }
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout trong sync_to_sqlite: {str(e)}")
@@ -2342,7 +3319,7 @@ class FirestoreHandler:
 
             check_disk_space()
             async with asyncio.timeout(300):
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     async with conn.execute(
                         "SELECT MAX(timestamp) FROM sync_log WHERE action = 'sync_to_firestore'"
                     ) as cursor:
@@ -2358,40 +3335,6 @@ class FirestoreHandler:
                     ) as cursor:
                         delete_logs = await cursor.fetchall()
 
-                    async def delete_firestore_records():
-                        count = 0
-                        for table_name, record_id, details_json in delete_logs:
-                            if specific_collections and table_name not in specific_collections:
-                                continue
-                            # Xóa bản ghi trên Firestore
-                            await self.db.collection(table_name).document(record_id).delete()
-                            self.logger.debug(
-                                f"{username}: Đã xóa {record_id} trong Firestore collection {table_name}"
-                            )
-
-                            # Xóa file vật lý cục bộ nếu là chat_messages và có file_url
-                            if table_name == "chat_messages":
-                                try:
-                                    details = json.loads(details_json)
-                                    file_url = details.get("file_url")
-                                    if file_url:
-                                        file_id = file_url.split("/")[-1]
-                                        file_path = os.path.join(Config.CHAT_FILE_STORAGE_PATH, file_id)
-                                        if os.path.exists(file_path):
-                                            os.remove(file_path)
-                                            self.logger.info(
-                                                f"{username}: Đã xóa file vật lý cục bộ {file_path}"
-                                            )
-                                except Exception as e:
-                                    self.logger.error(
-                                        f"{username}: Lỗi xóa file vật lý cục bộ: {str(e)}"
-                                    )
-                            count += 1
-                        return count
-
-                    deleted_count = await retry_firestore_operation(delete_firestore_records)
-                    self.logger.debug(f"{username}: Đã xóa {deleted_count} bản ghi trên Firestore")
-
                     async with conn.execute(
                         "SELECT collection_name, fields FROM collection_schemas"
                     ) as cursor:
@@ -2401,21 +3344,6 @@ class FirestoreHandler:
                         }
                         self.logger.info(f"{username}: Tìm thấy {len(local_schemas)} lược đồ trong SQLite")
 
-                    async def get_firestore_schemas():
-                        schemas = {}
-                        async for doc in self.db.collection("collection_schemas").stream():
-                            doc_data = doc.to_dict()
-                            if not isinstance(doc_data, dict) or \
-                               "collection_name" not in doc_data or \
-                               "fields" not in doc_data:
-                                continue
-                            schemas[doc_data["collection_name"]] = self._deserialize_schema(
-                                doc_data["fields"]
-                            )
-                        return schemas
-
-                    firestore_schemas = await retry_firestore_operation(get_firestore_schemas)
-
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table'"
                     ) as cursor:
@@ -2424,114 +3352,148 @@ class FirestoreHandler:
                             if row[0] not in Config.SYSTEM_TABLES
                         ]
 
-                    tables = [t for t in tables if not t.endswith('_fts') and 'fts' not in t.lower()]
-
-                    if specific_collections:
-                        tables = [t for t in tables if t in specific_collections]
-                    elif protected_only:
-                        tables = [
-                            t for t in tables
-                            if t in Config.PROTECTED_TABLES or t in Config.SPECIAL_TABLES
-                        ]
-                    else:
-                        tables = [t for t in tables if t not in Config.PROTECTED_TABLES]
+                    # Checkpoint của lần đẩy bị ngắt giữa chừng (timeout, khởi động lại)
+                    push_checkpoints = await self._load_checkpoints(conn, "push", "")
 
-                    tables = list(set(tables) | set(Config.SPECIAL_TABLES))
-                    self.logger.info(f"{username}: Đồng bộ các bảng (excluded FTS): {tables}")
+                # Ghi Firestore qua WriteBatch, giới hạn số commit đồng thời
+                writer = FirestoreBatchWriter(self.db)
 
-                    if not tables:
-                        self.logger.info(f"{username}: Không có bảng nào để đồng bộ")
-                        if progress_callback:
-                            await progress_callback(1.0)
-                        return {"success": "Không có bảng nào để đồng bộ", "synced_records": 0}
+                async def delete_firestore_records():
+                    details_by_key = {}
+                    for table_name, record_id, details_json in delete_logs:
+                        if specific_collections and table_name not in specific_collections:
+                            continue
+                        # Xóa bản ghi trên Firestore
+                        await writer.delete(table_name, record_id, tag=(table_name, record_id, None))
+                        details_by_key[(table_name, record_id)] = details_json
+                        self.logger.debug(
+                            f"{username}: Xếp hàng xóa {record_id} trong Firestore collection {table_name}"
+                        )
+                    await writer.flush()
+                    return details_by_key
 
-                    total_tables = len(tables)
-                    synced_records = 0
-                    processed_records = 0
-                    total_records = 0
+                details_by_key = await delete_firestore_records()
+                deleted = writer.take_committed()
+                deleted_count = len(deleted)
 
-                    # Ước tính tổng số bản ghi
-                    for table in tables:
-                        async with conn.execute(f'SELECT COUNT(*) FROM "{table}"') as cursor:
-                            total_records += (await cursor.fetchone())[0]
+                # Chỉ xóa file vật lý cục bộ của tin nhắn đã xóa thành công trên Firestore
+                for table_name, record_id, _ in deleted:
+                    if table_name != "chat_messages":
+                        continue
+                    try:
+                        details = json.loads(details_by_key.get((table_name, record_id)) or "{}")
+                        file_url = details.get("file_url")
+                        if file_url:
+                            file_id = file_url.split("/")[-1]
+                            file_path = os.path.join(Config.CHAT_FILE_STORAGE_PATH, file_id)
+                            if os.path.exists(file_path):
+                                os.remove(file_path)
+                                self.logger.info(
+                                    f"{username}: Đã xóa file vật lý cục bộ {file_path}"
+                                )
+                    except Exception as e:
+                        self.logger.error(
+                            f"{username}: Lỗi xóa file vật lý cục bộ: {str(e)}"
+                        )
 
-                    async def fetch_rows(table, last_sync, record_limit, page_size=1000):
-                        async with conn.execute(f'SELECT COUNT(*) FROM "{table}"') as cursor:
-                            row_count = (await cursor.fetchone())[0]
-                        is_empty = row_count == 0
-                        self.logger.debug(
-                            f"{username}: Bảng {table} "
-                            f"{'rỗng' if is_empty else f'có {row_count} bản ghi'}"
+                if deleted:
+                    # Dòng DELETE của bản ghi xóa lỗi được giữ lại để lần sau thử lại
+                    async def record_deletes(conn):
+                        await self._record_manifest(conn, deleted)
+                        await conn.executemany(
+                            "DELETE FROM sync_log WHERE action = 'DELETE' "
+                            "AND table_name = ? AND record_id = ?",
+                            [(table_name, record_id) for table_name, record_id, _ in deleted]
                         )
 
-                        async with conn.execute(f'PRAGMA table_info("{table}")') as cursor:
-                            columns_info = {row[1]: row[2] for row in await cursor.fetchall()}
-                        has_timestamp = "timestamp" in columns_info
-                        self.logger.debug(
-                            f"{username}: Table {table} has timestamp column: {has_timestamp}"
+                    await self.core.sqlite_handler.enqueue_write(record_deletes)
+                if writer.failed:
+                    self.logger.error(
+                        f"{username}: {len(writer.failed)} thao tác xóa Firestore thất bại, "
+                        "sẽ thử lại ở lần sau"
+                    )
+                self.logger.debug(f"{username}: Đã xóa {deleted_count} bản ghi trên Firestore")
+
+                async def get_firestore_schemas():
+                    schemas = {}
+                    async for doc in self.db.collection("collection_schemas").stream():
+                        doc_data = doc.to_dict()
+                        if not isinstance(doc_data, dict) or \
+                           "collection_name" not in doc_data or \
+                           "fields" not in doc_data:
+                            continue
+                        schemas[doc_data["collection_name"]] = self._deserialize_schema(
+                            doc_data["fields"]
                         )
+                    return schemas
 
-                        offset = 0
-                        while True:
-                            if is_empty or table in Config.SPECIAL_TABLES or \
-                               table in Config.PROTECTED_TABLES or not has_timestamp:
-                                query = f'SELECT * FROM "{table}" LIMIT ? OFFSET ?'
-                                params = [page_size, offset]
-                                self.logger.debug(
-                                    f"{username}: Đồng bộ toàn bộ cho {table} "
-                                    "(empty/special/no timestamp)"
-                                )
-                            else:
-                                query = f'SELECT * FROM "{table}" WHERE timestamp > ? LIMIT ? OFFSET ?'
-                                params = [last_sync, page_size, offset]
-                                self.logger.debug(
-                                    f"{username}: Đồng bộ bản ghi mới cho {table} "
-                                    f"(timestamp > {last_sync})"
-                                )
+                firestore_schemas = await retry_firestore_operation(get_firestore_schemas)
 
-                            if record_limit:
-                                params[-2] = min(page_size, record_limit - offset)
+                tables = [t for t in tables if not t.endswith('_fts') and 'fts' not in t.lower()]
 
-                            try:
-                                async with conn.execute(query, params) as cursor:
-                                    rows = await cursor.fetchall()
-                                    if not rows:
-                                        break
-                                    yield rows
-                                    offset += len(rows)
-                            except Exception as query_error:
-                                self.logger.error(
-                                    f"{username}: Lỗi query cho table {table}: {str(query_error)} "
-                                    f"(query: {query}, params: {params}). Skip table."
-                                )
-                                break
+                if specific_collections:
+                    tables = [t for t in tables if t in specific_collections]
+                elif protected_only:
+                    tables = [
+                        t for t in tables
+                        if t in Config.PROTECTED_TABLES or t in Config.SPECIAL_TABLES
+                    ]
+                else:
+                    tables = [t for t in tables if t not in Config.PROTECTED_TABLES]
 
-                            if record_limit and offset >= record_limit:
-                                break
+                tables = list(set(tables) | set(Config.SPECIAL_TABLES))
+                self.logger.info(f"{username}: Đồng bộ các bảng (excluded FTS): {tables}")
+
+                if not tables:
+                    self.logger.info(f"{username}: Không có bảng nào để đồng bộ")
+                    if progress_callback:
+                        await progress_callback(1.0)
+                    return {"success": "Không có bảng nào để đồng bộ", "synced_records": 0}
 
-                    # --- Đồng bộ từng bảng ---
+                processed_records = 0
+                total_records = 0
+
+                # Ước tính tổng số bản ghi
+                async with self.core.db_pool.reader() as conn:
                     for table in tables:
                         if not validate_name(table):
-                            self.logger.warning(f"{username}: Tên bảng {table} không hợp lệ, bỏ qua")
                             continue
+                        async with conn.execute(f'SELECT COUNT(*) FROM "{table}"') as cursor:
+                            total_records += (await cursor.fetchone())[0]
+
+                async def push_table(table: str) -> Dict:
+                    nonlocal processed_records
+                    if not validate_name(table):
+                        self.logger.warning(f"{username}: Tên bảng {table} không hợp lệ, bỏ qua")
+                        return {"synced_records": 0, "skipped": True}
 
-                        self.logger.debug(f"{username}: Đồng bộ bảng {table}")
+                    self.logger.debug(f"{username}: Đồng bộ bảng {table}")
+                    async with self.core.db_pool.reader() as conn:
                         async with conn.execute(f'PRAGMA table_info("{table}")') as cursor:
-                            columns = {
-                                sanitize_field_name(row[1]): row[2]
-                                for row in await cursor.fetchall()
-                            }
+                            columns_info = {row[1]: row[2] for row in await cursor.fetchall()}
+                        async with conn.execute(f'SELECT COUNT(*) FROM "{table}"') as cursor:
+                            row_count = (await cursor.fetchone())[0]
+                    columns = {sanitize_field_name(name): dtype for name, dtype in columns_info.items()}
+                    has_timestamp = "timestamp" in columns_info
+                    is_empty = row_count == 0
+                    self.logger.debug(
+                        f"{username}: Bảng {table} "
+                        f"{'rỗng' if is_empty else f'có {row_count} bản ghi'}, "
+                        f"có cột timestamp: {has_timestamp}"
+                    )
 
-                        local_schema = local_schemas.get(
-                            table, {"id": "TEXT", "timestamp": "INTEGER"}
-                        )
-                        firestore_schema = firestore_schemas.get(table, {})
-                        merged_schema = self.validate_schema_compatibility(
-                            local_schema, firestore_schema
-                        )
+                    local_schema = local_schemas.get(
+                        table, {"id": "TEXT", "timestamp": "INTEGER"}
+                    )
+                    firestore_schema = firestore_schemas.get(table, {})
+                    merged_schema = self.validate_schema_compatibility(
+                        local_schema, firestore_schema
+                    )
 
-                        if merged_schema != local_schema:
-                            schema_json = self._serialize_value(merged_schema)
+                    if merged_schema != local_schema:
+                        schema_json = self._serialize_value(merged_schema)
+
+                        async def update_local_schema(conn):
                             query = (
                                 "INSERT OR REPLACE INTO collection_schemas "
                                 "(id, collection_name, fields, timestamp) VALUES (?, ?, ?, ?)"
@@ -2545,123 +3507,190 @@ class FirestoreHandler:
                             self._check_parameters(params, query)
                             await conn.execute(query, params)
 
-                            async def update_firestore_schema():
-                                await self.db.collection("collection_schemas").document(
-                                    hashlib.sha256(table.encode()).hexdigest()
-                                ).set({
-                                    "collection_name": table,
-                                    "fields": merged_schema,
-                                    "timestamp": int(time.time())
-                                }, merge=True)
-                                return 1
+                        await self.core.sqlite_handler.enqueue_write(update_local_schema)
 
-                            updated_count = await retry_firestore_operation(update_firestore_schema)
-                            self.logger.debug(
-                                f"{username}: Cập nhật {updated_count} schema cho {table}"
-                            )
+                        async def update_firestore_schema():
+                            await self.db.collection("collection_schemas").document(
+                                hashlib.sha256(table.encode()).hexdigest()
+                            ).set({
+                                "collection_name": table,
+                                "fields": merged_schema,
+                                "timestamp": int(time.time())
+                            }, merge=True)
+                            return 1
 
-                        valid_columns = list(merged_schema.keys())
-                        column_list = list(columns.keys())
-                        batch = []
+                        updated_count = await retry_firestore_operation(update_firestore_schema)
+                        self.logger.debug(
+                            f"{username}: Cập nhật {updated_count} schema cho {table}"
+                        )
 
-                        async for rows in fetch_rows(table, last_sync, record_limit):
-                            for row in rows:
-                                try:
-                                    data = {
-                                        col: row[column_list.index(col)]
-                                        for col in valid_columns
-                                        if col in column_list and col != "rowid"
-                                    }
-                                    data = {k: v for k, v in data.items() if v is not None}
-                                    if not data:
-                                        continue
+                    # Lần trước dừng giữa bảng: tiếp tục sau rowid đã đẩy, cùng mốc last_sync
+                    table_last_sync = last_sync
+                    last_rowid = 0
+                    checkpoint = push_checkpoints.get(table)
+                    if checkpoint and checkpoint[2] == "_rowid_" and checkpoint[0]:
+                        last_rowid = int(checkpoint[0])
+                        if checkpoint[1] is not None:
+                            table_last_sync = checkpoint[1]
+                        self.logger.info(
+                            f"{username}: Tiếp tục đẩy {table} từ checkpoint rowid {last_rowid}"
+                        )
 
-                                    doc_id = data.get("id", str(uuid.uuid4()))
+                    if is_empty or table in Config.SPECIAL_TABLES or \
+                       table in Config.PROTECTED_TABLES or not has_timestamp:
+                        query = (
+                            f'SELECT _rowid_, * FROM "{table}" '
+                            'WHERE _rowid_ > ? ORDER BY _rowid_ LIMIT ?'
+                        )
+                        base_params = []
+                        self.logger.debug(
+                            f"{username}: Đồng bộ toàn bộ cho {table} "
+                            "(empty/special/no timestamp)"
+                        )
+                    else:
+                        query = (
+                            f'SELECT _rowid_, * FROM "{table}" '
+                            'WHERE _rowid_ > ? AND timestamp > ? ORDER BY _rowid_ LIMIT ?'
+                        )
+                        base_params = [table_last_sync]
+                        self.logger.debug(
+                            f"{username}: Đồng bộ bản ghi mới cho {table} "
+                            f"(timestamp > {table_last_sync})"
+                        )
 
-                                    if table in Config.SPECIAL_TABLES or table in Config.PROTECTED_TABLES:
-                                        key_field = (
-                                            "collection_name" if table == "collection_schemas"
-                                            else "username" if table in Config.SPECIAL_TABLES
-                                            else "collection_name"
-                                        )
-                                        key_value = data.get(key_field)
-                                        if not key_value:
-                                            continue
-                                        doc_id = hashlib.sha256(key_value.encode()).hexdigest()
-                                        await retry_firestore_operation(
-                                            lambda: self.db.collection(table)
-                                            .document(doc_id)
-                                            .set(data, merge=True)
-                                        )
-                                        synced_records += 1
-                                        processed_records += 1
-                                        self.logger.debug(
-                                            f"{username}: Đồng bộ bản ghi {doc_id} trong {table}"
-                                        )
-                                        if progress_callback and total_records > 0:
-                                            await progress_callback(processed_records / total_records)
-                                        continue
+                    valid_columns = list(merged_schema.keys())
+                    column_list = list(columns.keys())
+                    table_writer = FirestoreBatchWriter(self.db)
+                    page_size = 1000
+                    pushed_rows = 0
+                    table_synced = 0
+                    checkpoint_ok = True
+
+                    # Phân trang theo rowid; mỗi trang mượn kết nối đọc chỉ để lấy dữ liệu, chờ
+                    # commit Firestore của trang rồi ghi manifest cùng checkpoint trong một transaction
+                    while True:
+                        limit = page_size
+                        if record_limit:
+                            limit = min(page_size, record_limit - pushed_rows)
+                        params = [last_rowid] + base_params + [limit]
+                        try:
+                            async with self.core.db_pool.reader() as conn:
+                                async with conn.execute(query, params) as cursor:
+                                    rows = await cursor.fetchall()
+                        except Exception as query_error:
+                            self.logger.error(
+                                f"{username}: Lỗi query cho table {table}: {str(query_error)} "
+                                f"(query: {query}, params: {params}). Skip table."
+                            )
+                            # Bảng chưa đẩy xong: giữ checkpoint để lần sau tiếp tục
+                            checkpoint_ok = False
+                            break
+                        if not rows:
+                            break
+                        last_rowid = rows[-1][0]
+                        pushed_rows += len(rows)
 
-                                    batch.append((table, doc_id, data))
-                                    self.logger.debug(
-                                        f"{username}: Added to batch: table={table}, "
-                                        f"doc_id={doc_id}, data_keys={list(data.keys())}"
-                                    )
-                                except Exception as row_error:
-                                    self.logger.error(
-                                        f"{username}: Lỗi xử lý row cho table {table}: {str(row_error)} (row: {row}). Skip row."
-                                    )
+                        # Kết nối đọc đã được trả; xếp hàng ghi có thể chờ commit Firestore
+                        failed_before = len(table_writer.failed)
+                        batch = []
+                        for row in rows:
+                            row = row[1:]
+                            try:
+                                data = {
+                                    col: row[column_list.index(col)]
+                                    for col in valid_columns
+                                    if col in column_list and col != "rowid"
+                                }
+                                data = {k: v for k, v in data.items() if v is not None}
+                                if not data:
                                     continue
 
-                                if len(batch) >= batch_size:
-                                    try:
-                                        batch_count = await retry_firestore_operation(
-                                            lambda: self.sync_firestore_batch(batch, username)
-                                        )
-                                        synced_records += batch_count
-                                        processed_records += batch_count
-                                        self.logger.debug(
-                                            f"{username}: Synced batch {len(batch)} for {table}, count={batch_count}"
-                                        )
-                                        if progress_callback and total_records > 0:
-                                            await progress_callback(processed_records / total_records)
-                                    except Exception as batch_error:
-                                        self.logger.error(
-                                            f"{username}: Lỗi sync batch cho {table}: {str(batch_error)}. Skip batch."
-                                        )
-                                        batch.clear()
+                                doc_id = data.get("id", str(uuid.uuid4()))
 
-                            if batch:
-                                try:
-                                    batch_count = await retry_firestore_operation(
-                                        lambda: self.sync_firestore_batch(batch, username)
-                                    )
-                                    synced_records += batch_count
-                                    processed_records += batch_count
-                                    self.logger.debug(
-                                        f"{username}: Synced final batch {len(batch)} for {table}, count={batch_count}"
+                                if table in Config.SPECIAL_TABLES or table in Config.PROTECTED_TABLES:
+                                    key_field = (
+                                        "collection_name" if table == "collection_schemas"
+                                        else "username" if table in Config.SPECIAL_TABLES
+                                        else "collection_name"
                                     )
-                                    if progress_callback and total_records > 0:
-                                        await progress_callback(processed_records / total_records)
-                                except Exception as batch_error:
-                                    self.logger.error(
-                                        f"{username}: Lỗi sync final batch cho {table}: {str(batch_error)}"
-                                    )
-                                    batch.clear()
+                                    key_value = data.get(key_field)
+                                    if not key_value:
+                                        continue
+                                    doc_id = hashlib.sha256(key_value.encode()).hexdigest()
 
-                            if synced_records > 0:
-                                await conn.execute(
-                                    "DELETE FROM sync_log WHERE table_name = ? "
-                                    "AND action IN ('INSERT', 'UPDATE', 'DELETE')",
-                                    (table,)
+                                batch.append((table, doc_id, data))
+                            except Exception as row_error:
+                                self.logger.error(
+                                    f"{username}: Lỗi xử lý row cho table {table}: {str(row_error)} (row: {row}). Skip row."
                                 )
-                                await conn.commit()
-                                self.logger.debug(f"{username}: Xóa sync_log cũ cho {table}")
+                                continue
 
+                            if len(batch) >= batch_size:
+                                await self.sync_firestore_batch(batch, username, table_writer)
+                                batch = []
+
+                        if batch:
+                            await self.sync_firestore_batch(batch, username, table_writer)
+
+                        await table_writer.flush()
+                        committed = table_writer.take_committed()
+                        table_synced += sum(1 for _, _, digest in committed if digest is not None)
+                        # Checkpoint dừng tiến khi có thao tác lỗi để lần sau đẩy lại từ đó
+                        checkpoint_ok = checkpoint_ok and len(table_writer.failed) == failed_before
+                        page_rowid = last_rowid
+
+                        async def record_page(conn):
+                            await self._record_manifest(conn, committed)
+                            if checkpoint_ok:
+                                await self._save_checkpoint(
+                                    conn, table, "push", "", str(page_rowid), table_last_sync, "_rowid_"
+                                )
+
+                        await self.core.sqlite_handler.enqueue_write(record_page)
+
+                        processed_records += len(rows)
                         if progress_callback and total_records > 0:
-                            await progress_callback(processed_records / total_records)
+                            await progress_callback(min(processed_records / total_records, 1.0))
+
+                        if record_limit and pushed_rows >= record_limit:
+                            break
+
+                    async def record_table(conn):
+                        if checkpoint_ok:
+                            await self._clear_checkpoint(conn, table, "push", "")
+                        if table_synced > 0:
+                            # Dòng DELETE sau last_sync chỉ được xóa khi lệnh xóa đã commit
+                            await conn.execute(
+                                "DELETE FROM sync_log WHERE table_name = ? "
+                                "AND (action IN ('INSERT', 'UPDATE') "
+                                "OR (action = 'DELETE' AND timestamp <= ?))",
+                                (table, last_sync)
+                            )
+                            self.logger.debug(f"{username}: Xóa sync_log cũ cho {table}")
+
+                    await self.core.sqlite_handler.enqueue_write(record_table)
+                    if table_writer.failed:
+                        self.logger.error(
+                            f"{username}: {len(table_writer.failed)} thao tác Firestore của {table} "
+                            "commit thất bại, sẽ đồng bộ lại ở lần sau"
+                        )
+                    self.logger.debug(f"{username}: Đẩy {table_synced} bản ghi thay đổi của {table}")
+                    return {"synced_records": table_synced, **table_writer.stats()}
 
-                    if synced_records > 0:
+                results = await self._run_collection_tasks(tables, push_table, username)
+                synced_records = sum(result.get("synced_records", 0) for result in results.values())
+                failed_tables = [
+                    name for name, result in results.items()
+                    if "error" in result or result.get("failed")
+                ]
+
+                if failed_tables:
+                    self.logger.error(
+                        f"{username}: Lỗi đồng bộ các bảng {failed_tables}, sẽ đồng bộ lại ở lần sau"
+                    )
+                # Bản ghi/xóa lỗi phải được gửi lại, nên không dời mốc last_sync
+                if synced_records > 0 and not writer.failed and not failed_tables:
+                    async def log_sync(conn):
                         query = (
                             "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
                             "VALUES (?, ?, ?, ?, ?, ?)"
@@ -2678,16 +3707,19 @@ class FirestoreHandler:
                         )
                         self._check_parameters(params, query)
                         await conn.execute(query, params)
-                        await conn.commit()
-                        self.logger.info(f"{username}: Ghi log đồng bộ cho {synced_records} bản ghi")
 
-                    self.logger.info(f"{username}: Đồng bộ {synced_records} bản ghi từ SQLite sang Firestore")
-                    if progress_callback:
-                        await progress_callback(1.0)
-                    return {
-                        "success": f"Đồng bộ {synced_records} bản ghi từ SQLite sang Firestore",
-                        "synced_records": synced_records
-                    }
+                    await self.core.sqlite_handler.enqueue_write(log_sync)
+                    self.logger.info(f"{username}: Ghi log đồng bộ cho {synced_records} bản ghi")
+
+                self.logger.info(f"{username}: Đồng bộ {synced_records} bản ghi từ SQLite sang Firestore")
+                if progress_callback:
+                    await progress_callback(1.0)
+                return {
+                    "success": f"Đồng bộ {synced_records} bản ghi từ SQLite sang Firestore",
+                    "synced_records": synced_records,
+                    "collections": results,
+                    "failed_collections": failed_tables
+                }
 
         except asyncio.TimeoutError as e:
             self.logger.error(f"{username}: Timeout trong sync_from_sqlite: {str(e)}")
@@ -2707,11 +3739,32 @@ class Core:
 
     def __init__(self):
         self.logger = get_logger("Core")
+        # Pool kết nối SQLite dùng chung cho handler và các thành phần UI
+        self.db_pool = SQLitePool()
         
         self.sqlite_handler = SQLiteHandler(self.logger, self)
         asyncio.create_task(self.sqlite_handler.start())
         self.firestore_handler = FirestoreHandler(self.logger, self)
-        self.firestore_available = self.firestore_handler.firestore_available
+        # Tuần tự hóa các lượt đồng bộ Firestore (thủ công và nền)
+        self.firestore_lock = asyncio.Lock()
+        self.sync_daemon = SyncDaemon(self)
+        # Nhận thay đổi Firestore theo thời gian thực (tùy chọn, SYNC_LISTENER_ENABLED)
+        self.firestore_listener = FirestoreListener(self)
+        # Độ trễ gọi LLM: thời gian tới token đầu (TTFT) và tổng thời gian
+        self.llm_ttft = LatencyStats(Config.LLM_METRICS_WINDOW)
+        self.llm_total = LatencyStats(Config.LLM_METRICS_WINDOW)
+        # Độ trễ và số lần quá hạn của từng stage truy hồi QA
+        self.retrieval_latency = {
+            stage: LatencyStats(Config.LLM_METRICS_WINDOW) for stage in Config.RETRIEVAL_STAGE_BUDGETS
+        }
+        self.retrieval_timeouts = {stage: 0 for stage in Config.RETRIEVAL_STAGE_BUDGETS}
+        self._retrieval_tasks = set()
+        # Cache phản hồi LLM trong bảng SQLite llm_cache
+        self.llm_cache = LLMResponseCache(self)
+        # Fuzzy matching chạy trong thread pool, dùng chung cho chat và training
+        self.fuzzy_matcher = FuzzyMatcher()
+        # Truy hồi QA theo embedding cục bộ cho chế độ Hybrid
+        self.vector_store = QAVectorStore(self)
         self.groq_client = None
         if hasattr(Config, 'GROQ_API_KEY') and Config.GROQ_API_KEY:
             try:
@@ -2721,9 +3774,14 @@ class Core:
                 self.logger.error(f"Lỗi khi khởi tạo Grok client: {str(e)}")
                 self.groq_client = None
 
+    @property
+    def firestore_available(self) -> bool:
+        """Trạng thái Firestore mới nhất do health monitor công bố."""
+        return self.firestore_handler.firestore_available
+
     async def cleanup_invalid_client_states(self):
         try:
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+            async def write_op(conn):
                 current_time = int(time.time())
                 await conn.execute(
                     "DELETE FROM client_states WHERE timestamp < ? AND username != ?",
@@ -2733,8 +3791,9 @@ class Core:
                     "DELETE FROM sessions WHERE expires_at < ? AND username != ?",
                     (current_time, Config.ADMIN_USERNAME)
                 )
-                await conn.commit()
                 self.logger.info("Đã xóa các client_state và session hết hạn, bảo vệ admin")
+            await self.sqlite_handler.enqueue_write(write_op)
+            self.sqlite_handler.invalidate_session_cache()
         except Exception as e:
             self.logger.error(f"Lỗi xóa client_state hết hạn: {str(e)}")
             raise DatabaseError(f"Lỗi xóa client_state: {str(e)}")
@@ -2761,7 +3820,7 @@ class Core:
             try:
                 # Kiểm tra xem SQLite có dữ liệu không
                 has_sqlite_data = False
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.db_pool.reader() as conn:
                     protected_collections = ["users", "sessions", "client_states", "collection_schemas"]
                     for table in protected_collections:
                         async with conn.execute(f"SELECT COUNT(*) FROM {table}") as cursor:
@@ -2880,7 +3939,10 @@ class Core:
     async def create_record(self, collection_name: str, data: Dict, username: str) -> Dict:
         """Tạo một bản ghi mới trong collection (bảng) được chỉ định."""
         try:
-            return await self.sqlite_handler.create_record(collection_name, data, username)
+            result = await self.sqlite_handler.create_record(collection_name, data, username)
+            if "success" in result:
+                self.sync_daemon.notify_change()
+            return result
         except Exception as e:
             return await self.handle_error(e, f"Lỗi tạo bản ghi trong {collection_name}")
 
@@ -2899,14 +3961,20 @@ class Core:
     async def update_record(self, collection_name: str, record_id: str, data: Dict, username: str) -> Dict:
         """Cập nhật một bản ghi trong collection (bảng) được chỉ định."""
         try:
-            return await self.sqlite_handler.update_record(collection_name, record_id, data, username)
+            result = await self.sqlite_handler.update_record(collection_name, record_id, data, username)
+            if "success" in result:
+                self.sync_daemon.notify_change()
+            return result
         except Exception as e:
             return await self.handle_error(e, f"Lỗi cập nhật bản ghi {record_id} trong {collection_name}")
 
     async def delete_record(self, collection_name: str, record_id: str, username: str) -> Dict:
         """Xóa một bản ghi từ collection (bảng) được chỉ định."""
         try:
-            return await self.sqlite_handler.delete_record(collection_name, record_id, username)
+            result = await self.sqlite_handler.delete_record(collection_name, record_id, username)
+            if "success" in result:
+                self.sync_daemon.notify_change()
+            return result
         except Exception as e:
             return await self.handle_error(e, f"Lỗi xóa bản ghi {record_id} trong {collection_name}")
 
@@ -2975,6 +4043,8 @@ class Core:
                 return result
             deleted_count = result.get("deleted_count", 0)
             self.logger.info(f"{username}: Đã xóa {deleted_count} bản ghi trong {collection_name} (SQLite)")
+            if deleted_count:
+                self.sync_daemon.notify_change()
             return {
                 "success": f"Đã xóa {deleted_count} bản ghi trong {collection_name}",
                 "deleted_count": deleted_count
@@ -3003,7 +4073,7 @@ class Core:
         progress_callback: Optional[Callable[[float], None]] = None,
         protected_only: bool = False,
         specific_collections: Optional[List[str]] = None,
-        batch_size: int = 100
+        batch_size: int = Config.BATCH_SIZE
     ) -> Dict:
         """Đồng bộ dữ liệu từ Firestore sang SQLite."""
         return await self.firestore_handler.sync_to_sqlite(
@@ -3042,7 +4112,7 @@ class Core:
                 )
                 return {"error": f"Tham số page hoặc page_size không hợp lệ: {str(e)}"}
 
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+            async with self.db_pool.reader() as conn:
                 # Lấy log
                 async with conn.execute(
                     """
@@ -3141,8 +4211,8 @@ class Core:
         try:
             async with asyncio.timeout(30):
                 query = (
-                    "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
-                    "VALUES (?, ?, ?, ?, ?, ?)"
+                    "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details, username, session_token) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
                 )
                 params = (
                     str(uuid.uuid4()),
@@ -3150,13 +4220,13 @@ class Core:
                     record_id,
                     action,
                     int(time.time()),
-                    json.dumps(details, ensure_ascii=False)
+                    json.dumps(details, ensure_ascii=False),
+                    username,
+                    details.get("session_token") if isinstance(details, dict) else None
                 )
-                async with aiosqlite.connect(
-                    Config.SQLITE_DB_PATH, timeout=30.0
-                ) as conn:
+                async def write_op(conn):
                     await conn.execute(query, params)
-                    await conn.commit()
+                await self.sqlite_handler.enqueue_write(write_op)
 
                 self.logger.info(
                     f"{username}: Ghi log đồng bộ cho {table_name}, action: {action}"
@@ -3186,7 +4256,7 @@ class Core:
                     return result
 
                 # Lưu hoặc cập nhật cấu hình
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     await conn.execute(
                         "INSERT OR REPLACE INTO chat_config (id, username, model, timestamp) "
                         "VALUES (?, ?, ?, ?)",
@@ -3197,9 +4267,9 @@ class Core:
                             int(time.time())
                         )
                     )
-                    await conn.commit()
                     self.logger.info(f"{username}: Lưu cấu hình chat thành công, model: {model}")
                     return {"success": "Lưu cấu hình chat thành công"}
+                return await self.sqlite_handler.enqueue_write(write_op)
 
         except asyncio.TimeoutError:
             self.logger.error(f"{username}: Timeout khi lưu cấu hình chat")
@@ -3213,7 +4283,7 @@ class Core:
         """Lấy danh sách bảng có sẵn, trừ các bảng hệ thống."""
         try:
             async with asyncio.timeout(60):
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                async with self.db_pool.reader() as conn:
                     async with conn.execute(
                         "SELECT name FROM sqlite_master WHERE type='table'"
                     ) as cursor:
@@ -3248,9 +4318,10 @@ class Core:
                         self.logger.error(f"{username}: Tên collection không hợp lệ: {collection_name}")
                         return {"error": "Tên collection không hợp lệ"}
 
-                    async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=15.0) as conn:
-                        await conn.execute("PRAGMA busy_timeout = 30000")
+                    created_ids = []
 
+                    async def write_op(conn):
+                        nonlocal created_ids
                         # Kiểm tra và tạo bảng nếu chưa tồn tại
                         async with conn.execute(
                             "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
@@ -3388,44 +4459,43 @@ class Core:
                                 columns = ", ".join(f'"{k}"' for k in batch[0].keys())
                                 placeholders = ", ".join("?" for _ in batch[0])
                                 values = [tuple(record.values()) for record in batch]
-                                max_retries = 3
-                                for attempt in range(max_retries):
-                                    try:
-                                        await conn.executemany(
-                                            f'INSERT OR REPLACE INTO "{collection_name}" ({columns}) VALUES ({placeholders})',
-                                            values
-                                        )
-                                        # Ghi log vào sync_log
-                                        for record in batch:
-                                            await conn.execute(
-                                                "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
-                                                "VALUES (?, ?, ?, ?, ?, ?)",
-                                                (
-                                                    str(uuid.uuid4()),
-                                                    collection_name,
-                                                    record["id"],
-                                                    "INSERT",
-                                                    int(time.time()),
-                                                    json.dumps(
-                                                        {"username": username, "action": "create_records_batch"},
-                                                        ensure_ascii=False
-                                                    )
-                                                )
+                                await conn.executemany(
+                                    f'INSERT OR REPLACE INTO "{collection_name}" ({columns}) VALUES ({placeholders})',
+                                    values
+                                )
+                                # Ghi log vào sync_log
+                                await conn.executemany(
+                                    "INSERT INTO sync_log (id, table_name, record_id, action, timestamp, details) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)",
+                                    [
+                                        (
+                                            str(uuid.uuid4()),
+                                            collection_name,
+                                            record["id"],
+                                            "INSERT",
+                                            int(time.time()),
+                                            json.dumps(
+                                                {"username": username, "action": "create_records_batch"},
+                                                ensure_ascii=False
                                             )
-                                        await conn.commit()
-                                        break
-                                    except aiosqlite.OperationalError as e:
-                                        if "database is locked" in str(e).lower() and attempt < max_retries - 1:
-                                            self.logger.warning(f"{username}: Cơ sở dữ liệu bị khóa, thử lại lần {attempt + 1}")
-                                            await asyncio.sleep(0.2 * (attempt + 1))
-                                            continue
-                                        raise
+                                        )
+                                        for record in batch
+                                    ]
+                                )
 
+                        created_ids = [record["id"] for record in valid_records]
                         self.logger.info(f"{username}: Đã tạo {len(valid_records)} bản ghi trong {collection_name}")
                         return {
                             "success": f"Đã tạo {len(valid_records)} bản ghi trong {collection_name}",
                             "created_count": len(valid_records)
                         }
+                    result = await self.sqlite_handler.enqueue_write(write_op)
+                    if collection_name == "users":
+                        self.sqlite_handler.invalidate_role_cache()
+                    elif collection_name == "qa_data":
+                        await self.sqlite_handler.refresh_qa_index(created_ids, username)
+                    self.sync_daemon.notify_change()
+                    return result
 
             except asyncio.TimeoutError as e:
                 self.logger.error(f"{username}: Timeout khi tạo bản ghi hàng loạt trong {collection_name}: {str(e)}")
@@ -3437,17 +4507,255 @@ class Core:
                 self.logger.error(f"{username}: Lỗi tạo bản ghi hàng loạt trong {collection_name}: {str(e)}")
                 return {"error": f"Lỗi tạo bản ghi hàng loạt: {str(e)}"}
 
-        return await self.sqlite_handler.enqueue_write(create_batch_impl)
+        return await create_batch_impl()
+
+    def get_cache_stats(self) -> Dict:
+        """Thống kê hit/miss của các cache trong bộ nhớ."""
+        return {
+            "session_cache": self.sqlite_handler.session_cache.stats(),
+            "role_cache": self.sqlite_handler.role_cache.stats(),
+            "qa_index": self.sqlite_handler.qa_index.stats(),
+            "qa_answer_cache": self.sqlite_handler.qa_answer_cache.stats(),
+            "vector_store": self.vector_store.stats()
+        }
+
+    async def search_qa_fts(
+        self,
+        username: str,
+        query: str,
+        threshold: float = 0.0,
+        limit: Optional[int] = None,
+        conn: Optional[aiosqlite.Connection] = None
+    ) -> List[Dict]:
+        """Tìm qa_data của user bằng FTS5, xếp hạng bm25 có trọng số theo cột.
+
+        Điểm trả về ("score", thang 0-100 như fuzzy search) là tỉ lệ token của
+        câu truy vấn có mặt trong bản ghi, so với threshold theo thang 0-1.
+        Với limit, chỉ QA_FTS_CANDIDATES kết quả bm25 tốt nhất được xét.
+        """
+        match_query = compile_qa_query(query)
+        if not match_query:
+            return []
+        w_question, w_answer, w_category = Config.QA_FTS_WEIGHTS
+        candidates = max(limit, Config.QA_FTS_CANDIDATES) if limit else -1
+
+        async def run(conn) -> List[Dict]:
+            async with conn.execute(
+                """
+                SELECT qa_data.id, qa_data.question, qa_data.answer, qa_data.category,
+                       qa_data.created_by, qa_data.created_at, qa_data.timestamp,
+                       bm25(qa_fts, ?, ?, ?) AS rank_score
+                FROM qa_fts
+                JOIN qa_data ON qa_fts.rowid = qa_data.rowid
+                WHERE qa_fts MATCH ? AND qa_data.created_by = ?
+                ORDER BY rank_score, qa_data.timestamp DESC
+                LIMIT ?
+                """,
+                (w_question, w_answer, w_category, match_query, username, candidates)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            results = []
+            for row in rows:
+                coverage = token_coverage(query, row[1:4])
+                if coverage < threshold:
+                    continue
+                record = dict(zip(QA_INDEX_FIELDS, row[:7]))
+                record["score"] = round(coverage * 100, 1)
+                results.append(record)
+                if limit and len(results) >= limit:
+                    break
+            return results
+
+        if conn is not None:
+            results = await run(conn)
+        else:
+            async with self.db_pool.reader() as conn:
+                results = await run(conn)
+        self.logger.info(
+            f"{username}: FTS5 tìm thấy {len(results)} kết quả đạt ngưỡng {threshold} cho '{query}'"
+        )
+        return results
+
+    async def fuzzy_search_qa(
+        self,
+        username: str,
+        query: str,
+        threshold: float,
+        limit: Optional[int] = None,
+        conn: Optional[aiosqlite.Connection] = None
+    ) -> List[Dict]:
+        """Fuzzy search qa_data của user qua chỉ mục QA trong bộ nhớ.
+
+        Chỉ mục được dựng lười từ toàn bộ qa_data của user (không giới hạn
+        1000 bản ghi); ứng viên lấy từ chỉ mục trigram rồi chấm điểm ngoài
+        event loop. Kết quả sắp theo (score, timestamp) giảm dần.
+        """
+        search_lower = normalize_qa_text(query)
+        if not search_lower:
+            return []
+
+        async def load_records(conn) -> List[Dict]:
+            records = []
+            async with conn.execute(
+                f"SELECT {', '.join(QA_INDEX_FIELDS)} FROM qa_data WHERE created_by = ?",
+                (username,)
+            ) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(Config.FUZZY_SCAN_CHUNK)
+                    if not rows:
+                        break
+                    records.extend(dict(zip(QA_INDEX_FIELDS, row)) for row in rows)
+            return records
+
+        async def loader() -> List[Dict]:
+            if conn is not None:
+                return await load_records(conn)
+            async with self.db_pool.reader() as reader:
+                return await load_records(reader)
+
+        index = await self.sqlite_handler.qa_index.get(username, loader)
+        candidate_ids = index.candidates(search_lower, Config.QA_INDEX_MAX_CANDIDATES)
+        scores = await self.fuzzy_matcher.score(
+            search_lower,
+            [index.normalized[record_id][0] for record_id in candidate_ids],
+            [index.normalized[record_id][1] for record_id in candidate_ids],
+            threshold
+        )
+        matches = [
+            {**index.records[candidate_ids[position]], "score": round(score, 1)}
+            for position, score in scores.items()
+        ]
+        matches.sort(key=lambda x: (x["score"], x["timestamp"] or 0), reverse=True)
+        self.logger.info(
+            f"{username}: Fuzzy tìm thấy {len(matches)} kết quả trên "
+            f"{len(candidate_ids)}/{len(index)} ứng viên"
+        )
+        return matches[:limit] if limit else matches
+
+    async def vector_search_qa(
+        self,
+        username: str,
+        query: str,
+        limit: int,
+        threshold: float = Config.VECTOR_SEARCH_THRESHOLD
+    ) -> List[Dict]:
+        """Tìm qa_data của user theo cosine embedding (top-k trên ma trận trong bộ nhớ).
+
+        Điểm trả về ("score", thang 0-100) là cosine x 100; threshold theo thang 0-1.
+        Trả về [] nếu truy hồi vector bị tắt hoặc thiếu NumPy.
+        """
+        hits = await self.vector_store.search(username, query, limit, threshold)
+        if not hits:
+            return []
+        ids = [record_id for record_id, _ in hits]
+        async with self.db_pool.reader() as conn:
+            async with conn.execute(
+                f"SELECT {', '.join(QA_INDEX_FIELDS)} FROM qa_data "
+                f"WHERE id IN ({', '.join('?' for _ in ids)}) AND created_by = ?",
+                (*ids, username)
+            ) as cursor:
+                records = {row[0]: dict(zip(QA_INDEX_FIELDS, row)) for row in await cursor.fetchall()}
+        matches = [
+            {**records[record_id], "score": round(score * 100, 1)}
+            for record_id, score in hits
+            if record_id in records
+        ]
+        self.logger.info(f"{username}: Vector tìm thấy {len(matches)} kết quả cho '{query}'")
+        return matches
+
+    async def _run_retrieval_stage(self, username: str, stage: str, coro) -> Optional[List[Dict]]:
+        """Chạy một stage trong ngân sách thời gian; quá hạn hoặc lỗi thì trả None.
+
+        Stage quá hạn (thường do dựng chỉ mục lần đầu) không bị hủy mà tiếp tục
+        chạy nền để chỉ mục kịp sẵn sàng cho lượt sau.
+        """
+        task = asyncio.ensure_future(coro)
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(Config.RETRIEVAL_STAGE_BUDGETS.get(stage, 1.0)):
+                results = await asyncio.shield(task)
+            self.retrieval_latency[stage].record((time.perf_counter() - started) * 1000)
+            return results
+        except TimeoutError:
+            self.retrieval_timeouts[stage] += 1
+            self._retrieval_tasks.add(task)
+            task.add_done_callback(self._retrieval_tasks.discard)
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.logger.warning(f"{username}: Stage {stage} vượt ngân sách thời gian, bỏ qua lượt này")
+        except Exception as e:
+            self.logger.warning(f"{username}: Lỗi stage {stage}: {str(e)}")
+        return None
+
+    async def retrieve_qa(
+        self,
+        username: str,
+        query: str,
+        threshold: float,
+        limit: int,
+        stages: Optional[List[str]] = None
+    ) -> Tuple[List[Dict], List[str]]:
+        """Truy hồi qa_data bằng FTS5, fuzzy và vector chạy đồng thời, gộp bằng RRF.
+
+        Thứ tự theo reciprocal rank fusion; "score" (0-100) là điểm đã hiệu
+        chỉnh về thang chung và phải đạt threshold (thang 0-1). Trả về
+        (kết quả, các stage quá hạn/lỗi); kết quả thiếu stage không nên cache.
+        """
+        stage_limit = max(limit, Config.RETRIEVAL_STAGE_LIMIT)
+        runners = {
+            "fts": lambda: self.search_qa_fts(username, query, threshold, limit=stage_limit),
+            "fuzzy": lambda: self.fuzzy_search_qa(username, query, threshold, limit=stage_limit),
+            "vector": lambda: self.vector_search_qa(username, query, stage_limit),
+        }
+        stages = [stage for stage in (stages or runners) if stage in runners]
+        if "vector" in stages and not self.vector_store.enabled:
+            stages.remove("vector")
+        results = await asyncio.gather(
+            *(self._run_retrieval_stage(username, stage, runners[stage]()) for stage in stages)
+        )
+        degraded = [stage for stage, found in zip(stages, results) if found is None]
+        ranked = {stage: found for stage, found in zip(stages, results) if found is not None}
+        fused = [
+            match for match in reciprocal_rank_fusion(ranked)
+            if match["score"] >= threshold * 100
+        ][:limit]
+        self.logger.info(
+            f"{username}: Truy hồi QA '{query}': "
+            + ", ".join(f"{stage}={len(found)}" for stage, found in ranked.items())
+            + f" -> {len(fused)} kết quả"
+            + (f" (thiếu stage {degraded})" if degraded else "")
+        )
+        return fused, degraded
+
+    def get_retrieval_metrics(self) -> Dict:
+        """Độ trễ và số lần quá ngân sách của từng stage truy hồi QA."""
+        return {
+            stage: {**self.retrieval_latency[stage].stats(), "timeouts": self.retrieval_timeouts[stage]}
+            for stage in self.retrieval_latency
+        }
+
+    def record_llm_latency(self, ttft_ms: Optional[float], total_ms: float):
+        """Ghi nhận độ trễ một lần gọi LLM (ttft_ms=None nếu không có token nào)."""
+        if ttft_ms is not None:
+            self.llm_ttft.record(ttft_ms)
+        self.llm_total.record(total_ms)
+
+    def get_llm_metrics(self) -> Dict:
+        """Thống kê TTFT và tổng độ trễ của các lần gọi LLM gần nhất."""
+        return {
+            "ttft": self.llm_ttft.stats(),
+            "total": self.llm_total.stats(),
+            "cache": self.llm_cache.stats()
+        }
 
     async def cleanup_sync_log(self, days_old=7):
         """Xóa sync_log cũ hơn X ngày."""
         try:
             current_time = int(time.time())
             old_threshold = current_time - (days_old * 24 * 3600)
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
+            async def write_op(conn):
                 await conn.execute("DELETE FROM sync_log WHERE timestamp < ?", (old_threshold,))
-                await conn.commit()
                 self.logger.info(f"Đã xóa sync_log cũ (> {days_old} ngày)")
+            return await self.sqlite_handler.enqueue_write(write_op)
         except Exception as e:
             self.logger.warning(f"Lỗi cleanup sync_log: {str(e)}")
 
@@ -3467,7 +4775,7 @@ class Core:
             message_id = str(uuid.uuid4())
             current_time = int(time.time())
 
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+            async def write_op(conn):
                 await conn.execute(
                     """
                     INSERT INTO chat_messages 
@@ -3509,7 +4817,7 @@ class Core:
                         ),
                     ),
                 )
-                await conn.commit()
+            await self.sqlite_handler.enqueue_write(write_op)
 
             self.logger.info(f"{username}: Đã lưu tin nhắn chat với ID {message_id}")
 
@@ -3539,7 +4847,8 @@ class Core:
 
             record_ids = []
             file_urls = []
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+            async def write_op(conn):
+                nonlocal record_ids, file_urls
                 # Truy vấn id và file_url từ chat_messages
                 async with conn.execute(
                     """
@@ -3587,8 +4896,7 @@ class Core:
                             json.dumps(details, ensure_ascii=False),
                         ),
                     )
-
-                await conn.commit()
+            await self.sqlite_handler.enqueue_write(write_op)
 
             self.logger.info(
                 f"{username}: Đã xóa {len(record_ids)} tin nhắn, ghi sync_log, giữ lại file vật lý"
@@ -63,6 +63,9 @@ async def lifespan(app: FastAPI):
 
         logger.info("Bắt đầu khởi tạo ứng dụng")
         await core.init_sqlite()
+        if core.firestore_available:
+            await core.firestore_handler.probe_health()
+        core.firestore_handler.start_health_monitor()
         if core.firestore_available:
             logger.info("Firestore khả dụng, kiểm tra quyền admin")
             if await core.sqlite_handler.has_permission("admin", "sync_data"):
@@ -76,6 +79,10 @@ async def lifespan(app: FastAPI):
                 logger.warning("Tài khoản admin không có quyền đồng bộ, bỏ qua")
         else:
             logger.warning("Firestore không khả dụng, chạy với SQLite cục bộ")
+        # Đồng bộ nền định kỳ; tự bỏ qua các chu kỳ Firestore không khả dụng
+        core.sync_daemon.start()
+        if core.firestore_available and core.firestore_listener.enabled:
+            await core.firestore_listener.start()
 
         logger.info("Khởi tạo ứng dụng thành công")
         yield
@@ -86,6 +93,13 @@ async def lifespan(app: FastAPI):
             print(f"Lỗi lifespan (logger chưa sẵn sàng): {str(e)}")
         raise
     finally:
+        await core.firestore_listener.stop()
+        await core.sync_daemon.stop()
+        await core.firestore_handler.stop_health_monitor()
+        await core.vector_store.drain()
+        await core.sqlite_handler.stop()
+        await core.db_pool.close()
+        core.fuzzy_matcher.close()
         if logger:
             logger.info("Kết thúc lifespan")
 
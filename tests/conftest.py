@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Config đọc biến môi trường khi import: trỏ SQLite vào thư mục tạm trước khi import core
+os.environ.setdefault("SQLITE_DB_PATH", os.path.join(tempfile.mkdtemp(), "app.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,285 @@
+"""Firestore giả lập trong bộ nhớ cho test đồng bộ.
+
+Hỗ trợ tập con API mà FirestoreHandler/FirestoreBatchWriter/FirestoreListener
+dùng: collection/document, where(filter=FieldFilter) nhiều điều kiện, order_by,
+start_at/start_after (snapshot hoặc dict cursor), limit, stream, count(),
+batch, collections() và on_snapshot. Ghi qua _set/_delete (hoặc WriteBatch)
+phát sự kiện ADDED/MODIFIED/REMOVED tới các listener đang đăng ký, đồng bộ
+trên thread gọi như client thật. SERVER_TIMESTAMP được thay bằng đồng hồ
+server giả tăng dần mỗi lần ghi.
+"""
+import asyncio
+import copy
+import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+
+_OPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": lambda a, b: a == b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+}
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentRef", data: Optional[Dict]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict]:
+        return copy.deepcopy(self._data)
+
+    def get(self, field: str) -> Any:
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentRef:
+    def __init__(self, client: "FakeFirestore", collection_name: str, doc_id: str):
+        self.client = client
+        self.collection_name = collection_name
+        self.id = doc_id
+
+    async def get(self) -> FakeSnapshot:
+        self.client.reads += 1
+        return FakeSnapshot(self, copy.deepcopy(self.client.data.get(self.collection_name, {}).get(self.id)))
+
+    async def set(self, data: Dict, merge: bool = False) -> None:
+        self.client.writes += 1
+        self.client._set(self.collection_name, self.id, data, merge)
+
+    async def delete(self) -> None:
+        self.client.writes += 1
+        self.client._delete(self.collection_name, self.id)
+
+
+class _AggregateResult:
+    def __init__(self, value: int):
+        self.value = value
+
+
+class _CountQuery:
+    def __init__(self, query: "FakeQuery"):
+        self.query = query
+
+    async def get(self):
+        return [[_AggregateResult(len(self.query._documents()))]]
+
+
+class FakeQuery:
+    def __init__(
+        self,
+        client: "FakeFirestore",
+        collection_name: str,
+        filters: tuple = (),
+        order: Optional[str] = None,
+        cursor: Any = None,
+        inclusive: bool = False,
+        limit: Optional[int] = None
+    ):
+        self.client = client
+        self.collection_name = collection_name
+        self.filters = tuple(filters)
+        self.order = order
+        self.cursor = cursor
+        self.inclusive = inclusive
+        self.limit_count = limit
+
+    def _copy(self, **changes) -> "FakeQuery":
+        state = dict(
+            filters=self.filters, order=self.order, cursor=self.cursor,
+            inclusive=self.inclusive, limit=self.limit_count
+        )
+        state.update(changes)
+        return FakeQuery(self.client, self.collection_name, **state)
+
+    def where(self, filter=None) -> "FakeQuery":
+        return self._copy(filters=self.filters + (filter,))
+
+    def order_by(self, field_path: str, direction=None) -> "FakeQuery":
+        return self._copy(order=field_path)
+
+    def start_after(self, cursor) -> "FakeQuery":
+        return self._copy(cursor=cursor, inclusive=False)
+
+    def start_at(self, cursor) -> "FakeQuery":
+        return self._copy(cursor=cursor, inclusive=True)
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit=count)
+
+    def count(self) -> _CountQuery:
+        return _CountQuery(self)
+
+    def matches(self, data: Optional[Dict]) -> bool:
+        if data is None:
+            return False
+        return all(_OPS[f.op_string](data.get(f.field_path), f.value) for f in self.filters)
+
+    def _sort_key(self, doc_id: str, data: Dict) -> tuple:
+        if self.order in (None, "__name__"):
+            return (doc_id,)
+        value = data.get(self.order)
+        return (value is not None, value, doc_id)
+
+    def _cursor_key(self) -> tuple:
+        if isinstance(self.cursor, FakeSnapshot):
+            return self._sort_key(self.cursor.id, self.cursor._data or {})
+        name = self.cursor.get("__name__", "")
+        name = getattr(name, "id", name)
+        if self.order in (None, "__name__"):
+            return (name,)
+        # Cursor theo giá trị trường không kèm tên: bắt đầu từ đầu nhóm bằng nhau
+        return (True, self.cursor.get(self.order), name)
+
+    def _documents(self) -> List[tuple]:
+        items = [
+            (doc_id, data)
+            for doc_id, data in self.client.data.get(self.collection_name, {}).items()
+            if self.matches(data)
+        ]
+        items.sort(key=lambda item: self._sort_key(*item))
+        if self.cursor is not None:
+            start = self._cursor_key()
+            items = [
+                item for item in items
+                if (self._sort_key(*item) >= start if self.inclusive else self._sort_key(*item) > start)
+            ]
+        if self.limit_count is not None:
+            items = items[:self.limit_count]
+        return items
+
+    async def stream(self):
+        await asyncio.sleep(0)
+        for doc_id, data in self._documents():
+            self.client.reads += 1
+            yield FakeSnapshot(FakeDocumentRef(self.client, self.collection_name, doc_id), copy.deepcopy(data))
+
+    def on_snapshot(self, callback) -> "FakeWatch":
+        return self.client._listen(self, callback)
+
+
+class FakeCollectionRef(FakeQuery):
+    def __init__(self, client: "FakeFirestore", collection_name: str):
+        super().__init__(client, collection_name)
+        self.id = collection_name
+
+    def document(self, doc_id: str) -> FakeDocumentRef:
+        return FakeDocumentRef(self.client, self.collection_name, doc_id)
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "FakeFirestore"):
+        self.client = client
+        self.ops: List[tuple] = []
+
+    def set(self, reference: FakeDocumentRef, data: Dict, merge: bool = False) -> None:
+        self.ops.append(("set", reference, data, merge))
+
+    def delete(self, reference: FakeDocumentRef) -> None:
+        self.ops.append(("delete", reference, None, False))
+
+    async def commit(self) -> None:
+        assert len(self.ops) <= 500, "WriteBatch vượt 500 thao tác"
+        await asyncio.sleep(0)
+        self.client.commits += 1
+        for kind, reference, data, merge in self.ops:
+            self.client.writes += 1
+            if kind == "set":
+                self.client._set(reference.collection_name, reference.id, data, merge)
+            else:
+                self.client._delete(reference.collection_name, reference.id)
+
+
+class _ChangeType:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeChange:
+    def __init__(self, kind: str, document: FakeSnapshot):
+        self.type = _ChangeType(kind)
+        self.document = document
+
+
+class FakeWatch:
+    def __init__(self, client: "FakeFirestore", query: FakeQuery, callback):
+        self.client = client
+        self.query = query
+        self.callback = callback
+
+    def unsubscribe(self) -> None:
+        if self in self.client.watches:
+            self.client.watches.remove(self)
+
+
+class FakeFirestore:
+    """Client Firestore giả lập, dùng được cả làm AsyncClient lẫn client on_snapshot."""
+
+    def __init__(self):
+        self.data: Dict[str, Dict[str, Dict]] = {}
+        self.reads = 0
+        self.writes = 0
+        self.commits = 0
+        self.watches: List[FakeWatch] = []
+        self.server_time = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def collection(self, name: str) -> FakeCollectionRef:
+        return FakeCollectionRef(self, name)
+
+    async def collections(self):
+        for name in list(self.data):
+            yield FakeCollectionRef(self, name)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def _notify(self, collection_name: str, doc_id: str, kind: str, previous: Optional[Dict]) -> None:
+        data = self.data.get(collection_name, {}).get(doc_id)
+        for watch in list(self.watches):
+            if watch.query.collection_name != collection_name:
+                continue
+            if kind == "REMOVED":
+                if not watch.query.matches(previous):
+                    continue
+                data = previous
+            elif not watch.query.matches(data):
+                continue
+            snapshot = FakeSnapshot(FakeDocumentRef(self, collection_name, doc_id), copy.deepcopy(data))
+            watch.callback([snapshot], [FakeChange(kind, snapshot)], None)
+
+    def _set(self, collection_name: str, doc_id: str, data: Dict, merge: bool = False) -> None:
+        data = copy.deepcopy(data)
+        for field, value in data.items():
+            if value is SERVER_TIMESTAMP:
+                self.server_time += datetime.timedelta(microseconds=1)
+                data[field] = self.server_time
+        documents = self.data.setdefault(collection_name, {})
+        existed = doc_id in documents
+        if merge and existed:
+            documents[doc_id].update(copy.deepcopy(data))
+        else:
+            documents[doc_id] = copy.deepcopy(data)
+        self._notify(collection_name, doc_id, "MODIFIED" if existed else "ADDED", None)
+
+    def _delete(self, collection_name: str, doc_id: str) -> None:
+        previous = self.data.get(collection_name, {}).pop(doc_id, None)
+        if previous is not None:
+            self._notify(collection_name, doc_id, "REMOVED", previous)
+
+    def _listen(self, query: FakeQuery, callback) -> FakeWatch:
+        watch = FakeWatch(self, query, callback)
+        self.watches.append(watch)
+        snapshots = [
+            FakeSnapshot(FakeDocumentRef(self, query.collection_name, doc_id), copy.deepcopy(data))
+            for doc_id, data in query._documents()
+        ]
+        callback(snapshots, [FakeChange("ADDED", snapshot) for snapshot in snapshots], None)
+        return watch
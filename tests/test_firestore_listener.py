@@ -0,0 +1,150 @@
+import asyncio
+
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+
+from config import Config
+from core import Core
+from utils.firestore_listener import FirestoreListener
+from utils.sqlite_pool import SQLitePool
+from fake_firestore import FakeFirestore
+
+USERNAME = Config.SYNC_DAEMON_USERNAME
+OTHER = "otheruser"
+
+
+def qa_doc(doc_id: str, owner: str, timestamp: int, answer: str = "A") -> dict:
+    return {
+        "id": doc_id,
+        "question": f"Câu hỏi {doc_id}",
+        "answer": answer,
+        "category": "test",
+        "created_by": owner,
+        "created_at": timestamp,
+        "timestamp": timestamp,
+        Config.SYNC_VERSION_FIELD: SERVER_TIMESTAMP,
+    }
+
+
+async def open_core(db_path: str, fs: FakeFirestore) -> Core:
+    core = Core()
+    core.db_pool = SQLitePool(db_path)
+    await core.init_sqlite()
+    handler = core.firestore_handler
+    handler.db = fs
+    handler.watch_db = fs
+    handler.firestore_available = True
+    core.firestore_listener = FirestoreListener(core, username=USERNAME, collections=["qa_data"])
+    return core
+
+
+async def close_core(core: Core) -> None:
+    await core.firestore_listener.stop()
+    await core.vector_store.drain()
+    core.fuzzy_matcher.close()
+    await core.sqlite_handler.stop()
+    await core.db_pool.close()
+
+
+async def fetch(core: Core, sql: str, params: tuple = ()) -> list:
+    async with core.db_pool.reader() as conn:
+        async with conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+
+async def wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        assert asyncio.get_running_loop().time() < deadline, "Hết thời gian chờ listener"
+        await asyncio.sleep(0.02)
+
+
+def test_listener_query_filters_owner_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SQLITE_DB_PATH", str(tmp_path / "app.db"))
+
+    async def scenario():
+        fs = FakeFirestore()
+        core = await open_core(str(tmp_path / "app.db"), fs)
+        try:
+            handler = core.firestore_handler
+            query = handler.build_listener_query(fs, "qa_data", USERNAME)
+            filters = [(f.field_path, f.op_string, f.value) for f in query.filters]
+            assert filters == [("created_by", "==", USERNAME)]
+
+            query = handler.build_listener_query(fs, "users", USERNAME)
+            assert list(query.filters) == []
+        finally:
+            await close_core(core)
+
+    asyncio.run(scenario())
+
+
+def test_on_snapshot_changes_are_applied_through_listener(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SQLITE_DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setattr(Config, "SYNC_LISTENER_ENABLED", True)
+    monkeypatch.setattr(Config, "SYNC_LISTENER_FLUSH_DELAY", 0.01)
+
+    async def scenario():
+        fs = FakeFirestore()
+        fs._set("qa_data", "mine", qa_doc("mine", USERNAME, 1000))
+        fs._set("qa_data", "theirs", qa_doc("theirs", OTHER, 1000))
+        core = await open_core(str(tmp_path / "app.db"), fs)
+        listener = core.firestore_listener
+        try:
+            assert await listener.start()
+
+            async def answer_of(doc_id):
+                rows = await fetch(core, "SELECT answer FROM qa_data WHERE id = ?", (doc_id,))
+                return rows[0][0] if rows else None
+
+            # Snapshot ban đầu chỉ chứa tài liệu của user
+            async def initial_applied():
+                return await answer_of("mine") == "A"
+            await wait_for(initial_applied)
+            assert await answer_of("theirs") is None
+
+            fs._set(
+                "qa_data", "mine",
+                {"answer": "B", "timestamp": 2000, Config.SYNC_VERSION_FIELD: SERVER_TIMESTAMP},
+                merge=True
+            )
+            version = core.firestore_handler._version_of(fs.data["qa_data"]["mine"][Config.SYNC_VERSION_FIELD])
+
+            async def modified_applied():
+                return await answer_of("mine") == "B"
+            await wait_for(modified_applied)
+
+            fs._delete("qa_data", "mine")
+
+            # Bộ đếm chỉ tăng sau khi apply_listener_changes trả về
+            async def removed_applied():
+                return await answer_of("mine") is None and listener.removed == 1
+            await wait_for(removed_applied)
+
+            checkpoints = await fetch(
+                core,
+                "SELECT scope, last_timestamp, cursor_field FROM sync_checkpoints "
+                "WHERE collection = 'qa_data' AND direction = 'listen'"
+            )
+            assert checkpoints == [(USERNAME, version, Config.SYNC_VERSION_FIELD)]
+
+            # Tài liệu ghi lúc listener dừng, mang timestamp cũ hơn checkpoint
+            await listener.stop()
+            fs._set("qa_data", "offline", qa_doc("offline", USERNAME, 500, answer="E"))
+            assert await listener.start()
+
+            async def offline_applied():
+                return await answer_of("offline") == "E"
+            await wait_for(offline_applied)
+
+            # Sau khi khởi động lại vẫn chỉ nghe tài liệu của user
+            fs._set("qa_data", "theirs", qa_doc("theirs", OTHER, 3000, answer="C"))
+            fs._set("qa_data", "new", qa_doc("new", USERNAME, 3000, answer="D"))
+
+            async def new_applied():
+                return await answer_of("new") == "D"
+            await wait_for(new_applied)
+            assert await answer_of("theirs") is None
+        finally:
+            await close_core(core)
+
+    asyncio.run(scenario())
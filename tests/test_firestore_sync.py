@@ -0,0 +1,99 @@
+import asyncio
+
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+
+from config import Config
+from core import Core
+from utils.sqlite_pool import SQLitePool
+from fake_firestore import FakeFirestore
+
+USERNAME = Config.SYNC_DAEMON_USERNAME
+OTHER = "otheruser"
+
+
+def qa_doc(doc_id: str, owner: str, timestamp: int, answer: str = "A") -> dict:
+    """Tài liệu qa_data như được node khác đẩy lên (kèm phiên bản server)."""
+    return {
+        "id": doc_id,
+        "question": f"Câu hỏi {doc_id}",
+        "answer": answer,
+        "category": "test",
+        "created_by": owner,
+        "created_at": timestamp,
+        "timestamp": timestamp,
+        Config.SYNC_VERSION_FIELD: SERVER_TIMESTAMP,
+    }
+
+
+async def open_core(db_path: str, fs: FakeFirestore) -> Core:
+    core = Core()
+    core.db_pool = SQLitePool(db_path)
+    await core.init_sqlite()
+    handler = core.firestore_handler
+    handler.db = fs
+    handler.firestore_available = True
+    return core
+
+
+async def close_core(core: Core) -> None:
+    await core.vector_store.drain()
+    core.fuzzy_matcher.close()
+    await core.sqlite_handler.stop()
+    await core.db_pool.close()
+
+
+async def qa_ids(core: Core) -> set:
+    async with core.db_pool.reader() as conn:
+        async with conn.execute("SELECT id FROM qa_data") as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+
+def test_delta_pull_keeps_late_document_with_old_timestamp(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SQLITE_DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setattr(Config, "SYNC_WATERMARK_SLACK", 0)
+
+    async def scenario():
+        fs = FakeFirestore()
+        for i in range(3):
+            fs._set("qa_data", f"doc{i}", qa_doc(f"doc{i}", USERNAME, 100_000 + i))
+        fs._set("qa_data", "theirs", qa_doc("theirs", OTHER, 100_000))
+        core = await open_core(str(tmp_path / "app.db"), fs)
+        try:
+            result = await core.firestore_handler.sync_to_sqlite(USERNAME, specific_collections=["qa_data"])
+            assert "success" in result
+            assert await qa_ids(core) == {"doc0", "doc1", "doc2"}
+
+            # Node khác đẩy bản ghi tạo lúc offline: timestamp cũ hơn mốc đã kéo
+            fs._set("qa_data", "late", qa_doc("late", USERNAME, 50_000))
+            result = await core.firestore_handler.sync_to_sqlite(USERNAME, specific_collections=["qa_data"])
+            assert "success" in result
+            assert "late" in await qa_ids(core)
+            # Lượt sau chỉ kéo delta theo phiên bản server: tài liệu ở mốc và tài liệu mới
+            assert result["collections"]["qa_data"]["documents"] == 2
+            assert "theirs" not in await qa_ids(core)
+        finally:
+            await close_core(core)
+
+    asyncio.run(scenario())
+
+
+def test_push_stamps_server_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SQLITE_DB_PATH", str(tmp_path / "app.db"))
+
+    async def scenario():
+        fs = FakeFirestore()
+        core = await open_core(str(tmp_path / "app.db"), fs)
+        try:
+            created = await core.create_records_batch(
+                "qa_data", [{"question": "Q", "answer": "A", "category": "x"}], USERNAME
+            )
+            assert "error" not in created
+            result = await core.firestore_handler.sync_from_sqlite(USERNAME, specific_collections=["qa_data"])
+            assert "success" in result
+            docs = list(fs.data["qa_data"].values())
+            assert len(docs) == 1
+            assert docs[0][Config.SYNC_VERSION_FIELD].tzinfo is not None
+        finally:
+            await close_core(core)
+
+    asyncio.run(scenario())
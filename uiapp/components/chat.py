@@ -2,7 +2,7 @@
 from nicegui import ui, context, app
 import mimetypes
 import os
-from typing import List, Dict, Callable, Optional
+from typing import List, Dict, Callable, Optional, Tuple
 import asyncio
 import time
 import aiosqlite
@@ -14,6 +14,8 @@ import io
 
 from utils.logging import get_logger
 from utils.core_common import validate_name, check_disk_space
+from utils.qa_index import normalize_qa_text
+from utils.llm_cache import LLMResponseCache
 from config import Config
 from jsonschema import validate, ValidationError as JSONSchemaValidationError
 from fuzzywuzzy import fuzz
@@ -139,7 +141,7 @@ class ChatComponent:
                     logger.error(f"{username}: Trạng thái quá lớn")
                     ui.notify(get_text(self.language, "state_too_large_error"), type="negative")
                     return False
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                async def write_op(conn):
                     state_id = hashlib.sha256(f"{username}_{self.client_state['session_token']}".encode()).hexdigest()
                     await conn.execute(
                         "INSERT OR REPLACE INTO client_states (id, username, session_token, state, timestamp) VALUES (?, ?, ?, ?, ?)",
@@ -168,7 +170,8 @@ class ChatComponent:
                             }, ensure_ascii=False)
                         )
                     )
-                    await conn.commit()
+                await self.core.sqlite_handler.enqueue_write(write_op)
+                self.core.sqlite_handler.invalidate_session_cache(username, self.client_state["session_token"])
                 logger.info(f"{username}: Lưu cấu hình thành công, model={self.client_state['model']}, chat_mode={self.client_state['chat_mode']}")
                 return True
         except Exception as e:
@@ -185,7 +188,7 @@ class ChatComponent:
                     logger.warning(f"{username}: Phiên đăng nhập không hợp lệ")
                     ui.notify(get_text(self.language, "invalid_session"), type="negative")
                     return False
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                async def write_op(conn):
                     async with conn.execute(
                         "SELECT state FROM client_states WHERE session_token = ? AND username = ?",
                         (self.client_state["session_token"], username)
@@ -218,10 +221,10 @@ class ChatComponent:
                                     }, ensure_ascii=False)
                                 )
                             )
-                            await conn.commit()
                         else:
                             self.client_state.update(json.loads(row[0]))
                             self.client_state.pop("chat_messages", None)
+                await self.core.sqlite_handler.enqueue_write(write_op)
                 await self.load_messages_from_db(username)
                 await self.save_state_and_config(username)
                 success = await self.render()
@@ -249,8 +252,16 @@ class ChatComponent:
         context: str = "",
         username: str = "",
         file_url: str = None,
-        history_limit: int = 5
+        history_limit: int = 5,
+        on_delta: Optional[Callable] = None,
+        cache_prompt: Optional[str] = None,
+        cache_context: str = ""
     ) -> Dict:
+        """Gọi Grok; nếu có on_delta thì stream và gọi on_delta(text_tích_lũy) theo nhịp.
+
+        Khi có cache_prompt, phản hồi được tra/lưu trong cache LLM theo
+        (model, system prompt, cache_prompt, cache_context).
+        """
         if not self.groq_client:
             logger.error(f"{username}: GROQ_API_KEY không được cấu hình")
             ui.notify(
@@ -285,10 +296,10 @@ class ChatComponent:
             }
             validate({"message": message, "context": context, "file_url": file_url}, schema)
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S') 
-            system_prompt = Config.SYSTEM_PROMPTS.get(
+            base_system_prompt = Config.SYSTEM_PROMPTS.get(
                 self.language, Config.SYSTEM_PROMPTS["vi"]
             )
-            system_prompt += f"\nThời gian hiện tại là: {current_time}."  # Thêm dòng này
+            system_prompt = base_system_prompt + f"\nThời gian hiện tại là: {current_time}."  # Thêm dòng này
 
             messages = [{"role": "system", "content": system_prompt}]
 
@@ -317,19 +328,69 @@ class ChatComponent:
             if file_url and Config.GROK_VISION_ENABLED:
                 messages.append({"role": "user", "content": f"[File: {file_url}]"})
 
+            model = self.client_state.get("model", Config.DEFAULT_MODEL)
+            cache_key = None
+            if cache_prompt and self.core:
+                cache_key = LLMResponseCache.make_key(
+                    model, base_system_prompt, cache_prompt, cache_context
+                )
+                cached = await self.core.llm_cache.get(cache_key)
+                if cached:
+                    if on_delta:
+                        await on_delta(cached)
+                    logger.info(f"{username}: Grok trả từ cache LLM")
+                    return {"success": "Grok API thành công (cache)", "response": cached, "cached": True}
+
             # Grok call
+            stream = bool(on_delta) and Config.GROK_STREAM_ENABLED
+            started_at = time.perf_counter()
+            ttft_ms = None
             chat_completion = await self.groq_client.chat.completions.create(
                 messages=messages,
-                model=self.client_state.get("model", Config.DEFAULT_MODEL),
+                model=model,
                 temperature=0.7,
-                max_tokens=1000
+                max_tokens=1000,
+                stream=stream
+            )
+            if stream:
+                parts = []
+                last_flush = 0.0
+                async for chunk in chat_completion:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    now = time.perf_counter()
+                    if ttft_ms is None:
+                        ttft_ms = (now - started_at) * 1000
+                    parts.append(delta)
+                    # Gom delta để không đẩy cập nhật UI cho từng token
+                    if now - last_flush >= Config.GROK_STREAM_FLUSH_INTERVAL:
+                        last_flush = now
+                        await on_delta("".join(parts))
+                response = "".join(parts)
+                if response:
+                    await on_delta(response)
+            else:
+                response = chat_completion.choices[0].message.content or ""
+                ttft_ms = (time.perf_counter() - started_at) * 1000
+
+            total_ms = (time.perf_counter() - started_at) * 1000
+            if self.core:
+                self.core.record_llm_latency(ttft_ms, total_ms)
+            logger.info(
+                f"{username}: Grok latency ttft={ttft_ms or 0:.0f}ms, "
+                f"total={total_ms:.0f}ms, stream={stream}"
             )
-            response = chat_completion.choices[0].message.content
 
             if not response.strip():
                 logger.error(f"{username}: Phản hồi Grok rỗng")
                 return {"error": get_text(self.language, "grok_api_error")}
 
+            if cache_key:
+                await self.core.llm_cache.set(cache_key, model, response, total_ms)
+
             logger.info(f"{username}: Grok API thành công với {len(messages) - 1} messages")
             return {"success": "Grok API thành công", "response": response}
 
@@ -345,7 +406,7 @@ class ChatComponent:
         try:
             async with asyncio.timeout(10):
                 check_disk_space()
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                async def write_op(conn):
                     # Lấy danh sách tin nhắn của username
                     async with conn.execute(
                         """
@@ -395,16 +456,17 @@ class ChatComponent:
                         """
                         DELETE FROM sync_log 
                         WHERE table_name = ? 
-                        AND action IN ('sync_to_firestore', 'sync_to_sqlite')
-                        AND details LIKE ?
+                        AND action IN ('sync_to_firestore', 'sync_to_sqlite', 'sync_to_sqlite_page')
+                        AND username = ?
                         """,
-                        ("chat_messages", f'%{{"username": "{username}"%'),
+                        ("chat_messages", username),
                     )
-                    await conn.commit()
 
                     logger.debug(
                         f"{username}: Đã xóa {len(record_ids)} tin nhắn và log đồng bộ, giữ lại file vật lý"
                     )
+                    return record_ids
+                record_ids = await self.core.sqlite_handler.enqueue_write(write_op)
 
                 self.messages = []
                 self.displayed_message_ids.clear()
@@ -480,120 +542,45 @@ class ChatComponent:
                 f"Original='{question}', Cleaned='{clean_search}'"
             )
 
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
-                # FTS5 QUERY
-                try:
-                    fts_query = f'({clean_search}* OR "{clean_search}" OR {clean_search})'
-                    logger.debug(f"{username}: FTS query: {fts_query}")
-
-                    query = """
-                        SELECT qa_data.id, qa_data.question, qa_data.answer, qa_data.category,
-                               qa_data.created_by, qa_data.created_at, qa_data.timestamp
-                        FROM qa_fts
-                        JOIN qa_data ON qa_fts.rowid = qa_data.rowid
-                        WHERE qa_fts MATCH ? AND qa_data.created_by = ?
-                        ORDER BY rank, qa_data.timestamp DESC
-                        LIMIT ?
-                    """
-                    params = [fts_query, username, limit]
-                    cursor = await conn.execute(query, params)
-                    rows = await cursor.fetchall()
-
-                    if not rows:
-                        logger.info(
-                            f"{username}: FTS5 không tìm thấy kết quả cho '{clean_search}'"
-                        )
-                    else:
-                        logger.info(
-                            f"{username}: FTS5 tìm thấy {len(rows)} kết quả cho '{clean_search}'"
-                        )
-
-                    results = [
-                        {
-                            "id": row[0],
-                            "question": row[1],
-                            "answer": row[2],
-                            "category": row[3],
-                            "created_by": row[4],
-                            "created_at": row[5],
-                            "timestamp": row[6],
-                        }
-                        for row in rows
-                    ]
-
-                    if results:
-                        return results
-
-                except Exception as fts_error:
-                    logger.warning(
-                        f"{username}: Lỗi FTS5: {fts_error}. "
-                        "Fallback sang fuzzy search."
-                    )
-
-                # FALLBACK FUZZY SEARCH
-                async with conn.execute(
-                    """
-                    SELECT id, question, answer, category, created_by,
-                           created_at, timestamp
-                    FROM qa_data
-                    WHERE created_by = ?
-                    ORDER BY timestamp DESC
-                    LIMIT 1000
-                    """,
-                    (username,)
-                ) as cursor:
-                    all_rows = await cursor.fetchall()
-
-                if not all_rows:
-                    logger.info(f"{username}: Không có dữ liệu Q&A để fuzzy search.")
-                    return []
-
-                search_lower = clean_search
-                matches = []
-                for row in all_rows:
-                    q_lower = row[1].lower() if row[1] else ""
-                    a_lower = row[2].lower() if row[2] else ""
-                    max_ratio = max(
-                        fuzz.ratio(search_lower, q_lower),
-                        fuzz.ratio(search_lower, a_lower),
-                        fuzz.token_sort_ratio(search_lower, q_lower),
-                        fuzz.token_sort_ratio(search_lower, a_lower),
-                        fuzz.partial_ratio(search_lower, q_lower),
-                        fuzz.partial_ratio(search_lower, a_lower)
-                    )
-                    if max_ratio >= threshold * 100:
-                        matches.append(
-                            {
-                                "id": row[0],
-                                "question": row[1],
-                                "answer": row[2],
-                                "category": row[3],
-                                "created_by": row[4],
-                                "created_at": row[5],
-                                "timestamp": row[6],
-                                "score": round(max_ratio, 1),
-                            }
-                        )
-
-                matches.sort(key=lambda x: (x["score"], x["timestamp"]), reverse=True)
-                logger.info(
-                    f"{username}: Fuzzy tìm thấy {len(matches)} kết quả "
-                    f"trên {len(all_rows)} bản ghi cho '{clean_search}'"
-                )
-
-                return matches[:limit]
+            # Câu hỏi lặp lại được trả từ cache câu trả lời QA
+            handler = self.core.sqlite_handler
+            cache_key = (username, normalize_qa_text(clean_search), limit, threshold)
+            cached = handler.qa_answer_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"{username}: Cache QA hit cho '{clean_search}'")
+                return [dict(match) for match in cached]
+            generation = handler.qa_generation
+
+            results, degraded = await self._lookup_qa_matches(username, clean_search, limit, threshold)
+            # Kết quả thiếu stage (quá hạn/lỗi) không được cache để lượt sau truy hồi đủ
+            if not degraded and handler.qa_generation == generation:
+                handler.qa_answer_cache.set(cache_key, [dict(match) for match in results])
+            return results
 
         except Exception as e:
             logger.error(f"{username}: Lỗi fuzzy_match_question: {str(e)}", exc_info=True)
             return []
 
+    async def _lookup_qa_matches(
+        self,
+        username: str,
+        clean_search: str,
+        limit: int,
+        threshold: float
+    ) -> Tuple[List[Dict], List[str]]:
+        """Tra cứu qa_data: FTS5, fuzzy và vector chạy đồng thời, gộp bằng reciprocal rank fusion.
+
+        Trả về (kết quả, các stage quá hạn/lỗi).
+        """
+        return await self.core.retrieve_qa(username, clean_search, threshold, limit)
+
     
     
     
     
     async def load_messages_from_db(self, username: str):
         try:
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+            async with self.core.db_pool.reader() as conn:
                 async with conn.execute(
                     """
                     SELECT id, content, role, type, file_url, timestamp
@@ -623,6 +610,17 @@ class ChatComponent:
 
     
     
+    def _create_streaming_message(self, role: str):
+        """Tạo khung tin nhắn trợ lý rỗng để cập nhật dần theo stream."""
+        with self.messages_container:
+            bubble = ui.element("div").classes(
+                "p-1 sm:p-2 mb-1 rounded bg-green-100 self-start max-w-full "
+                "sm:max-w-[98%] whitespace-normal"
+            )
+            with bubble:
+                body = ui.markdown(f"**{role}**: ...").classes("text-sm whitespace-normal")
+        return bubble, body
+
     async def update_messages(self):
         username = self.client_state.get("username", "")
         if not self.rendered or not self.messages_container:
@@ -941,6 +939,7 @@ class ChatComponent:
 
             self.last_message_id = current_message_id
             self.loading = True
+            stream_bubble = None
 
             with self.container:
                 self.progress = ui.linear_progress().classes("w-full")
@@ -966,8 +965,13 @@ class ChatComponent:
                 await self.update_messages()
                 await self.scroll_to_bottom()
                 ui.notify(get_text(self.language, "processing_mode", mode=chat_mode), type="info")
+                ai_role = get_text(self.language, "ai_role_label")
+                stream_bubble, stream_body = self._create_streaming_message(ai_role)
                 ui.update()
 
+                async def on_delta(text: str):
+                    stream_body.set_content(f"**{ai_role}**: {text}")
+
                 # Process response
                 if chat_mode == "QA":
                     matches = await self.fuzzy_match_question(
@@ -982,7 +986,7 @@ class ChatComponent:
                         ui.notify(get_text(self.language, "no_qa_answer"), type="negative")
 
                 elif chat_mode == "Hybrid":
-                    # Tìm top 3 QA khớp nhất
+                    # Tìm top 3 QA khớp nhất (FTS5 + fuzzy + vector)
                     matches = await self.fuzzy_match_question(
                         "qa_data", message, username, limit=3, threshold=self.qa_threshold
                     )
@@ -992,11 +996,6 @@ class ChatComponent:
                         qa_context = "No relevant QA found."
                         ui.notify(get_text(self.language, "no_qa_answer"), type="warning")
                     else:
-                        # Ước lượng score nếu FTS không có
-                        for i, match in enumerate(matches):
-                            if "score" not in match:
-                                match["score"] = 90 - i * 10
-
                         qa_context_parts = []
                         for i, match in enumerate(matches):
                             truncated_question = (
@@ -1044,7 +1043,11 @@ class ChatComponent:
                         
                     )
                     
-                    result = await self.call_grok_api(hybrid_prompt, "", username)
+                    result = await self.call_grok_api(
+                        hybrid_prompt, "", username, on_delta=on_delta,
+                        cache_prompt=None if "Hybrid" in Config.LLM_CACHE_BYPASS_MODES else message,
+                        cache_context=qa_context
+                    )
                     response = result.get(
                         "response",
                         qa_context.split("\n")[0]
@@ -1074,13 +1077,17 @@ class ChatComponent:
                         f"Recent chat history:\n{recent_history}\n"
                         f"Answer based on chat history if possible, or general knowledge if not."
                     )
-                    result = await self.call_grok_api(grok_prompt, "chat", username)
+                    result = await self.call_grok_api(
+                        grok_prompt, "chat", username, on_delta=on_delta,
+                        cache_prompt=None if "Grok" in Config.LLM_CACHE_BYPASS_MODES else message,
+                        cache_context=recent_history
+                    )
                     response = result.get(
                         "response",
                         f"Error: {result.get('error', 'Unknown error')}",
                     )
 
-                # Save assistant message
+                # Lưu tin nhắn trợ lý một lần khi đã có nội dung đầy đủ
                 result = await self.core.add_chat_message(
                     username=username,
                     session_token=self.client_state["session_token"],
@@ -1090,84 +1097,21 @@ class ChatComponent:
                 )
                 assistant_message_id = result["message_id"]
 
+                stream_body.set_content(f"**{ai_role}**: {response}")
+                stream_bubble.props(f"id=message-{assistant_message_id}")
+                with stream_bubble:
+                    ui.label(
+                        f"({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(current_time))})"
+                    ).classes("text-xs text-gray-500")
                 self.messages.append({
                     "id": assistant_message_id,
-                    "content": "",
+                    "content": response,
                     "role": "assistant",
                     "type": "text",
                     "timestamp": current_time,
                 })
-                await self.update_messages()
-
-                from app import CHAT_COMPONENTS
-                CHAT_COMPONENTS[self.client_id] = self
-                app.storage.client[self.client_id] = {"client_id": self.client_id}
-
-                escaped_response = response.replace("'", "\\'").replace("\n", "\\n")
-                js_code = f"""
-                    (function() {{
-                        const element = document.getElementById('message-{assistant_message_id}');
-                        if (!element) {{
-                            console.error('Element message-{assistant_message_id} not found');
-                            return;
-                        }}
-                        let text = '{escaped_response}';
-                        let index = 0;
-                        element.innerHTML = '<strong>{get_text(self.language, "ai_role_label")}:</strong> ';
-                        function type() {{
-                            if (index < text.length) {{
-                                element.innerHTML += text[index];
-                                index++;
-                                setTimeout(type, 20);
-                            }} else {{
-                                element.innerHTML += '<br><span class="text-xs text-gray-500">'
-                                    + '({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(current_time))})'
-                                    + '</span>';
-                                fetch('/typing-complete/{assistant_message_id}', {{
-                                    method: 'POST',
-                                    headers: {{ 'Content-Type': 'application/json' }},
-                                    body: JSON.stringify({{
-                                        response: '{escaped_response}',
-                                        client_id: '{self.client_id}'
-                                    }})
-                                }}).then(response => response.json()).then(data => {{
-                                    if (data.success) {{
-                                        fetch('/update-ui', {{
-                                            method: 'POST',
-                                            headers: {{ 'Content-Type': 'application/json' }},
-                                            body: JSON.stringify({{ client_id: '{self.client_id}' }})
-                                        }}).catch(err => console.error('Failed to call /update-ui: ', err));
-                                    }}
-                                }}).catch(err => console.error('Failed to call /typing-complete: ', err));
-                            }}
-                        }}
-                        type();
-                    }})();
-                """
-
-                try:
-                    await ui.run_javascript(js_code, timeout=5.0)
-                    logger.info(
-                        f"{username}: JavaScript sent for typing effect, "
-                        f"message_id={assistant_message_id}"
-                    )
-                except TimeoutError as e:
-                    logger.warning(
-                        f"{username}: JavaScript timeout for message_id={assistant_message_id}: {str(e)}"
-                    )
-
-                async def fallback_update():
-                    await asyncio.sleep(30)
-                    for msg in self.messages:
-                        if msg["id"] == assistant_message_id and not msg["content"]:
-                            msg["content"] = response
-                            await self.update_messages()
-                            logger.warning(
-                                f"{username}: JavaScript timeout, updated assistant message manually"
-                            )
-                            break
-
-                asyncio.create_task(fallback_update())
+                self.displayed_message_ids.add(assistant_message_id)
+                stream_bubble = None
 
                 self.messages = self.messages[-self.message_limit:]
                 self.message_input.value = ""
@@ -1176,6 +1120,8 @@ class ChatComponent:
 
             except Exception as e:
                 logger.error(f"{username}: Error sending message: {str(e)}", exc_info=True)
+                if stream_bubble is not None:
+                    stream_bubble.delete()
                 result = await self.core.add_chat_message(
                     username=username,
                     session_token=self.client_state["session_token"],
@@ -668,7 +668,7 @@ class HeaderComponent:
             logger.debug(f"{self.username}: Sử dụng dữ liệu người dùng từ cache")
             return self.cached_user_data
 
-        async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=10.0) as conn:
+        async with self.core.db_pool.reader() as conn:
             async with conn.execute(
                 "SELECT avatar, role FROM users WHERE username = ?",
                 (self.username,)
@@ -736,7 +736,7 @@ class HeaderComponent:
             else:
                 tabs_to_update = ["Chat", "Training"]
 
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=10.0) as conn:
+            async with self.core.db_pool.reader() as conn:
                 async with conn.execute(
                     "SELECT COUNT(*) FROM chat_messages WHERE username = ?",
                     (self.username,)
@@ -837,7 +837,7 @@ class HeaderComponent:
                         )
                         logger.debug(f"{self.username}: Cập nhật sync_label sau đồng bộ từ Firestore: {last_sync_time}")
                     # Kiểm tra qa_data sau đồng bộ
-                    async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=10.0) as conn:
+                    async with self.core.db_pool.reader() as conn:
                         async with conn.execute(
                             "SELECT COUNT(*) FROM qa_data WHERE created_by = ?",
                             (self.username,)
@@ -885,7 +885,7 @@ class HeaderComponent:
                         )
                         logger.debug(f"{self.username}: Cập nhật sync_label sau đồng bộ lên Firestore: {last_sync_time}")
                     # Kiểm tra qa_data sau đồng bộ
-                    async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=10.0) as conn:
+                    async with self.core.db_pool.reader() as conn:
                         async with conn.execute(
                             "SELECT COUNT(*) FROM qa_data WHERE created_by = ?",
                             (self.username,)
@@ -1001,17 +1001,14 @@ class HeaderComponent:
             if not os.path.exists(file_path):
                 raise ValueError(get_text(self.language, "avatar_save_error", default="Failed to save avatar file"))
 
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=10.0) as conn:
+            async def write_op(conn):
                 async with conn.execute(
                     "SELECT avatar FROM users WHERE username = ?",
                     (self.username,),
                 ) as cursor:
                     existing = await cursor.fetchone()
                     if existing and existing[0] == avatar_url:
-                        logger.warning(f"{self.username}: Avatar giống hệt đã tồn tại, bỏ qua")
-                        if context.client.has_socket_connection:
-                            ui.notify(get_text(self.language, "avatar_exists", default="This avatar already exists"), type="warning")
-                        return
+                        return False
 
                 await conn.execute(
                     """
@@ -1045,7 +1042,13 @@ class HeaderComponent:
                         ),
                     ),
                 )
-                await conn.commit()
+                return True
+
+            if not await self.core.sqlite_handler.enqueue_write(write_op):
+                logger.warning(f"{self.username}: Avatar giống hệt đã tồn tại, bỏ qua")
+                if context.client.has_socket_connection:
+                    ui.notify(get_text(self.language, "avatar_exists", default="This avatar already exists"), type="warning")
+                return
 
             self.client_state["avatar_url"] = f"{avatar_url}?t={int(time.time())}"
             self.cached_user_data = None
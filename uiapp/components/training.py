@@ -17,7 +17,6 @@ from uiapp.components.form import FormComponent
 from utils.logging import get_logger
 from utils.core_common import check_disk_space, sanitize_field_name
 from uiapp.language import get_text
-from fuzzywuzzy import fuzz
 
 logger = get_logger("TrainingComponent")
 
@@ -50,7 +49,7 @@ class TrainingComponent:
         self.qa_form = self._create_form_component()
         self.search_input = None
         self.json_input = None
-        asyncio.create_task(self.enable_wal_mode())
+        asyncio.create_task(self.log_journal_mode())
 
     def _create_form_component(self) -> FormComponent:
         """Create or recreate FormComponent with current language."""
@@ -186,7 +185,7 @@ class TrainingComponent:
         page_size: int = 10
     ) -> Tuple[List[Dict], int]:
         try:
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
+            async with self.core.db_pool.reader() as conn:
                 search_value = self.search_input.value.strip() if self.search_input else ""
                 logger.debug(
                     f"{self.username}: fetch_qa_data with search_value='{search_value}', "
@@ -200,44 +199,16 @@ class TrainingComponent:
                     )
 
                     try:
-                        fts_query = f'({clean_search}* OR "{clean_search}" OR {clean_search})'
-                        logger.debug(f"{self.username}: FTS query: {fts_query}")
-
-                        query_count = """
-                            SELECT COUNT(*) FROM qa_fts 
-                            WHERE qa_fts MATCH ? AND rowid IN (
-                                SELECT rowid FROM qa_data WHERE created_by = ?
-                            )
-                        """
-                        cursor_count = await conn.execute(query_count, (fts_query, self.username))
-                        total_matches = (await cursor_count.fetchone())[0]
+                        threshold = getattr(Config, "TRAINING_SEARCH_THRESHOLD", 0.6)
+                        matches = await self.core.search_qa_fts(
+                            self.username, clean_search, threshold, conn=conn
+                        )
+                        total_matches = len(matches)
                         logger.debug(f"{self.username}: FTS count: {total_matches}")
 
                         if total_matches > 0:
-                            query = """
-                                SELECT qa_data.id, qa_data.question, qa_data.answer, qa_data.category, 
-                                       qa_data.created_by, qa_data.created_at, qa_data.timestamp
-                                FROM qa_fts JOIN qa_data ON qa_fts.rowid = qa_data.rowid
-                                WHERE qa_fts MATCH ? AND qa_data.created_by = ?
-                                ORDER BY rank, qa_data.timestamp DESC
-                                LIMIT ? OFFSET ?
-                            """
-                            params = [fts_query, self.username, page_size, (page - 1) * page_size]
-                            cursor = await conn.execute(query, params)
-                            rows = await cursor.fetchall()
-
-                            data = [
-                                {
-                                    "id": row[0],
-                                    "question": row[1],
-                                    "answer": row[2],
-                                    "category": row[3],
-                                    "created_by": row[4],
-                                    "created_at": row[5],
-                                    "timestamp": row[6],
-                                    "score": 0
-                                } for row in rows
-                            ]
+                            start_idx = (page - 1) * page_size
+                            data = matches[start_idx:start_idx + page_size]
 
                             logger.info(
                                 f"{self.username}: FTS search '{search_value}' (cleaned '{clean_search}'): "
@@ -283,7 +254,7 @@ class TrainingComponent:
                     except Exception as fts_error:
                         logger.warning(
                             f"{self.username}: FTS error (not no-results): {str(fts_error)}. "
-                            "Falling back to fuzzy in-memory (limit 1000 records)"
+                            "Falling back to fuzzy matching"
                         )
                         if context.client.has_socket_connection:
                             ui.notify(
@@ -295,67 +266,21 @@ class TrainingComponent:
                                 type="warning"
                             )
 
-                    # --- Fallback fuzzy search ---
-                    async with conn.execute(
-                        """
-                        SELECT id, question, answer, category, created_by, created_at, timestamp
-                        FROM qa_data
-                        WHERE created_by = ?
-                        ORDER BY timestamp DESC
-                        LIMIT 1000
-                        """,
-                        (self.username,)
-                    ) as cursor:
-                        all_rows = await cursor.fetchall()
-
-                    if not all_rows:
-                        logger.info(f"{self.username}: No Q&A data found")
-                        return [], 0
-
+                    # --- Fallback fuzzy search (chấm điểm ngoài event loop) ---
                     threshold = getattr(Config, "TRAINING_SEARCH_THRESHOLD", 0.6)
-                    search_lower = search_value.strip().lower()
-
-                    matches = []
-                    for row in all_rows:
-                        q_lower = row[1].lower() if row[1] else ""
-                        a_lower = row[2].lower() if row[2] else ""
-                        max_ratio = max(
-                            fuzz.ratio(search_lower, q_lower),
-                            fuzz.ratio(search_lower, a_lower),
-                            fuzz.token_sort_ratio(search_lower, q_lower),
-                            fuzz.token_sort_ratio(search_lower, a_lower),
-                            fuzz.partial_ratio(search_lower, q_lower),
-                            fuzz.partial_ratio(search_lower, a_lower)
-                        )
-                        if max_ratio >= threshold * 100:
-                            matches.append({
-                                "id": row[0],
-                                "question": row[1],
-                                "answer": row[2],
-                                "category": row[3],
-                                "created_by": row[4],
-                                "created_at": row[5],
-                                "timestamp": row[6],
-                                "score": round(max_ratio, 1)
-                            })
-
-                    matches.sort(key=lambda x: (x["score"], x["timestamp"]), reverse=True)
+                    matches = await self.core.fuzzy_search_qa(
+                        self.username, search_value, threshold, conn=conn
+                    )
                     total_matches = len(matches)
                     start_idx = (page - 1) * page_size
                     end_idx = start_idx + page_size
                     data = matches[start_idx:end_idx]
 
                     logger.info(
-                        f"{self.username}: Fallback fuzzy search '{search_value}' "
-                        f"(in 1000 records): {total_matches} matches, "
-                        f"page {page} ({len(data)} items)"
+                        f"{self.username}: Fallback fuzzy search '{search_value}': "
+                        f"{total_matches} matches, page {page} ({len(data)} items)"
                     )
 
-                    if len(all_rows) == 1000:
-                        logger.warning(
-                            f"{self.username}: Fallback searched only in 1000 most recent records"
-                        )
-
                     return data, total_matches
 
                 else:
@@ -456,14 +381,15 @@ class TrainingComponent:
             if context.client.has_socket_connection:
                 ui.notify(get_text(self.language, "load_qa_error", "Error loading Q&A: {error}", error=str(e)), type="negative")
 
-    async def enable_wal_mode(self):
+    async def log_journal_mode(self):
         try:
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
-                await conn.execute("PRAGMA journal_mode=WAL")
-                await conn.commit()
-                logger.info(f"{self.username}: Enabled WAL mode for SQLite")
+            # Pool đã bật WAL khi mở kết nối; chỉ kiểm tra, không giữ kết nối ghi
+            async with self.core.db_pool.reader() as conn:
+                async with conn.execute("PRAGMA journal_mode") as cursor:
+                    mode = (await cursor.fetchone())[0]
+                logger.info(f"{self.username}: SQLite journal_mode={mode}")
         except Exception as e:
-            logger.error(f"{self.username}: Error enabling WAL: {str(e)}", exc_info=True)
+            logger.error(f"{self.username}: Error reading journal mode: {str(e)}", exc_info=True)
 
     async def refresh_session_token(self):
         try:
@@ -560,7 +486,7 @@ class TrainingComponent:
 
                 # Ghi log DELETE và đặt last_sync = 0
                 current_time = int(time.time())
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                async def write_op(conn):
                     # Ghi log DELETE vào sync_log
                     await conn.execute(
                         """
@@ -585,15 +511,15 @@ class TrainingComponent:
                         """
                         DELETE FROM sync_log
                         WHERE table_name = ?
-                        AND action IN ('sync_to_firestore', 'sync_to_sqlite')
+                        AND action IN ('sync_to_firestore', 'sync_to_sqlite', 'sync_to_sqlite_page')
                         """,
                         ("qa_data",)
                     )
-                    await conn.commit()
                     logger.debug(
                         f"{self.username}: Đã xóa sync_log cho qa_data "
-                        f"với action='sync_to_firestore' và 'sync_to_sqlite' để đặt last_sync=0"
+                        f"với action đồng bộ (sync_to_firestore, sync_to_sqlite, sync_to_sqlite_page) để đặt last_sync=0"
                     )
+                await self.core.sqlite_handler.enqueue_write(write_op)
 
                 async with self.log_lock:
                     await self.core.log_sync_action(
@@ -639,25 +565,21 @@ class TrainingComponent:
                     
     async def _get_search_record_ids(self, search_query: str) -> List[str]:
         if not search_query:
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
+            async with self.core.db_pool.reader() as conn:
                 async with conn.execute("SELECT id FROM qa_data WHERE created_by = ?", (self.username,)) as cursor:
                     return [row[0] for row in await cursor.fetchall()]
         
         clean_search = search_query.rstrip('?.!;,').strip()
         try:
-            fts_query = f'({clean_search}* OR "{clean_search}" OR {clean_search})'
-            query = """
-                SELECT qa_data.id FROM qa_fts JOIN qa_data ON qa_fts.rowid = qa_data.rowid
-                WHERE qa_fts MATCH ? AND qa_data.created_by = ?
-            """
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
-                async with conn.execute(query, (fts_query, self.username)) as cursor:
-                    record_ids = [row[0] for row in await cursor.fetchall()]
-                    logger.debug(f"{self.username}: FTS delete query '{search_query}' (clean '{clean_search}'): {len(record_ids)} IDs: {record_ids[:5]}...")
-                    return record_ids
+            # Cùng truy vấn và ngưỡng với danh sách kết quả đang hiển thị
+            threshold = getattr(Config, "TRAINING_SEARCH_THRESHOLD", 0.6)
+            matches = await self.core.search_qa_fts(self.username, clean_search, threshold)
+            record_ids = [match["id"] for match in matches]
+            logger.debug(f"{self.username}: FTS delete query '{search_query}' (clean '{clean_search}'): {len(record_ids)} IDs: {record_ids[:5]}...")
+            return record_ids
         except Exception as fts_error:
             logger.warning(f"{self.username}: FTS error in delete: {str(fts_error)}. Falling back to LIKE")
-            async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
+            async with self.core.db_pool.reader() as conn:
                 async with conn.execute(
                     "SELECT id FROM qa_data WHERE (question LIKE ? OR answer LIKE ?) AND created_by = ?",
                     (f"%{clean_search}%", f"%{clean_search}%", self.username)
@@ -740,8 +662,10 @@ class TrainingComponent:
                         return
 
                 current_time = int(time.time())
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
-                    is_full_reset = not search_query
+                is_full_reset = not search_query
+
+                async def write_op(conn):
+                    nonlocal record_ids
 
                     # Lấy record_ids của username để ghi log DELETE
                     if is_full_reset:
@@ -797,12 +721,16 @@ class TrainingComponent:
                         """
                         DELETE FROM sync_log
                         WHERE table_name = ?
-                        AND action IN ('sync_to_firestore', 'sync_to_sqlite')
+                        AND action IN ('sync_to_firestore', 'sync_to_sqlite', 'sync_to_sqlite_page')
                         """,
                         ("qa_data",),
                     )
-                    await conn.commit()
                     logger.debug(f"{self.username}: Đã xóa sync_log đồng bộ cho qa_data")
+                await self.core.sqlite_handler.enqueue_write(write_op)
+                if is_full_reset:
+                    self.core.sqlite_handler.reset_qa_indexes()
+                else:
+                    await self.core.sqlite_handler.refresh_qa_index(record_ids, self.username)
 
                 await self.update_qa_records()
 
@@ -1051,7 +979,7 @@ class TrainingComponent:
     async def process_qa_list(self, qa_list: List[Dict], source: str) -> List[Dict]:
         valid_qa_list = []
         current_time = int(time.time())
-        async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+        async with self.core.db_pool.reader() as conn:
             for qa in qa_list:
                 if "question" not in qa or "answer" not in qa:
                     logger.error(f"{self.username}: Q&A missing question or answer from {source}")
@@ -1148,7 +1076,7 @@ class TrainingComponent:
                         ui.notify(get_text(self.language, "qa_too_large", "Q&A data too large"), type="negative")
                     return {"success": False, "error": get_text(self.language, "qa_too_large", "Q&A data too large")}
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     async with conn.execute(
                         'SELECT id FROM "qa_data" WHERE question = ? AND answer = ? AND created_by = ?',
                         (data["question"], data["answer"], self.username)
@@ -1164,20 +1092,21 @@ class TrainingComponent:
                 is_update = False
                 logger.debug(f"{self.username}: record_id before processing: {record_id}")
                 if record_id:
-                    async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                    async with self.core.db_pool.reader() as conn:
                         async with conn.execute(
                             'SELECT id FROM "qa_data" WHERE id = ? AND created_by = ?',
                             (record_id, self.username)
                         ) as cursor:
-                            if await cursor.fetchone():
-                                result = await self.core.update_record("qa_data", record_id, data, self.username)
-                                is_update = True
-                                action = "UPDATE_QA"
-                            else:
-                                logger.warning(f"{self.username}: ID {record_id} does not exist or not owned by user, falling back to create")
-                                data["id"] = str(uuid.uuid4())
-                                result = await self.core.create_record("qa_data", data, self.username)
-                                action = "CREATE_QA"
+                            record_exists = await cursor.fetchone() is not None
+                    if record_exists:
+                        result = await self.core.update_record("qa_data", record_id, data, self.username)
+                        is_update = True
+                        action = "UPDATE_QA"
+                    else:
+                        logger.warning(f"{self.username}: ID {record_id} does not exist or not owned by user, falling back to create")
+                        data["id"] = str(uuid.uuid4())
+                        result = await self.core.create_record("qa_data", data, self.username)
+                        action = "CREATE_QA"
                 else:
                     result = await self.core.create_record("qa_data", data, self.username)
                     action = "CREATE_QA"
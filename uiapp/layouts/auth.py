@@ -107,7 +107,7 @@ class AuthLayout:
                 result = await self.on_register(data, progress_callback=progress_callback)
                 if result.get("success") and self.core and self.core.firestore_handler.firestore_available:
                     username = data["username"]
-                    async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                    async def write_op(conn):
                         await conn.execute(
                             "INSERT INTO sync_log "
                             "(id, table_name, record_id, action, timestamp, details) "
@@ -121,7 +121,7 @@ class AuthLayout:
                                 json.dumps({"username": username, "action": "register"})
                             )
                         )
-                        await conn.commit()
+                    await self.core.sqlite_handler.enqueue_write(write_op)
                     ui.notify(get_text(self.language, "register_success", default="Registration successful!"), type="positive")
                 else:
                     ui.notify(get_text(self.language, "register_error", default="Registration failed: {error}", error=result.get("error", "Unknown error")), type="negative")
@@ -228,138 +228,143 @@ class DashboardLayout:
                     ui.notify(get_text(self.language, "state_too_large_error", default="Error: Session state too large"), type="negative")
                     return
 
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async with self.core.db_pool.reader() as conn:
                     async with conn.execute(
                         "SELECT state FROM client_states WHERE username = ?",
                         (self.username,)
                     ) as cursor:
                         row = await cursor.fetchone()
-                        session_token = self.client_state.get("session_token", "")
-                        state_id = hashlib.sha256(f"{self.username}_{session_token}".encode()).hexdigest()
-                        self.client_state["timestamp"] = int(time.time())
-                        state_json = json.dumps(self.client_state, ensure_ascii=False)
 
-                        if not row:
-                            logger.info(get_text(self.language, 'no_client_state', default='No client_state found, creating new'))
-                            self.client_state["selected_tab"] = (
-                                get_text(self.language, "chat_tab", default="Chat") if get_text(self.language, "chat_tab", default="Chat") in self.tabs
-                                else list(self.tabs.keys())[0]
-                                if self.tabs else None
-                            )
-                        else:
-                            logger.info(get_text(self.language, 'load_client_state', default='Loaded client_state from SQLite'))
-                            current_state = json.loads(row[0])
-                            self.client_state.update(current_state)
+                session_token = self.client_state.get("session_token", "")
+                state_id = hashlib.sha256(f"{self.username}_{session_token}".encode()).hexdigest()
+                self.client_state["timestamp"] = int(time.time())
+                state_json = json.dumps(self.client_state, ensure_ascii=False)
 
-                        if self.ui_manager and self.ui_manager.registered_tabs:
-                            self.tabs = {
-                                name: {
-                                    "name": tab["name"],
-                                    "icon": tab["icon"],
-                                    "update_func_name": tab["update"].__name__ if callable(tab.get("update")) else None
-                                }
-                                for name, tab in self.ui_manager.registered_tabs.items()
-                            }
-                            self.client_state["tabs"] = {
-                                name: {
-                                    "name": tab["name"],
-                                    "icon": tab["icon"],
-                                    "update_func_name": tab["update_func_name"]
-                                }
-                                for name, tab in self.tabs.items()
-                            }
-                            logger.info(get_text(self.language, 'updated_tabs', default='Updated client_state tabs with: {tabs}', tabs=list(self.tabs.keys())))
-                            for tab_name in self.tabs:
-                                update_func = self.ui_manager.registered_tabs.get(tab_name, {}).get("update")
-                                logger.debug(get_text(self.language, 'tab_update_func', default='Tab {tab_name} has update_func: {has_func}', tab_name=tab_name, has_func=update_func is not None))
+                if not row:
+                    logger.info(get_text(self.language, 'no_client_state', default='No client_state found, creating new'))
+                    self.client_state["selected_tab"] = (
+                        get_text(self.language, "chat_tab", default="Chat") if get_text(self.language, "chat_tab", default="Chat") in self.tabs
+                        else list(self.tabs.keys())[0]
+                        if self.tabs else None
+                    )
+                else:
+                    logger.info(get_text(self.language, 'load_client_state', default='Loaded client_state from SQLite'))
+                    current_state = json.loads(row[0])
+                    self.client_state.update(current_state)
 
-                        await conn.execute(
-                            "INSERT OR REPLACE INTO client_states (id, username, session_token, state, timestamp) "
-                            "VALUES (?, ?, ?, ?, ?)",
-                            (state_id, self.username, session_token, state_json, self.client_state["timestamp"])
-                        )
-                        await conn.commit()
+                if self.ui_manager and self.ui_manager.registered_tabs:
+                    self.tabs = {
+                        name: {
+                            "name": tab["name"],
+                            "icon": tab["icon"],
+                            "update_func_name": tab["update"].__name__ if callable(tab.get("update")) else None
+                        }
+                        for name, tab in self.ui_manager.registered_tabs.items()
+                    }
+                    self.client_state["tabs"] = {
+                        name: {
+                            "name": tab["name"],
+                            "icon": tab["icon"],
+                            "update_func_name": tab["update_func_name"]
+                        }
+                        for name, tab in self.tabs.items()
+                    }
+                    logger.info(get_text(self.language, 'updated_tabs', default='Updated client_state tabs with: {tabs}', tabs=list(self.tabs.keys())))
+                    for tab_name in self.tabs:
+                        update_func = self.ui_manager.registered_tabs.get(tab_name, {}).get("update")
+                        logger.debug(get_text(self.language, 'tab_update_func', default='Tab {tab_name} has update_func: {has_func}', tab_name=tab_name, has_func=update_func is not None))
+
+                async def write_op(conn):
+                    await conn.execute(
+                        "INSERT OR REPLACE INTO client_states (id, username, session_token, state, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (state_id, self.username, session_token, state_json, self.client_state["timestamp"])
+                    )
 
-                    if self.is_admin:
+                await self.core.sqlite_handler.enqueue_write(write_op)
+                self.core.sqlite_handler.invalidate_session_cache(self.username, session_token)
+
+                if self.is_admin:
+                    async with self.core.db_pool.reader() as conn:
                         async with conn.execute(
                             "SELECT action, details, timestamp FROM sync_log ORDER BY timestamp DESC LIMIT 10"
                         ) as cursor:
                             status = await cursor.fetchall()
                             logger.info(get_text(self.language, 'load_sync_status', default='Loaded sync status for admin'))
 
-                    if not self.ui_manager:
-                        logger.error(get_text(self.language, 'no_ui_manager', default='UIManager not assigned to DashboardLayout'))
-                        ui.notify(get_text(self.language, "invalid_dashboard_config", default="Error: Invalid dashboard configuration"), type="negative")
-                        return
+                if not self.ui_manager:
+                    logger.error(get_text(self.language, 'no_ui_manager', default='UIManager not assigned to DashboardLayout'))
+                    ui.notify(get_text(self.language, "invalid_dashboard_config", default="Error: Invalid dashboard configuration"), type="negative")
+                    return
 
-                    self.header = HeaderComponent(
-                        username=self.username,
-                        on_logout=self.on_logout,
-                        is_admin=self.is_admin,
-                        on_sync_to_sqlite=self.core.sync_to_sqlite,
-                        on_sync_from_sqlite=self.core.sync_from_sqlite,
-                        core=self.core,
-                        client_state=self.client_state,
-                        ui_manager=self.ui_manager
-                    )
-                    await self.header.render()
-                    self.sidebar = SidebarComponent(
-                        tabs=[{"name": tab["name"], "icon": tab["icon"]} for tab in self.tabs.values()],
-                        on_select=self.handle_tab_change,
-                        core=self.core,
-                        client_state=self.client_state,
-                        language=self.language
-                    )
-                    await self.sidebar.render()
-                    with ui.card().classes('w-full p-4'):
-                        if not self.tabs:
-                            ui.label(get_text(self.language, "welcome_dashboard", default="Welcome to Dashboard")).classes("text-2xl font-bold")
-                            ui.label(
-                                get_text(self.language, "no_tabs_configured", default="No tabs configured. Please add tabs in the uiapp directory.")
-                            ).classes("text-lg text-gray-500")
-                            logger.info(get_text(self.language, 'no_tabs_default', default='Displayed default content due to no tabs'))
-                        else:
-                            with ui.tabs().classes('dense w-full') as tabs:
-                                for tab_name, tab_info in self.tabs.items():
-                                    if len(tab_name) < 3 or not re.match(r'^[a-zA-Z0-9_]+$', tab_name):
-                                        logger.error(get_text(self.language, 'invalid_tab_name', default='Invalid tab name: {tab_name}', tab_name=tab_name))
-                                        continue
-                                    if not isinstance(tab_info, dict) or "icon" not in tab_info or "name" not in tab_info:
-                                        logger.error(get_text(self.language, 'invalid_tab_config', default='Invalid tab configuration: {tab_name}', tab_name=tab_name))
-                                        continue
-                                    ui.tab(tab_name, icon=tab_info["icon"]).classes('no-caps')
-                            with ui.tab_panels(
-                                tabs,
-                                value=self.client_state.get(
-                                    "selected_tab",
-                                    get_text(self.language, "chat_tab", default="Chat") if get_text(self.language, "chat_tab", default="Chat") in self.tabs else list(self.tabs.keys())[0] if self.tabs else None
-                                )
-                            ).classes('w-full') as tab_panels:
-                                tab_panels.bind_value(self.client_state, "selected_tab")
-                                for tab_name, tab_info in self.tabs.items():
-                                    with ui.tab_panel(tab_name):
-                                        try:
-                                            render_func = self.ui_manager.registered_tabs.get(tab_name, {}).get("render")
-                                            if not render_func or not asyncio.iscoroutinefunction(render_func):
-                                                logger.error(
-                                                    get_text(self.language, 'invalid_render_func', default='render_func for tab {tab_name} is invalid or not async', tab_name=tab_name)
-                                                )
-                                                ui.notify(get_text(self.language, "load_tab_error", default="Error: Cannot load tab {tab_name}", tab_name=tab_name), type="negative")
-                                                continue
-                                            logger.debug(get_text(self.language, 'rendering_tab', default='Rendering tab {tab_name}', tab_name=tab_name))
-                                            await render_func(self.core, self.username, self.is_admin, self.client_state)
-                                            update_func = self.ui_manager.registered_tabs.get(tab_name, {}).get("update")
-                                            if update_func and callable(update_func):
-                                                if asyncio.iscoroutinefunction(update_func):
-                                                    await update_func(self.core, self.username, self.is_admin, self.client_state)
-                                                else:
-                                                    update_func(self.core, self.username, self.is_admin, self.client_state)
-                                        except Exception as e:
-                                            error_msg = get_text(self.language, "render_tab_error", default="Error rendering tab {tab_name}: {error}", tab_name=tab_name, error=str(e))
-                                            if self.is_admin:
-                                                error_msg += get_text(self.language, 'details', default='Details') + f": {traceback.format_exc()}"
-                                            ui.notify(error_msg, type="negative")
-                                            logger.error(f"{self.username}: {error_msg}", exc_info=True)
+                self.header = HeaderComponent(
+                    username=self.username,
+                    on_logout=self.on_logout,
+                    is_admin=self.is_admin,
+                    on_sync_to_sqlite=self.core.sync_to_sqlite,
+                    on_sync_from_sqlite=self.core.sync_from_sqlite,
+                    core=self.core,
+                    client_state=self.client_state,
+                    ui_manager=self.ui_manager
+                )
+                await self.header.render()
+                self.sidebar = SidebarComponent(
+                    tabs=[{"name": tab["name"], "icon": tab["icon"]} for tab in self.tabs.values()],
+                    on_select=self.handle_tab_change,
+                    core=self.core,
+                    client_state=self.client_state,
+                    language=self.language
+                )
+                await self.sidebar.render()
+                with ui.card().classes('w-full p-4'):
+                    if not self.tabs:
+                        ui.label(get_text(self.language, "welcome_dashboard", default="Welcome to Dashboard")).classes("text-2xl font-bold")
+                        ui.label(
+                            get_text(self.language, "no_tabs_configured", default="No tabs configured. Please add tabs in the uiapp directory.")
+                        ).classes("text-lg text-gray-500")
+                        logger.info(get_text(self.language, 'no_tabs_default', default='Displayed default content due to no tabs'))
+                    else:
+                        with ui.tabs().classes('dense w-full') as tabs:
+                            for tab_name, tab_info in self.tabs.items():
+                                if len(tab_name) < 3 or not re.match(r'^[a-zA-Z0-9_]+$', tab_name):
+                                    logger.error(get_text(self.language, 'invalid_tab_name', default='Invalid tab name: {tab_name}', tab_name=tab_name))
+                                    continue
+                                if not isinstance(tab_info, dict) or "icon" not in tab_info or "name" not in tab_info:
+                                    logger.error(get_text(self.language, 'invalid_tab_config', default='Invalid tab configuration: {tab_name}', tab_name=tab_name))
+                                    continue
+                                ui.tab(tab_name, icon=tab_info["icon"]).classes('no-caps')
+                        with ui.tab_panels(
+                            tabs,
+                            value=self.client_state.get(
+                                "selected_tab",
+                                get_text(self.language, "chat_tab", default="Chat") if get_text(self.language, "chat_tab", default="Chat") in self.tabs else list(self.tabs.keys())[0] if self.tabs else None
+                            )
+                        ).classes('w-full') as tab_panels:
+                            tab_panels.bind_value(self.client_state, "selected_tab")
+                            for tab_name, tab_info in self.tabs.items():
+                                with ui.tab_panel(tab_name):
+                                    try:
+                                        render_func = self.ui_manager.registered_tabs.get(tab_name, {}).get("render")
+                                        if not render_func or not asyncio.iscoroutinefunction(render_func):
+                                            logger.error(
+                                                get_text(self.language, 'invalid_render_func', default='render_func for tab {tab_name} is invalid or not async', tab_name=tab_name)
+                                            )
+                                            ui.notify(get_text(self.language, "load_tab_error", default="Error: Cannot load tab {tab_name}", tab_name=tab_name), type="negative")
+                                            continue
+                                        logger.debug(get_text(self.language, 'rendering_tab', default='Rendering tab {tab_name}', tab_name=tab_name))
+                                        await render_func(self.core, self.username, self.is_admin, self.client_state)
+                                        update_func = self.ui_manager.registered_tabs.get(tab_name, {}).get("update")
+                                        if update_func and callable(update_func):
+                                            if asyncio.iscoroutinefunction(update_func):
+                                                await update_func(self.core, self.username, self.is_admin, self.client_state)
+                                            else:
+                                                update_func(self.core, self.username, self.is_admin, self.client_state)
+                                    except Exception as e:
+                                        error_msg = get_text(self.language, "render_tab_error", default="Error rendering tab {tab_name}: {error}", tab_name=tab_name, error=str(e))
+                                        if self.is_admin:
+                                            error_msg += get_text(self.language, 'details', default='Details') + f": {traceback.format_exc()}"
+                                        ui.notify(error_msg, type="negative")
+                                        logger.error(f"{self.username}: {error_msg}", exc_info=True)
         except asyncio.TimeoutError as e:
             logger.error(get_text(self.language, 'dashboard_timeout', default='Timeout rendering dashboard: {error}', error=str(e)), exc_info=True)
             ui.notify(get_text(self.language, "dashboard_timeout_error", default="Timeout loading dashboard, please try again!"), type="negative")
@@ -397,7 +402,7 @@ class DashboardLayout:
                     logger.error(get_text(self.language, 'state_too_large', default='State size exceeds 1MB'))
                     ui.notify(get_text(self.language, "state_too_large_error", default="Error: Session state too large"), type="negative")
                     return
-                async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=30.0) as conn:
+                async def write_op(conn):
                     state_id = hashlib.sha256(f"{self.username}_{session_token}".encode()).hexdigest()
                     await conn.execute(
                         "INSERT OR REPLACE INTO client_states (id, username, session_token, state, timestamp) VALUES (?, ?, ?, ?, ?)",
@@ -414,7 +419,8 @@ class DashboardLayout:
                             json.dumps({"username": self.username, "tab": tab_name})
                         )
                     )
-                    await conn.commit()
+                await self.core.sqlite_handler.enqueue_write(write_op)
+                self.core.sqlite_handler.invalidate_session_cache(self.username, session_token)
                 if self.on_tab_select and callable(self.on_tab_select):
                     if asyncio.iscoroutinefunction(self.on_tab_select):
                         await self.on_tab_select(tab_name)
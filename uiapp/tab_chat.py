@@ -88,12 +88,12 @@ async def create_tab(core: Core) -> Tuple[Callable, Callable]:
                     try:
                         async with chat_component.processing_lock:
                             chat_component.messages = []
-                            async with aiosqlite.connect(Config.SQLITE_DB_PATH, timeout=60.0) as conn:
+                            async def write_op(conn):
                                 await conn.execute(
                                     "DELETE FROM chat_messages WHERE session_token = ? AND username = ?",
                                     (client_state["session_token"], _username)
                                 )
-                                await conn.commit()
+                            await chat_component.core.sqlite_handler.enqueue_write(write_op)
                             await chat_component.update_messages()
                             ui.update()
                             await scroll_to_bottom(client_state)
@@ -6,7 +6,6 @@ import hashlib
 import json
 import zipfile
 import os
-import sqlite3
 import math
 import base64
 import traceback
@@ -290,11 +289,9 @@ class DownloadComponent:
     async def export_sqlite_to_json(self):
         username = self.client_state.get("username", "")
         try:
-            sqlite_db_path = Config.SQLITE_DB_PATH
-            with sqlite3.connect(sqlite_db_path, timeout=20) as conn:
-                c = conn.cursor()
-                c.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = [row[0] for row in c.fetchall() if not row[0].endswith('_fts') and not row[0].startswith('sqlite_')]
+            async with self.core.db_pool.reader() as conn:
+                async with conn.execute("SELECT name FROM sqlite_master WHERE type='table'") as cursor:
+                    tables = [row[0] for row in await cursor.fetchall() if not row[0].endswith('_fts') and not row[0].startswith('sqlite_')]
                 if not tables:
                     logger.warning(f"{username}: No tables found in SQLite database")
                     return '{"tables": [], "data": {}}'
@@ -302,13 +299,14 @@ class DownloadComponent:
                 data = {}
                 for table in tables:
                     try:
-                        c.execute(f"PRAGMA table_info({table})")
-                        columns = [col[1] for col in c.fetchall()]
+                        async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+                            columns = [col[1] for col in await cursor.fetchall()]
                         if table == 'qa_data':
-                            c.execute(f"SELECT * FROM {table} ORDER BY timestamp DESC LIMIT 1000")
+                            query = f"SELECT * FROM {table} ORDER BY timestamp DESC LIMIT 1000"
                         else:
-                            c.execute(f"SELECT * FROM {table}")
-                        rows = c.fetchall()
+                            query = f"SELECT * FROM {table}"
+                        async with conn.execute(query) as cursor:
+                            rows = await cursor.fetchall()
                         table_data = []
                         for row in rows:
                             row_dict = {columns[i]: self.serialize_value(value) for i, value in enumerate(row)}
@@ -319,14 +317,13 @@ class DownloadComponent:
                         logger.warning(f"{username}: Failed to export table {table}: {str(e)}")
                         data[table] = []
 
-                try:
-                    json_str = json.dumps({"tables": tables, "data": data}, indent=2, ensure_ascii=False)
-                    logger.info(f"{username}: JSON dump success, size: {len(json_str)} chars")
-                    conn.commit()
-                    return json_str
-                except Exception as json_e:
-                    logger.error(f"{username}: JSON dump failed: {str(json_e)}", exc_info=True)
-                    return {"error": f"Lỗi JSON: {str(json_e)}"}
+            try:
+                json_str = json.dumps({"tables": tables, "data": data}, indent=2, ensure_ascii=False)
+                logger.info(f"{username}: JSON dump success, size: {len(json_str)} chars")
+                return json_str
+            except Exception as json_e:
+                logger.error(f"{username}: JSON dump failed: {str(json_e)}", exc_info=True)
+                return {"error": f"Lỗi JSON: {str(json_e)}"}
         except Exception as e:
             logger.error(f"{username}: Error exporting SQLite to JSON: {str(e)}", exc_info=True)
             return {"error": f"Lỗi xuất SQLite sang JSON: {str(e)}"}
@@ -2,6 +2,20 @@
 from .core_common import sanitize_field_name, validate_name, validate_password_strength, retry_firestore_operation, check_disk_space
 from .exceptions import DatabaseError, AuthError, handle_exception
 from .logging import setup_logging, get_logger
+from .sqlite_pool import SQLitePool
+from .cache import TTLCache
+from .metrics import LatencyStats
+from .fuzzy_matcher import FuzzyMatcher
+from .qa_index import QAIndexManager
+from .fts_query import fold_text, compile_qa_query
+from .llm_cache import LLMResponseCache
+from .embeddings import HashedNgramEmbedder, register_embedder, get_embedder
+from .vector_store import QAVectorStore
+from .ann_index import IVFIndex
+from .retrieval import reciprocal_rank_fusion
+from .firestore_batch import FirestoreBatchWriter, content_hash
+from .sync_daemon import SyncDaemon
+from .firestore_listener import FirestoreListener
 
 __all__ = [
     'sanitize_field_name',
@@ -13,5 +27,23 @@ __all__ = [
     'AuthError',
     'handle_exception',
     'setup_logging',
-    'get_logger'
+    'get_logger',
+    'SQLitePool',
+    'TTLCache',
+    'LatencyStats',
+    'FuzzyMatcher',
+    'QAIndexManager',
+    'fold_text',
+    'compile_qa_query',
+    'LLMResponseCache',
+    'HashedNgramEmbedder',
+    'register_embedder',
+    'get_embedder',
+    'QAVectorStore',
+    'IVFIndex',
+    'reciprocal_rank_fusion',
+    'FirestoreBatchWriter',
+    'content_hash',
+    'SyncDaemon',
+    'FirestoreListener'
 ]
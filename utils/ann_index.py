@@ -0,0 +1,354 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import Config
+from utils.logging import get_logger
+from utils.embeddings import np
+from utils.metrics import LatencyStats
+
+logger = get_logger("ANNIndex")
+
+ANN_FORMAT_VERSION = 1
+
+
+def kmeans(vectors, nlist: int, iterations: int = 10, sample_size: Optional[int] = None, seed: int = 0):
+    """K-means cầu (cosine) thuần NumPy trên mẫu ngẫu nhiên; trả về tâm đã chuẩn hóa L2."""
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or nlist * 40
+    if len(vectors) > sample_size:
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    else:
+        sample = np.asarray(vectors)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Tâm rỗng được gieo lại từ điểm ngẫu nhiên
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.maximum(norms, 1e-12)).astype(np.float32)
+    return centroids
+
+
+def assign(vectors, centroids, chunk: int = 8192):
+    """Gán mỗi vector vào tâm gần nhất (tích vô hướng lớn nhất), xử lý theo khối."""
+    result = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk])
+        result[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return result
+
+
+def _top_k(ids: List[str], scores, limit: int, threshold: float) -> List[Tuple[str, float]]:
+    if limit < len(scores):
+        top = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top])]
+    return [(ids[i], float(scores[i])) for i in top if scores[i] >= threshold]
+
+
+class UserVectorIndex:
+    """Ma trận embedding (float32, đã chuẩn hóa L2) của một user trong bộ nhớ.
+
+    Hàng i ứng với ids[i]; xóa bằng cách đổi chỗ với hàng cuối nên không
+    phải sao chép lại cả ma trận.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self._matrix = np.zeros((64, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def record_ids(self) -> Iterable[str]:
+        return iter(self.ids)
+
+    @property
+    def matrix(self):
+        return self._matrix[:len(self.ids)]
+
+    def upsert(self, record_id: str, vector) -> None:
+        position = self.positions.get(record_id)
+        if position is None:
+            position = len(self.ids)
+            if position >= len(self._matrix):
+                grown = np.zeros((len(self._matrix) * 2, self.dim), dtype=np.float32)
+                grown[:position] = self._matrix[:position]
+                self._matrix = grown
+            self.ids.append(record_id)
+            self.positions[record_id] = position
+        self._matrix[position] = vector
+
+    def remove(self, record_id: str) -> bool:
+        position = self.positions.pop(record_id, None)
+        if position is None:
+            return False
+        last = len(self.ids) - 1
+        if position != last:
+            moved = self.ids[last]
+            self._matrix[position] = self._matrix[last]
+            self.ids[position] = moved
+            self.positions[moved] = position
+        self.ids.pop()
+        return True
+
+    def search(self, query_vector, limit: int, threshold: float = 0.0) -> List[Tuple[str, float]]:
+        """Top-k theo cosine (tích vô hướng) giảm dần, bỏ kết quả dưới threshold."""
+        if not self.ids or limit <= 0:
+            return []
+        return _top_k(self.ids, self.matrix @ query_vector, limit, threshold)
+
+
+class IVFIndex:
+    """Chỉ mục ANN kiểu IVF (inverted file) thuần NumPy cho embedding đã chuẩn hóa L2.
+
+    Phần nền (tâm cụm, vector sắp theo cụm, id, offset) được lưu thành file .npy
+    và mở bằng memory map. Thay đổi sau lần dựng nằm trong bộ đệm delta chính
+    xác (UserVectorIndex) và mặt nạ xóa; compact() gộp tất cả thành phần nền mới.
+    """
+
+    def __init__(self, dim: int, model: str, nprobe: int = Config.ANN_NPROBE):
+        self.dim = dim
+        self.model = model
+        self.nprobe = nprobe
+        self.centroids = np.zeros((0, dim), dtype=np.float32)
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype="<U1")
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.base_positions: Dict[str, int] = {}
+        self.delta = UserVectorIndex(dim)
+        self.built_at = 0
+        self.trained_size = 0
+        self._journal: Optional[List[Tuple[str, Optional[object]]]] = None
+
+    def __len__(self) -> int:
+        return int(self.alive.sum()) + len(self.delta)
+
+    @property
+    def base_size(self) -> int:
+        return len(self.ids)
+
+    def record_ids(self) -> Iterable[str]:
+        for record_id, position in self.base_positions.items():
+            if self.alive[position]:
+                yield record_id
+        yield from self.delta.ids
+
+    def upsert(self, record_id: str, vector) -> None:
+        position = self.base_positions.get(record_id)
+        if position is not None:
+            self.alive[position] = False
+        self.delta.upsert(record_id, vector)
+        if self._journal is not None:
+            self._journal.append((record_id, np.array(vector, dtype=np.float32)))
+
+    def remove(self, record_id: str) -> bool:
+        removed = self.delta.remove(record_id)
+        position = self.base_positions.get(record_id)
+        if position is not None and self.alive[position]:
+            self.alive[position] = False
+            removed = True
+        if self._journal is not None:
+            self._journal.append((record_id, None))
+        return removed
+
+    def search(self, query_vector, limit: int, threshold: float = 0.0, nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Top-k gần đúng: chỉ chấm điểm nprobe cụm gần nhất, cộng với bộ đệm delta."""
+        if limit <= 0:
+            return []
+        results = self.delta.search(query_vector, limit, threshold)
+        nlist = len(self.centroids)
+        if nlist and self.base_size:
+            nprobe = min(nlist, nprobe or self.nprobe)
+            probe = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+            rows = np.concatenate([
+                np.arange(self.offsets[cluster], self.offsets[cluster + 1]) for cluster in probe
+            ])
+            rows = rows[self.alive[rows]]
+            if len(rows):
+                scores = np.asarray(self.vectors[rows]) @ query_vector
+                hits = _top_k(rows, scores, limit, threshold)
+                results.extend((str(self.ids[row]), score) for row, score in hits)
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:limit]
+
+    def needs_compaction(self) -> bool:
+        """Delta hoặc số bản ghi đã xóa vượt ANN_COMPACT_RATIO của phần nền."""
+        stale = len(self.delta) + int(self.base_size - self.alive.sum())
+        return stale > max(Config.ANN_COMPACT_MIN_DELTA, Config.ANN_COMPACT_RATIO * self.base_size)
+
+    def snapshot(self) -> Tuple[List[str], object]:
+        """Lấy (ids, vectors) còn sống để compact; thay đổi sau đó được ghi vào journal."""
+        # Bản ghi trong delta luôn đã bị đánh dấu xóa ở phần nền nên không trùng
+        live_rows = np.nonzero(self.alive)[0]
+        ids = [str(record_id) for record_id in self.ids[live_rows]] + list(self.delta.ids)
+        vectors = np.vstack([np.asarray(self.vectors[live_rows]), self.delta.matrix]).astype(np.float32)
+        self._journal = []
+        return ids, vectors
+
+    def install(self, built: "IVFIndex") -> None:
+        """Thay phần nền bằng chỉ mục vừa compact rồi áp lại các thay đổi trong journal."""
+        journal = self._journal or []
+        self._journal = None
+        for name in ("centroids", "vectors", "ids", "offsets", "alive", "base_positions", "built_at", "trained_size"):
+            setattr(self, name, getattr(built, name))
+        self.delta = UserVectorIndex(self.dim)
+        for record_id, vector in journal:
+            if vector is None:
+                self.remove(record_id)
+            else:
+                self.upsert(record_id, vector)
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        vectors,
+        model: str,
+        previous_centroids=None,
+        built_at: Optional[int] = None
+    ) -> "IVFIndex":
+        """Dựng chỉ mục từ đầu; giữ tâm cũ nếu kích thước chưa tăng quá ANN_RETRAIN_GROWTH lần."""
+        dim = vectors.shape[1]
+        index = cls(dim, model)
+        nlist = max(1, min(len(ids), int(Config.ANN_LISTS_FACTOR * np.sqrt(max(1, len(ids))))))
+        if previous_centroids is not None and len(previous_centroids):
+            centroids = np.asarray(previous_centroids, dtype=np.float32)
+        elif len(ids):
+            centroids = kmeans(vectors, nlist)
+        else:
+            centroids = np.zeros((0, dim), dtype=np.float32)
+        if len(ids):
+            assignment = assign(vectors, centroids)
+            order = np.argsort(assignment, kind="stable")
+            counts = np.bincount(assignment, minlength=len(centroids))
+            index.vectors = np.ascontiguousarray(vectors[order], dtype=np.float32)
+            index.ids = np.array(ids)[order]
+            index.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        index.centroids = centroids
+        index.alive = np.ones(len(index.ids), dtype=bool)
+        index.base_positions = {str(record_id): row for row, record_id in enumerate(index.ids)}
+        index.built_at = built_at if built_at is not None else int(time.time())
+        index.trained_size = len(ids)
+        return index
+
+    def should_retrain(self, size: int) -> bool:
+        return not self.trained_size or size > self.trained_size * Config.ANN_RETRAIN_GROWTH \
+            or size * Config.ANN_RETRAIN_GROWTH < self.trained_size
+
+    def save(self, path: str) -> None:
+        """Ghi phần nền ra thư mục path (ghi vào thư mục tạm rồi đổi tên)."""
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in ("centroids", "vectors", "ids", "offsets"):
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({
+                "version": ANN_FORMAT_VERSION,
+                "model": self.model,
+                "dim": self.dim,
+                "count": self.base_size,
+                "built_at": self.built_at,
+                "trained_size": self.trained_size
+            }, f)
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        # File cũ có thể vẫn đang được memory map; Linux giữ nội dung tới khi unmap
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str, model: str) -> Optional["IVFIndex"]:
+        """Mở chỉ mục đã lưu bằng memory map; None nếu không có hoặc khác model/định dạng."""
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("version") != ANN_FORMAT_VERSION or meta.get("model") != model:
+                return None
+            index = cls(meta["dim"], model)
+            index.centroids = np.load(os.path.join(path, "centroids.npy"))
+            index.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            index.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+            index.offsets = np.load(os.path.join(path, "offsets.npy"))
+            index.alive = np.ones(len(index.ids), dtype=bool)
+            index.base_positions = {str(record_id): row for row, record_id in enumerate(index.ids)}
+            index.built_at = meta["built_at"]
+            index.trained_size = meta.get("trained_size", len(index.ids))
+            return index
+        except Exception as e:
+            logger.warning(f"Không mở được chỉ mục ANN {path}: {str(e)}")
+            return None
+
+
+def ann_index_path(username: str, base_dir: str = Config.ANN_INDEX_DIR) -> str:
+    """Thư mục chỉ mục ANN của user (tên băm để an toàn cho hệ thống file)."""
+    return os.path.join(base_dir, hashlib.sha1(username.encode()).hexdigest())
+
+
+def benchmark(index: IVFIndex, vectors, queries, limit: int = 10, nprobe: Optional[int] = None) -> Dict:
+    """So sánh IVF với tìm kiếm chính xác: recall@limit và độ trễ (ms) mỗi truy vấn.
+
+    vectors là toàn bộ vector (cùng thứ tự với index.ids) dùng cho tìm kiếm chính xác.
+    """
+    exact_ids = [str(record_id) for record_id in index.ids]
+    exact_latency = LatencyStats(len(queries))
+    ann_latency = LatencyStats(len(queries))
+    recall_sum = 0.0
+    for query in queries:
+        started = time.perf_counter()
+        exact = _top_k(exact_ids, np.asarray(vectors) @ query, limit, -1.0)
+        exact_latency.record((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        approx = index.search(query, limit, -1.0, nprobe=nprobe)
+        ann_latency.record((time.perf_counter() - started) * 1000)
+        truth = {record_id for record_id, _ in exact}
+        recall_sum += len(truth & {record_id for record_id, _ in approx}) / max(1, len(truth))
+    return {
+        "size": index.base_size,
+        "lists": len(index.centroids),
+        "nprobe": min(len(index.centroids), nprobe or index.nprobe),
+        "limit": limit,
+        "recall": round(recall_sum / max(1, len(queries)), 4),
+        "exact": exact_latency.stats(),
+        "ann": ann_latency.stats()
+    }
+
+
+if __name__ == "__main__":
+    # Benchmark trên dữ liệu tổng hợp: python -m utils.ann_index [số_bản_ghi]
+    import sys
+    from utils.embeddings import get_embedder
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    embedder = get_embedder()
+    rng = np.random.default_rng(1)
+    words = [f"tu{i}" for i in range(5000)]
+    texts = [" ".join(rng.choice(words, 8)) for _ in range(size)]
+    started = time.perf_counter()
+    data = embedder.embed(texts)
+    print(f"Embed {size} văn bản: {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    ivf = IVFIndex.build([str(i) for i in range(size)], data, embedder.name)
+    print(f"Dựng IVF ({len(ivf.centroids)} cụm): {time.perf_counter() - started:.1f}s")
+    ordered = np.asarray(ivf.vectors)
+    sample = embedder.embed([" ".join(text.split()[:5]) for text in rng.choice(texts, 200)])
+    for probe in (4, 8, 16, 32, 64):
+        print(json.dumps(benchmark(ivf, ordered, sample, nprobe=probe), ensure_ascii=False))
@@ -84,14 +84,14 @@ def check_disk_space() -> None:
 async def check_last_sync(core, username: str) -> dict:
     """Kiểm tra thời gian đồng bộ cuối cùng."""
     try:
-        async with aiosqlite.connect(Config.SQLITE_DB_PATH) as conn:
+        async with core.db_pool.reader() as conn:
             async with conn.execute(
                 """
                 SELECT MAX(timestamp) FROM sync_log 
-                WHERE action IN ('SYNC_TO_SQLITE', 'SYNC_FROM_SQLITE') 
-                AND details LIKE ?
+                WHERE username = ?
+                AND action IN ('sync_to_firestore', 'sync_to_sqlite', 'sync_to_sqlite_page')
                 """,
-                (f'%username": "{username}"%',)
+                (username,)
             ) as cursor:
                 last_sync = await cursor.fetchone()
                 current_time = int(time.time())
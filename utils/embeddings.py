@@ -0,0 +1,70 @@
+import zlib
+from typing import Callable, Dict, List, Sequence
+from config import Config
+from utils.fts_query import fold_text, tokenize
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+
+class HashedNgramEmbedder:
+    """Embedding cục bộ không cần tải model: băm n-gram ký tự và token vào vector cố định.
+
+    Văn bản được bỏ dấu trước khi băm nên câu gõ không dấu vẫn gần câu có dấu.
+    Mỗi đặc trưng được băm (crc32) vào một chiều với dấu +/-; vector trả về
+    đã chuẩn hóa L2 để tích vô hướng chính là cosine.
+    """
+
+    def __init__(self, dim: int = Config.EMBEDDING_DIM, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+        self.name = f"hashed-ngram-{ngram}-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        folded = " ".join(fold_text(text).split())
+        padded = f" {folded} "
+        grams = [padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)]
+        return grams + [f"w:{token}" for token in tokenize(folded)]
+
+    def embed_one(self, text: str):
+        hashes = [zlib.crc32(feature.encode()) for feature in self._features(text)]
+        if not hashes:
+            return np.zeros(self.dim, dtype=np.float32)
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        signs = np.where(hashes & 0x80000000, 1.0, -1.0)
+        vector = np.bincount((hashes % self.dim).astype(np.int64), weights=signs, minlength=self.dim).astype(np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def embed(self, texts: Sequence[str]):
+        """Trả về ma trận float32 (len(texts), dim) đã chuẩn hóa L2."""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.vstack([self.embed_one(text) for text in texts])
+
+
+# Registry embedder: tên -> factory. Đăng ký thêm embedder khác (ví dụ model ONNX
+# cục bộ) bằng register_embedder rồi đặt Config.EMBEDDING_BACKEND.
+EMBEDDERS: Dict[str, Callable[[], object]] = {
+    "hashed": HashedNgramEmbedder,
+}
+
+
+def register_embedder(name: str, factory: Callable[[], object]) -> None:
+    """Đăng ký embedder; factory trả về đối tượng có name, dim và embed(texts)."""
+    EMBEDDERS[name] = factory
+
+
+def get_embedder(name: str = Config.EMBEDDING_BACKEND):
+    if name not in EMBEDDERS:
+        raise ValueError(f"Embedder không hỗ trợ: {name}")
+    return EMBEDDERS[name]()
+
+
+def qa_embedding_text(question: str, answer: str) -> str:
+    """Văn bản dùng để embed một cặp QA; câu hỏi được lặp để có trọng số cao hơn."""
+    return f"{question or ''} {question or ''} {answer or ''}"
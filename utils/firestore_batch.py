@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from config import Config
+from utils.logging import get_logger
+from utils.core_common import retry_firestore_operation
+
+logger = get_logger("FirestoreBatch")
+
+
+def content_hash(data: Dict) -> str:
+    """Hash nội dung bản ghi (JSON sắp khóa) để phát hiện thay đổi mà không đọc Firestore."""
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class FirestoreBatchWriter:
+    """Gom thao tác ghi Firestore thành WriteBatch, tối đa max_ops thao tác mỗi commit.
+
+    Tối đa max_in_flight commit chạy đồng thời; khi đủ, lệnh ghi tiếp theo chờ
+    (backpressure) thay vì dồn bộ nhớ. Mỗi thao tác mang một tag tùy ý; tag của
+    thao tác đã commit thành công nằm trong committed, thất bại nằm trong failed.
+    """
+
+    def __init__(
+        self,
+        db,
+        max_ops: int = Config.FIRESTORE_BATCH_MAX_OPS,
+        max_in_flight: int = Config.FIRESTORE_MAX_INFLIGHT_COMMITS
+    ):
+        self.db = db
+        self.max_ops = max(1, min(500, max_ops))
+        self._ops: List[Tuple[str, str, str, Optional[Dict], bool, Any]] = []
+        self._semaphore = asyncio.Semaphore(max(1, max_in_flight))
+        self._in_flight: Set[asyncio.Task] = set()
+        self.committed: List[Any] = []
+        self.failed: List[Any] = []
+        self.commits = 0
+        self.ops_written = 0
+
+    async def set(self, collection: str, doc_id: str, data: Dict, merge: bool = True, tag: Any = None) -> None:
+        await self._add(("set", collection, doc_id, data, merge, tag))
+
+    async def delete(self, collection: str, doc_id: str, tag: Any = None) -> None:
+        await self._add(("delete", collection, doc_id, None, False, tag))
+
+    async def _add(self, op) -> None:
+        self._ops.append(op)
+        if len(self._ops) >= self.max_ops:
+            await self._dispatch()
+
+    async def _dispatch(self) -> None:
+        ops, self._ops = self._ops, []
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._commit(ops))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _commit(self, ops) -> None:
+        async def commit_batch():
+            batch = self.db.batch()
+            for kind, collection, doc_id, data, merge, _ in ops:
+                ref = self.db.collection(collection).document(doc_id)
+                if kind == "set":
+                    batch.set(ref, data, merge=merge)
+                else:
+                    batch.delete(ref)
+            await batch.commit()
+            return len(ops)
+
+        try:
+            await retry_firestore_operation(commit_batch)
+            self.commits += 1
+            self.ops_written += len(ops)
+            self.committed.extend(op[5] for op in ops)
+        except Exception as e:
+            logger.error(f"Lỗi commit batch {len(ops)} thao tác Firestore: {str(e)}")
+            self.failed.extend(op[5] for op in ops)
+        finally:
+            self._semaphore.release()
+
+    async def flush(self) -> None:
+        """Commit phần còn lại và chờ mọi commit đang chạy hoàn tất."""
+        if self._ops:
+            await self._dispatch()
+        if self._in_flight:
+            await asyncio.gather(*list(self._in_flight))
+
+    def take_committed(self) -> List[Any]:
+        """Lấy và xóa danh sách tag đã commit (dùng sau flush để ghi manifest)."""
+        committed, self.committed = self.committed, []
+        return committed
+
+    def stats(self) -> Dict[str, int]:
+        return {"commits": self.commits, "ops_written": self.ops_written, "failed": len(self.failed)}
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from config import Config
+from utils.logging import get_logger
+
+logger = get_logger("FirestoreListener")
+
+
+class FirestoreListener:
+    """Nhận thay đổi Firestore theo thời gian thực qua on_snapshot (chế độ tùy chọn).
+
+    Mỗi collection trong SYNC_LISTENER_COLLECTIONS có một listener; callback (chạy
+    trên thread của client Firestore) chỉ đưa thay đổi vào hàng đợi của event loop.
+    Một task gom thay đổi trong SYNC_LISTENER_FLUSH_DELAY giây rồi ghi vào SQLite qua
+    FirestoreHandler.apply_listener_changes (hàng đợi ghi). Mỗi lần khởi động nghe lại
+    toàn bộ collection (tài liệu trùng hash không bị ghi lại) để không bỏ sót thay đổi
+    lúc tiến trình dừng; checkpoint "listen" chỉ ghi nhận mốc đã áp dụng.
+    """
+
+    def __init__(
+        self,
+        core,
+        username: str = Config.SYNC_DAEMON_USERNAME,
+        collections: Iterable[str] = Config.SYNC_LISTENER_COLLECTIONS
+    ):
+        self.core = core
+        self.username = username
+        self.collections = list(collections)
+        self.enabled = Config.SYNC_LISTENER_ENABLED
+        self._watches: Dict[str, Any] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional[asyncio.Task] = None
+        self.events = 0
+        self.applied = 0
+        self.removed = 0
+        self.errors = 0
+        self.last_event_at: Optional[int] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self._watches) and bool(self.task and not self.task.done())
+
+    async def start(self) -> bool:
+        """Đăng ký listener cho các collection; trả về False nếu không thể bật."""
+        if not self.enabled or self.active:
+            return self.active
+        handler = self.core.firestore_handler
+        client = handler.get_watch_client()
+        if client is None:
+            logger.warning("Không có client Firestore hỗ trợ on_snapshot, không bật listener")
+            return False
+
+        self._loop = asyncio.get_running_loop()
+        async with self.core.db_pool.reader() as conn:
+            checkpoints = {
+                "": await handler._load_checkpoints(conn, "listen", ""),
+                self.username: await handler._load_checkpoints(conn, "listen", self.username)
+            }
+        self.task = asyncio.create_task(self._consume())
+        for collection_name in self.collections:
+            checkpoint = (
+                checkpoints[self.username].get(collection_name)
+                or checkpoints[""].get(collection_name)
+            )
+            try:
+                query = handler.build_listener_query(client, collection_name, self.username)
+                self._watches[collection_name] = query.on_snapshot(self._callback(collection_name))
+                logger.info(
+                    f"Lắng nghe {collection_name}"
+                    + (f" (đã áp dụng tới mốc {checkpoint[1]})" if checkpoint and checkpoint[1] is not None else "")
+                )
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.error(f"Lỗi đăng ký listener cho {collection_name}: {str(e)}")
+        if not self._watches:
+            await self.stop()
+            return False
+        return True
+
+    def _callback(self, collection_name: str):
+        def on_snapshot(snapshots, changes, read_time):
+            for change in changes:
+                item = (collection_name, change.type.name, change.document)
+                try:
+                    self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+                except RuntimeError:
+                    # Event loop đã đóng khi ứng dụng tắt
+                    return
+        return on_snapshot
+
+    async def _consume(self):
+        while True:
+            try:
+                batch = [await self._queue.get()]
+                await asyncio.sleep(Config.SYNC_LISTENER_FLUSH_DELAY)
+                while not self._queue.empty() and len(batch) < Config.BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+                await self._apply(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.error(f"Lỗi áp dụng thay đổi từ listener: {str(e)}")
+
+    async def _apply(self, batch: List[tuple]) -> None:
+        self.events += len(batch)
+        self.last_event_at = int(time.time())
+        by_collection: Dict[str, List[tuple]] = {}
+        for collection_name, kind, snapshot in batch:
+            by_collection.setdefault(collection_name, []).append((kind, snapshot))
+        for collection_name, changes in by_collection.items():
+            result = await self.core.firestore_handler.apply_listener_changes(
+                collection_name, changes, self.username
+            )
+            self.applied += result.get("synced_records", 0)
+            self.removed += result.get("removed_records", 0)
+
+    async def drain(self) -> None:
+        """Áp dụng ngay các thay đổi đang chờ trong hàng đợi."""
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._apply(batch)
+
+    async def stop(self) -> None:
+        for collection_name, watch in list(self._watches.items()):
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.warning(f"Lỗi hủy listener {collection_name}: {str(e)}")
+        self._watches.clear()
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        try:
+            await self.drain()
+        except Exception as e:
+            logger.error(f"Lỗi áp dụng thay đổi còn lại từ listener: {str(e)}")
+
+    def status(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "active": self.active,
+            "collections": list(self._watches),
+            "pending": self._queue.qsize(),
+            "events": self.events,
+            "applied": self.applied,
+            "removed": self.removed,
+            "errors": self.errors,
+            "last_event_at": self.last_event_at,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,63 @@
+import re
+import unicodedata
+from typing import Iterable, List, Optional
+from config import Config
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_text(text) -> str:
+    """Bỏ dấu tiếng Việt và chuyển chữ thường ("Khách sạn Đà Nẵng" -> "khach san da nang").
+
+    Khớp với cách qa_fts lập chỉ mục (tokenizer unicode61 remove_diacritics 2
+    trên cột đã thay đ/Đ bằng d/D), nên câu gõ không dấu vẫn tìm thấy dữ liệu có dấu.
+    """
+    text = str(text or "").replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(text) -> List[str]:
+    """Tách token (chữ/số) từ văn bản đã bỏ dấu; ký tự đặc biệt của FTS5 bị loại."""
+    return _TOKEN_RE.findall(fold_text(text))
+
+
+def quote_term(term: str) -> str:
+    """Đặt token trong dấu nháy kép theo cú pháp chuỗi FTS5."""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def compile_qa_query(text, near_distance: int = Config.QA_FTS_NEAR_DISTANCE) -> Optional[str]:
+    """Biên dịch câu người dùng thành biểu thức MATCH FTS5 cho qa_fts.
+
+    Gồm các nhánh OR (cụm từ chính xác, NEAR, mọi token, bất kỳ token) để
+    bm25 xếp các khớp chặt lên trước mà vẫn giữ được khớp một phần. Token
+    luôn được đặt trong nháy kép nên dấu nháy, gạch nối hay toán tử FTS5 trong
+    câu nhập không thể gây lỗi cú pháp. Trả về None nếu không có token.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    distinct = [quote_term(token) for token in dict.fromkeys(tokens)]
+    if len(distinct) == 1:
+        return f"{distinct[0]} OR {distinct[0]}*"
+    phrase = quote_term(" ".join(tokens))
+    near = f"NEAR({' '.join(quote_term(token) for token in tokens)}, {int(near_distance)})"
+    every = " AND ".join(distinct[:-1] + [distinct[-1] + "*"])
+    any_term = " OR ".join(distinct[:-1] + [distinct[-1] + "*"])
+    return f"{phrase} OR {near} OR ({every}) OR {any_term}"
+
+
+def token_coverage(query_text, fields: Iterable) -> float:
+    """Tỉ lệ token (0-1) của câu truy vấn xuất hiện trong các trường; token cuối khớp tiền tố."""
+    tokens = list(dict.fromkeys(tokenize(query_text)))
+    if not tokens:
+        return 0.0
+    field_tokens = set()
+    for field in fields:
+        field_tokens.update(tokenize(field))
+    matched = sum(1 for token in tokens[:-1] if token in field_tokens)
+    last = tokens[-1]
+    if last in field_tokens or any(candidate.startswith(last) for candidate in field_tokens):
+        matched += 1
+    return matched / len(tokens)
@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from rapidfuzz import process, fuzz
+from config import Config
+from utils.logging import get_logger
+
+logger = get_logger("FuzzyMatcher")
+
+
+class FuzzyMatcher:
+    """Chấm điểm fuzzy hàng loạt bằng rapidfuzz trong thread pool riêng.
+
+    Điểm của một bản ghi là max của ratio/token_sort_ratio/partial_ratio trên
+    câu hỏi và câu trả lời (giống cách tính cũ với fuzzywuzzy), nhưng mỗi
+    scorer chạy một lượt process.extract với score_cutoff để bỏ sớm bản ghi yếu.
+    """
+
+    SCORERS = (fuzz.ratio, fuzz.token_sort_ratio, fuzz.partial_ratio)
+
+    def __init__(self, max_workers: int = Config.FUZZY_MATCH_WORKERS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers),
+            thread_name_prefix="fuzzy-match"
+        )
+
+    @classmethod
+    def score_batch(
+        cls,
+        query: str,
+        questions: List[str],
+        answers: List[str],
+        score_cutoff: float
+    ) -> Dict[int, float]:
+        """Trả về {chỉ số: điểm cao nhất} cho các bản ghi đạt score_cutoff (0-100)."""
+        best: Dict[int, float] = {}
+        for choices in (questions, answers):
+            for scorer in cls.SCORERS:
+                for _, score, index in process.extract(
+                    query,
+                    choices,
+                    scorer=scorer,
+                    processor=None,
+                    score_cutoff=score_cutoff,
+                    limit=None
+                ):
+                    if score > best.get(index, -1.0):
+                        best[index] = score
+        return best
+
+    async def score(
+        self,
+        query: str,
+        questions: List[str],
+        answers: List[str],
+        threshold: float
+    ) -> Dict[int, float]:
+        """Chạy score_batch ngoài event loop; threshold theo thang 0-1."""
+        if not questions:
+            return {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self.score_batch,
+            query,
+            questions,
+            answers,
+            threshold * 100
+        )
+
+    def close(self):
+        """Dừng thread pool, hủy các tác vụ đang chờ."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Đã dừng thread pool fuzzy matching")
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, Optional
+from config import Config
+from utils.logging import get_logger
+
+logger = get_logger("LLMResponseCache")
+
+
+def normalize_prompt(text: Any) -> str:
+    """Chuẩn hóa prompt cho khóa cache: chữ thường, gộp khoảng trắng (giữ dấu)."""
+    return " ".join(str(text or "").lower().split())
+
+
+class LLMResponseCache:
+    """Cache phản hồi LLM lưu trong bảng SQLite llm_cache, có TTL và giới hạn số mục.
+
+    Đọc qua pool đọc, ghi qua hàng đợi ghi gộp của SQLiteHandler. Bộ đếm
+    hit/miss và độ trễ tiết kiệm được giữ trong bộ nhớ của tiến trình.
+    """
+
+    def __init__(self, core, ttl: int = Config.LLM_CACHE_TTL, max_entries: int = Config.LLM_CACHE_MAX_ENTRIES):
+        self.core = core
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, prompt: str, context: str = "") -> str:
+        """Khóa cache = sha256(model, system prompt, prompt chuẩn hóa, hash ngữ cảnh QA)."""
+        context_hash = hashlib.sha256(normalize_prompt(context).encode()).hexdigest()
+        payload = json.dumps(
+            [model, system_prompt, normalize_prompt(prompt), context_hash],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Lấy phản hồi còn hạn; cập nhật thống kê và thời điểm dùng gần nhất."""
+        try:
+            async with self.core.db_pool.reader() as conn:
+                async with conn.execute(
+                    "SELECT response, latency_ms FROM llm_cache WHERE cache_key = ? AND created_at > ?",
+                    (key, int(time.time()) - self.ttl)
+                ) as cursor:
+                    row = await cursor.fetchone()
+        except Exception as e:
+            logger.warning(f"Lỗi đọc llm_cache: {str(e)}")
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.saved_ms += row[1] or 0.0
+
+        async def write_op(conn):
+            await conn.execute(
+                "UPDATE llm_cache SET last_hit_at = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+                (int(time.time()), key)
+            )
+        try:
+            await self.core.sqlite_handler.enqueue_write(write_op)
+        except Exception as e:
+            logger.warning(f"Lỗi cập nhật llm_cache: {str(e)}")
+        return row[0]
+
+    async def set(self, key: str, model: str, response: str, latency_ms: float) -> None:
+        """Lưu phản hồi và loại bỏ mục hết hạn/ít dùng nhất khi vượt giới hạn."""
+        now = int(time.time())
+
+        async def write_op(conn):
+            await conn.execute(
+                """
+                INSERT OR REPLACE INTO llm_cache
+                    (cache_key, model, response, latency_ms, created_at, last_hit_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, model, response, latency_ms, now, now)
+            )
+            await conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+            await conn.execute(
+                """
+                DELETE FROM llm_cache WHERE cache_key IN (
+                    SELECT cache_key FROM llm_cache
+                    ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+        try:
+            await self.core.sqlite_handler.enqueue_write(write_op)
+        except Exception as e:
+            logger.warning(f"Lỗi ghi llm_cache: {str(e)}")
+
+    async def clear(self) -> None:
+        async def write_op(conn):
+            await conn.execute("DELETE FROM llm_cache")
+        await self.core.sqlite_handler.enqueue_write(write_op)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê hit/miss và tổng độ trễ LLM tiết kiệm nhờ cache."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "saved_latency_ms": round(self.saved_ms, 2)
+        }
@@ -0,0 +1,32 @@
+from collections import deque
+from typing import Any, Dict
+
+
+class LatencyStats:
+    """Thống kê độ trễ (ms) trên cửa sổ trượt N mẫu gần nhất."""
+
+    def __init__(self, window: int = 500):
+        self._samples: deque = deque(maxlen=max(1, window))
+        self.count = 0
+
+    def record(self, value_ms: float) -> None:
+        self._samples.append(float(value_ms))
+        self.count += 1
+
+    @staticmethod
+    def _percentile(ordered: list, q: float) -> float:
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, Any]:
+        """Trả về count, avg, p50, p95, max của cửa sổ hiện tại."""
+        if not self._samples:
+            return {"count": self.count, "avg_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "avg_ms": round(sum(ordered) / len(ordered), 2),
+            "p50_ms": round(self._percentile(ordered, 0.5), 2),
+            "p95_ms": round(self._percentile(ordered, 0.95), 2),
+            "max_ms": round(ordered[-1], 2)
+        }
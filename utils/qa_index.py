@@ -0,0 +1,207 @@
+import asyncio
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from config import Config
+from utils.logging import get_logger
+from utils.fts_query import fold_text
+
+logger = get_logger("QAIndex")
+
+QA_INDEX_FIELDS = ("id", "question", "answer", "category", "created_by", "created_at", "timestamp")
+
+
+def normalize_qa_text(text: Any) -> str:
+    """Chuẩn hóa văn bản QA: bỏ dấu tiếng Việt, chữ thường, gộp khoảng trắng."""
+    return " ".join(fold_text(text).split())
+
+
+def text_trigrams(text: str) -> Set[str]:
+    """Tập trigram ký tự của văn bản đã chuẩn hóa (có đệm khoảng trắng hai đầu)."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class UserQAIndex:
+    """Chỉ mục QA trong bộ nhớ của một user.
+
+    Lưu câu hỏi/câu trả lời đã chuẩn hóa, tập token và chỉ mục ngược theo
+    trigram và token để sinh ứng viên fuzzy mà không đọc đĩa.
+    """
+
+    def __init__(self):
+        self.records: Dict[str, Dict] = {}
+        self.normalized: Dict[str, Tuple[str, str]] = {}
+        self._keys: Dict[str, Tuple[frozenset, frozenset]] = {}
+        self._gram_postings: Dict[str, Set[str]] = defaultdict(set)
+        self._token_postings: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def upsert(self, record: Dict) -> None:
+        record_id = record["id"]
+        self.remove(record_id)
+        question = normalize_qa_text(record.get("question"))
+        answer = normalize_qa_text(record.get("answer"))
+        grams = frozenset(text_trigrams(question) | text_trigrams(answer))
+        tokens = frozenset(question.split()) | frozenset(answer.split())
+        self.records[record_id] = record
+        self.normalized[record_id] = (question, answer)
+        self._keys[record_id] = (grams, tokens)
+        for gram in grams:
+            self._gram_postings[gram].add(record_id)
+        for token in tokens:
+            self._token_postings[token].add(record_id)
+
+    def remove(self, record_id: str) -> bool:
+        keys = self._keys.pop(record_id, None)
+        if keys is None:
+            return False
+        grams, tokens = keys
+        for postings, terms in ((self._gram_postings, grams), (self._token_postings, tokens)):
+            for term in terms:
+                ids = postings.get(term)
+                if ids is not None:
+                    ids.discard(record_id)
+                    if not ids:
+                        del postings[term]
+        self.records.pop(record_id, None)
+        self.normalized.pop(record_id, None)
+        return True
+
+    def candidates(self, query: str, limit: int) -> List[str]:
+        """Trả về tối đa limit id có nhiều trigram/token chung với câu truy vấn nhất.
+
+        Nếu số bản ghi không vượt quá limit thì trả về tất cả để giữ nguyên
+        kết quả của lượt chấm điểm đầy đủ. Trigram/token xuất hiện ở quá nửa số
+        bản ghi bị bỏ qua vì không có tính phân biệt.
+        """
+        if len(self.records) <= limit:
+            return list(self.records)
+        normalized = normalize_qa_text(query)
+        common_cutoff = max(1, len(self.records) // 2)
+        counts: Dict[str, int] = defaultdict(int)
+        for gram in text_trigrams(normalized):
+            ids = self._gram_postings.get(gram)
+            if ids and len(ids) <= common_cutoff:
+                for record_id in ids:
+                    counts[record_id] += 1
+        for token in set(normalized.split()):
+            ids = self._token_postings.get(token)
+            if ids and len(ids) <= common_cutoff:
+                for record_id in ids:
+                    counts[record_id] += 2
+        return sorted(counts, key=counts.__getitem__, reverse=True)[:limit]
+
+
+class QAIndexManager:
+    """Quản lý chỉ mục QA theo user, dựng lười khi dùng lần đầu và loại bỏ theo LRU."""
+
+    def __init__(self, max_users: int = Config.QA_INDEX_MAX_USERS):
+        self.max_users = max(1, max_users)
+        self._indexes: "OrderedDict[str, UserQAIndex]" = OrderedDict()
+        self._owners: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._building: Set[str] = set()
+        self._stale: Set[str] = set()
+        self.hits = 0
+        self.builds = 0
+        self.evictions = 0
+
+    def has_loaded(self) -> bool:
+        return bool(self._indexes) or bool(self._building)
+
+    async def get(
+        self,
+        username: str,
+        loader: Callable[[], Awaitable[Iterable[Dict]]]
+    ) -> UserQAIndex:
+        """Lấy chỉ mục của user, dựng từ loader() nếu chưa có."""
+        index = self._indexes.get(username)
+        if index is not None:
+            self._indexes.move_to_end(username)
+            self.hits += 1
+            return index
+
+        lock = self._locks.setdefault(username, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(username)
+            if index is not None:
+                self._indexes.move_to_end(username)
+                self.hits += 1
+                return index
+
+            self._building.add(username)
+            try:
+                index = UserQAIndex()
+                for position, record in enumerate(await loader(), 1):
+                    index.upsert(record)
+                    if position % 1000 == 0:
+                        # Nhường event loop khi dựng chỉ mục lớn
+                        await asyncio.sleep(0)
+            finally:
+                self._building.discard(username)
+
+            self.builds += 1
+            if username in self._stale:
+                # Có thay đổi trong lúc dựng: dùng cho lần này, lần sau dựng lại
+                self._stale.discard(username)
+                logger.debug(f"{username}: Chỉ mục QA thay đổi trong lúc dựng, không lưu")
+                return index
+
+            self._indexes[username] = index
+            for record_id in index.records:
+                self._owners[record_id] = username
+            while len(self._indexes) > self.max_users:
+                evicted_user, evicted = self._indexes.popitem(last=False)
+                for record_id in evicted.records:
+                    self._owners.pop(record_id, None)
+                self._locks.pop(evicted_user, None)
+                self.evictions += 1
+            logger.info(f"{username}: Dựng chỉ mục QA trong bộ nhớ với {len(index)} bản ghi")
+            return index
+
+    def upsert(self, record: Dict) -> None:
+        """Cập nhật một bản ghi qa_data vào chỉ mục của chủ sở hữu (nếu đang nạp)."""
+        record_id = record["id"]
+        username = record.get("created_by")
+        previous = self._owners.get(record_id)
+        if previous is not None and previous != username:
+            self.remove(record_id)
+        if username in self._building:
+            self._stale.add(username)
+        index = self._indexes.get(username)
+        if index is not None:
+            index.upsert(record)
+            self._owners[record_id] = username
+
+    def remove(self, record_id: str) -> None:
+        """Xóa một bản ghi khỏi chỉ mục đang nạp."""
+        username = self._owners.pop(record_id, None)
+        if username is None:
+            # Không rõ chủ sở hữu: các chỉ mục đang dựng có thể đã đọc bản ghi này
+            self._stale.update(self._building)
+            return
+        index = self._indexes.get(username)
+        if index is not None:
+            index.remove(record_id)
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        """Bỏ chỉ mục của một user (hoặc tất cả) để dựng lại ở lần dùng sau."""
+        users = list(self._indexes) if username is None else [username]
+        for user in users:
+            index = self._indexes.pop(user, None)
+            if index is not None:
+                for record_id in index.records:
+                    self._owners.pop(record_id, None)
+        self._stale.update(self._building if username is None else self._building & {username})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._indexes),
+            "max_users": self.max_users,
+            "records": len(self._owners),
+            "hits": self.hits,
+            "builds": self.builds,
+            "evictions": self.evictions
+        }
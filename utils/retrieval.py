@@ -0,0 +1,47 @@
+from typing import Dict, List, Mapping, Optional
+from config import Config
+
+
+def calibrate(stage: str, score: float) -> float:
+    """Đưa điểm thô (0-100) của một stage về thang chung 0-1 theo RETRIEVAL_CALIBRATION."""
+    low, high = Config.RETRIEVAL_CALIBRATION.get(stage, (0.0, 100.0))
+    if high <= low:
+        return 1.0 if score >= high else 0.0
+    return min(1.0, max(0.0, (score - low) / (high - low)))
+
+
+def reciprocal_rank_fusion(
+    ranked: Mapping[str, List[Dict]],
+    k: int = Config.RETRIEVAL_RRF_K,
+    weights: Optional[Mapping[str, float]] = None
+) -> List[Dict]:
+    """Gộp danh sách kết quả của các stage (đã xếp hạng) bằng reciprocal rank fusion.
+
+    Thứ tự theo tổng weight / (k + hạng). Mỗi bản ghi trả về có "score" (0-100)
+    là điểm đã hiệu chỉnh cao nhất trong các stage tìm thấy nó, "rrf" và
+    "sources" (điểm thô theo stage).
+    """
+    weights = weights or Config.RETRIEVAL_STAGE_WEIGHTS
+    fused: Dict[str, Dict] = {}
+    for stage, results in ranked.items():
+        weight = weights.get(stage, 1.0)
+        for rank, record in enumerate(results, 1):
+            entry = fused.get(record["id"])
+            if entry is None:
+                entry = fused[record["id"]] = {
+                    **{key: value for key, value in record.items() if key != "score"},
+                    "rrf": 0.0,
+                    "calibrated": 0.0,
+                    "sources": {}
+                }
+            entry["rrf"] += weight / (k + rank)
+            entry["calibrated"] = max(entry["calibrated"], calibrate(stage, record.get("score") or 0.0))
+            entry["sources"][stage] = record.get("score")
+
+    results = []
+    for entry in fused.values():
+        entry["score"] = round(entry.pop("calibrated") * 100, 1)
+        entry["rrf"] = round(entry["rrf"], 6)
+        results.append(entry)
+    results.sort(key=lambda x: (x["rrf"], x["score"], x.get("timestamp") or 0), reverse=True)
+    return results
@@ -0,0 +1,124 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import aiosqlite
+from config import Config
+from utils.logging import get_logger
+from utils.exceptions import DatabaseError
+
+logger = get_logger("SQLitePool")
+
+
+class SQLitePool:
+    """Pool kết nối SQLite dùng chung: N kết nối đọc và một kết nối ghi duy nhất.
+
+    PRAGMA được áp dụng một lần khi mở kết nối; cache câu lệnh của sqlite3
+    (cached_statements) được giữ nguyên suốt vòng đời kết nối.
+    """
+
+    def __init__(
+        self,
+        db_path: str = Config.SQLITE_DB_PATH,
+        readers: int = Config.SQLITE_POOL_READERS,
+        timeout: float = Config.SQLITE_POOL_TIMEOUT
+    ):
+        self.db_path = db_path
+        self.reader_count = max(1, readers)
+        self.timeout = timeout
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        """Mở một kết nối và áp dụng PRAGMA."""
+        conn = await aiosqlite.connect(
+            self.db_path,
+            timeout=self.timeout,
+            cached_statements=Config.SQLITE_STATEMENT_CACHE
+        )
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            await conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    async def open(self):
+        """Mở các kết nối của pool (chỉ thực hiện một lần)."""
+        if self._opened:
+            return
+        async with self._open_lock:
+            if self._opened:
+                return
+            try:
+                self._writer = await self._connect()
+                self._idle = asyncio.Queue()
+                for _ in range(self.reader_count):
+                    conn = await self._connect(read_only=True)
+                    self._readers.append(conn)
+                    self._idle.put_nowait(conn)
+                self._opened = True
+                logger.info(f"Mở pool SQLite: {self.reader_count} kết nối đọc, 1 kết nối ghi")
+            except Exception as e:
+                logger.error(f"Lỗi mở pool SQLite: {str(e)}", exc_info=True)
+                await self._close_connections()
+                raise DatabaseError(f"Lỗi mở pool SQLite: {str(e)}")
+
+    async def _close_connections(self):
+        for conn in self._readers + ([self._writer] if self._writer else []):
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning(f"Lỗi đóng kết nối SQLite: {str(e)}")
+        self._readers = []
+        self._writer = None
+        self._idle = None
+
+    async def close(self):
+        """Đóng toàn bộ kết nối của pool."""
+        async with self._open_lock:
+            if not self._opened:
+                return
+            async with self._writer_lock:
+                await self._close_connections()
+                self._opened = False
+            logger.info("Đã đóng pool SQLite")
+
+    @asynccontextmanager
+    async def reader(self):
+        """Mượn một kết nối chỉ đọc từ pool."""
+        await self.open()
+        idle = self._idle
+        conn = await idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                try:
+                    await conn.rollback()
+                except Exception as e:
+                    logger.warning(f"Lỗi rollback kết nối đọc: {str(e)}")
+            idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Mượn kết nối ghi duy nhất; các thao tác ghi được tuần tự hóa.
+
+        Giao dịch chưa commit khi thoát khối (do lỗi) sẽ bị rollback để
+        không ảnh hưởng tới lần mượn tiếp theo.
+        """
+        await self.open()
+        async with self._writer_lock:
+            conn = self._writer
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    try:
+                        await conn.rollback()
+                    except Exception as e:
+                        logger.warning(f"Lỗi rollback kết nối ghi: {str(e)}")
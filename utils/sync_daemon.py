@@ -0,0 +1,166 @@
+import asyncio
+import time
+from typing import Dict, Optional
+from config import Config
+from utils.logging import get_logger
+
+logger = get_logger("SyncDaemon")
+
+
+class SyncDaemon:
+    """Đồng bộ Firestore định kỳ chạy nền (kéo rồi đẩy delta mỗi SYNC_INTERVAL giây).
+
+    Thay đổi cục bộ gọi notify_change() để đồng bộ sớm hơn; các thay đổi dồn dập
+    được gom trong SYNC_COALESCE_DELAY giây và hai lần chạy luôn cách nhau ít nhất
+    SYNC_MIN_INTERVAL giây. Lỗi liên tiếp làm giãn chu kỳ theo lũy thừa (tối đa
+    SYNC_MAX_BACKOFF). Mỗi lần chạy giữ core.firestore_lock như đồng bộ thủ công.
+    """
+
+    def __init__(
+        self,
+        core,
+        username: str = Config.SYNC_DAEMON_USERNAME,
+        interval: float = Config.SYNC_INTERVAL
+    ):
+        self.core = core
+        self.username = username
+        self.interval = max(1.0, interval)
+        self.enabled = Config.SYNC_DAEMON_ENABLED
+        self.task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.syncing = False
+        self.runs = 0
+        self.skipped = 0
+        self.consecutive_failures = 0
+        self.last_run_at: Optional[int] = None
+        self.last_success_at: Optional[int] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_pulled = 0
+        self.last_pushed = 0
+        self.next_run_at: Optional[float] = None
+
+    def start(self) -> None:
+        """Chạy daemon nền nếu được bật và chưa chạy."""
+        if not self.enabled or (self.task and not self.task.done()):
+            return
+        self.task = asyncio.create_task(self._loop())
+        logger.info(f"Khởi động đồng bộ nền cho {self.username}, chu kỳ {self.interval}s")
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def notify_change(self) -> None:
+        """Báo có thay đổi cục bộ cần đẩy; nhiều lần gọi liên tiếp chỉ gây một lần đồng bộ."""
+        if self.task and not self.task.done():
+            self._wakeup.set()
+
+    def _next_delay(self) -> float:
+        if not self.consecutive_failures:
+            return self.interval
+        return min(
+            self.interval * (2 ** (self.consecutive_failures - 1)),
+            Config.SYNC_MAX_BACKOFF
+        )
+
+    async def _loop(self):
+        while True:
+            try:
+                delay = self._next_delay()
+                self.next_run_at = time.time() + delay
+                if self.consecutive_failures:
+                    # Đang backoff: bỏ qua tín hiệu thay đổi cho tới hết thời gian chờ
+                    await asyncio.sleep(delay)
+                else:
+                    try:
+                        async with asyncio.timeout(delay):
+                            await self._wakeup.wait()
+                        # Gom các thay đổi dồn dập thành một lần đồng bộ
+                        await asyncio.sleep(Config.SYNC_COALESCE_DELAY)
+                    except TimeoutError:
+                        pass
+                if self.last_run_at is not None:
+                    wait = Config.SYNC_MIN_INTERVAL - (time.time() - self.last_run_at)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                self._wakeup.clear()
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Lỗi trong vòng lặp đồng bộ nền: {str(e)}")
+                await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> Dict:
+        """Kéo rồi đẩy delta một lần; trả về kết quả dạng {"success"/"error": ...}."""
+        if not self.core.firestore_available:
+            self.skipped += 1
+            logger.debug("Firestore không khả dụng, bỏ qua đồng bộ nền")
+            return {"error": "Firestore không khả dụng"}
+
+        async with self.core.firestore_lock:
+            self.syncing = True
+            started = time.perf_counter()
+            self.last_run_at = int(time.time())
+            try:
+                pulled = await self.core.sync_to_sqlite(self.username)
+                pushed = await self.core.sync_from_sqlite(self.username)
+                error = pulled.get("error") or pushed.get("error")
+            except Exception as e:
+                pulled, pushed, error = {}, {}, str(e)
+            finally:
+                self.syncing = False
+                self.runs += 1
+                self.last_duration = round(time.perf_counter() - started, 3)
+
+        self.last_pulled = pulled.get("synced_records", 0)
+        self.last_pushed = pushed.get("synced_records", 0)
+        if error:
+            self.consecutive_failures += 1
+            self.last_error = error
+            logger.warning(
+                f"Đồng bộ nền thất bại ({self.consecutive_failures} lần liên tiếp): {error}"
+            )
+            return {"error": error}
+
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_success_at = self.last_run_at
+        if self.last_pulled or self.last_pushed:
+            logger.info(
+                f"Đồng bộ nền: kéo {self.last_pulled}, đẩy {self.last_pushed} bản ghi "
+                f"trong {self.last_duration}s"
+            )
+        return {
+            "success": "Đồng bộ nền thành công",
+            "synced_to_sqlite": self.last_pulled,
+            "synced_to_firestore": self.last_pushed
+        }
+
+    def status(self) -> Dict:
+        """Trạng thái daemon (không gọi mạng)."""
+        return {
+            "enabled": self.enabled,
+            "running": bool(self.task and not self.task.done()),
+            "syncing": self.syncing,
+            "interval": self.interval,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "pending_changes": self._wakeup.is_set(),
+            "last_run_at": self.last_run_at,
+            "last_success_at": self.last_success_at,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+            "last_pulled": self.last_pulled,
+            "last_pushed": self.last_pushed,
+            "next_run_in": (
+                max(0.0, round(self.next_run_at - time.time(), 1)) if self.next_run_at else None
+            )
+        }
@@ -0,0 +1,350 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from config import Config
+from utils.logging import get_logger
+from utils.embeddings import HAS_NUMPY, np, get_embedder, qa_embedding_text
+from utils.ann_index import IVFIndex, UserVectorIndex, ann_index_path, benchmark
+
+logger = get_logger("QAVectorStore")
+
+# Lùi mốc built_at của chỉ mục ANN để lần nạp sau đọc lại cả embedding ghi gần lúc compact
+ANN_RECONCILE_SLACK = 300
+
+
+class QAVectorStore:
+    """Truy hồi QA theo embedding cục bộ (CPU), dùng cho ngữ cảnh chế độ Hybrid.
+
+    Embedding lưu dạng BLOB float32 trong bảng qa_embeddings cạnh qa_data;
+    ma trận của mỗi user được nạp lười vào bộ nhớ (LRU như chỉ mục QA). Bản ghi
+    chưa có embedding (hoặc embedding của model khác) được embed khi dựng,
+    bản ghi mới/sửa được embed tăng dần qua refresh_qa_index.
+
+    User có từ ANN_MIN_ROWS bản ghi dùng chỉ mục IVF lưu cạnh file SQLite
+    (memory map khi nạp); thay đổi được gom vào delta và compact khi đủ lớn.
+    """
+
+    def __init__(self, core, max_users: int = Config.QA_INDEX_MAX_USERS):
+        self.core = core
+        self.enabled = HAS_NUMPY and Config.VECTOR_SEARCH_ENABLED
+        self.embedder = get_embedder() if self.enabled else None
+        self.max_users = max(1, max_users)
+        self._indexes: "OrderedDict[str, Any]" = OrderedDict()
+        self._owners: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._building: Set[str] = set()
+        self._stale: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._compacting: Set[str] = set()
+        self.embedded = 0
+        self.builds = 0
+        self.searches = 0
+        self.compactions = 0
+
+    async def embed(self, texts: List[str]):
+        """Embed ngoài event loop."""
+        return await asyncio.to_thread(self.embedder.embed, texts)
+
+    async def _persist(self, rows: List[Tuple[str, str]], vectors) -> None:
+        """Ghi embedding (id, created_by) vào qa_embeddings qua hàng đợi ghi."""
+        now = int(time.time())
+        params = [
+            (record_id, created_by, self.embedder.name, self.embedder.dim, vector.tobytes(), now)
+            for (record_id, created_by), vector in zip(rows, vectors)
+        ]
+
+        async def write_op(conn):
+            await conn.executemany(
+                """
+                INSERT OR REPLACE INTO qa_embeddings (id, created_by, model, dim, vector, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                params
+            )
+        await self.core.sqlite_handler.enqueue_write(write_op)
+
+    async def _embed_missing(self, username: str, index, missing: List[Tuple[str, str]]) -> None:
+        """Embed các bản ghi (id, văn bản) chưa có vector, lưu SQLite và thêm vào chỉ mục."""
+        for start in range(0, len(missing), Config.EMBEDDING_BATCH_SIZE):
+            chunk = missing[start:start + Config.EMBEDDING_BATCH_SIZE]
+            vectors = await self.embed([text for _, text in chunk])
+            for (record_id, _), vector in zip(chunk, vectors):
+                index.upsert(record_id, vector)
+            await self._persist([(record_id, username) for record_id, _ in chunk], vectors)
+            self.embedded += len(chunk)
+        if missing:
+            logger.info(f"{username}: Đã embed {len(missing)} bản ghi QA chưa có vector")
+
+    async def _build(self, username: str):
+        ivf = await asyncio.to_thread(IVFIndex.load, ann_index_path(username), self.embedder.name)
+        if ivf is not None:
+            return await self._reconcile(username, ivf)
+
+        index = UserVectorIndex(self.embedder.dim)
+        missing = []
+        async with self.core.db_pool.reader() as conn:
+            async with conn.execute(
+                """
+                SELECT q.id, q.question, q.answer, e.vector
+                FROM qa_data q
+                LEFT JOIN qa_embeddings e ON e.id = q.id AND e.model = ?
+                WHERE q.created_by = ?
+                """,
+                (self.embedder.name, username)
+            ) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(Config.EMBEDDING_BATCH_SIZE)
+                    if not rows:
+                        break
+                    for record_id, question, answer, blob in rows:
+                        if blob is not None and len(blob) == self.embedder.dim * 4:
+                            index.upsert(record_id, np.frombuffer(blob, dtype=np.float32))
+                        else:
+                            missing.append((record_id, qa_embedding_text(question, answer)))
+                    await asyncio.sleep(0)
+        await self._embed_missing(username, index, missing)
+
+        if len(index) >= Config.ANN_MIN_ROWS:
+            index = self._wrap_ivf(index)
+            await self._compact(username, index)
+        return index
+
+    async def _reconcile(self, username: str, ivf: IVFIndex) -> IVFIndex:
+        """Đồng bộ chỉ mục ANN đã lưu với SQLite: nạp vector mới/sửa, bỏ bản ghi đã xóa."""
+        live: Set[str] = set()
+        changed: List[str] = []
+        missing: List[Tuple[str, str]] = []
+        async with self.core.db_pool.reader() as conn:
+            async with conn.execute(
+                """
+                SELECT q.id, e.timestamp,
+                       CASE WHEN e.id IS NULL THEN q.question END,
+                       CASE WHEN e.id IS NULL THEN q.answer END
+                FROM qa_data q
+                LEFT JOIN qa_embeddings e ON e.id = q.id AND e.model = ?
+                WHERE q.created_by = ?
+                """,
+                (self.embedder.name, username)
+            ) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(Config.FUZZY_SCAN_CHUNK)
+                    if not rows:
+                        break
+                    for record_id, timestamp, question, answer in rows:
+                        live.add(record_id)
+                        if timestamp is None:
+                            missing.append((record_id, qa_embedding_text(question, answer)))
+                        elif timestamp >= ivf.built_at or record_id not in ivf.base_positions:
+                            changed.append(record_id)
+                    await asyncio.sleep(0)
+
+            for record_id in [record_id for record_id in ivf.base_positions if record_id not in live]:
+                ivf.remove(record_id)
+            for start in range(0, len(changed), 500):
+                chunk = changed[start:start + 500]
+                async with conn.execute(
+                    f"SELECT id, vector FROM qa_embeddings WHERE id IN ({', '.join('?' for _ in chunk)})",
+                    chunk
+                ) as cursor:
+                    for record_id, blob in await cursor.fetchall():
+                        ivf.upsert(record_id, np.frombuffer(blob, dtype=np.float32))
+        await self._embed_missing(username, ivf, missing)
+        logger.info(
+            f"{username}: Mở chỉ mục ANN {ivf.base_size} vector, "
+            f"{len(ivf.delta)} thay đổi mới, {ivf.base_size - int(ivf.alive.sum())} đã xóa"
+        )
+        if ivf.needs_compaction():
+            await self._compact(username, ivf)
+        return ivf
+
+    def _wrap_ivf(self, index: UserVectorIndex) -> IVFIndex:
+        """Chuyển ma trận chính xác thành IVF rỗng với ma trận đó làm delta (compact sau)."""
+        ivf = IVFIndex(self.embedder.dim, self.embedder.name)
+        ivf.delta = index
+        return ivf
+
+    def _build_and_save(self, username: str, ids: List[str], vectors, centroids, built_at: int) -> IVFIndex:
+        path = ann_index_path(username)
+        built = IVFIndex.build(ids, vectors, self.embedder.name, previous_centroids=centroids, built_at=built_at)
+        built.save(path)
+        return IVFIndex.load(path, self.embedder.name) or built
+
+    async def _compact(self, username: str, ivf: IVFIndex) -> None:
+        """Gộp delta và bản ghi đã xóa vào phần nền mới, ghi ra đĩa ngoài event loop."""
+        if username in self._compacting:
+            return
+        self._compacting.add(username)
+        try:
+            built_at = int(time.time()) - ANN_RECONCILE_SLACK
+            ids, vectors = ivf.snapshot()
+            centroids = None if ivf.should_retrain(len(ids)) else ivf.centroids
+            started = time.perf_counter()
+            built = await asyncio.to_thread(self._build_and_save, username, ids, vectors, centroids, built_at)
+            ivf.install(built)
+            self.compactions += 1
+            logger.info(
+                f"{username}: Compact chỉ mục ANN {len(ids)} vector, {len(ivf.centroids)} cụm "
+                f"trong {time.perf_counter() - started:.2f}s"
+            )
+        except Exception as e:
+            ivf._journal = None
+            logger.warning(f"{username}: Lỗi compact chỉ mục ANN: {str(e)}")
+        finally:
+            self._compacting.discard(username)
+
+    async def get(self, username: str) -> UserVectorIndex:
+        """Lấy ma trận embedding của user, dựng từ SQLite nếu chưa nạp."""
+        index = self._indexes.get(username)
+        if index is not None:
+            self._indexes.move_to_end(username)
+            return index
+
+        lock = self._locks.setdefault(username, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(username)
+            if index is not None:
+                return index
+            self._building.add(username)
+            try:
+                index = await self._build(username)
+            finally:
+                self._building.discard(username)
+            self.builds += 1
+            if username in self._stale:
+                # Có thay đổi trong lúc dựng: dùng cho lần này, lần sau dựng lại
+                self._stale.discard(username)
+                return index
+
+            self._indexes[username] = index
+            for record_id in index.record_ids():
+                self._owners[record_id] = username
+            while len(self._indexes) > self.max_users:
+                evicted_user, evicted = self._indexes.popitem(last=False)
+                for record_id in evicted.record_ids():
+                    self._owners.pop(record_id, None)
+                self._locks.pop(evicted_user, None)
+            logger.info(f"{username}: Nạp {len(index)} vector QA vào bộ nhớ")
+            return index
+
+    async def search(
+        self,
+        username: str,
+        query: str,
+        limit: int,
+        threshold: float = 0.0
+    ) -> List[Tuple[str, float]]:
+        """Trả về [(id, cosine)] của tối đa limit bản ghi gần câu truy vấn nhất."""
+        if not self.enabled or not str(query or "").strip():
+            return []
+        index = await self.get(username)
+        query_vector = (await self.embed([query]))[0]
+        self.searches += 1
+        return index.search(query_vector, limit, threshold)
+
+    async def upsert_records(self, records: Iterable[Dict]) -> None:
+        """Embed và lưu các bản ghi qa_data mới/sửa, cập nhật ma trận đang nạp.
+
+        Sau mỗi lượt, chỉ mục của user đã đủ lớn được chuyển sang IVF hoặc compact.
+        """
+        records = list(records)
+        touched: Set[str] = set()
+        for start in range(0, len(records), Config.EMBEDDING_BATCH_SIZE):
+            chunk = records[start:start + Config.EMBEDDING_BATCH_SIZE]
+            vectors = await self.embed(
+                [qa_embedding_text(record.get("question"), record.get("answer")) for record in chunk]
+            )
+            await self._persist([(record["id"], record.get("created_by")) for record in chunk], vectors)
+            self.embedded += len(chunk)
+            for record, vector in zip(chunk, vectors):
+                record_id = record["id"]
+                username = record.get("created_by")
+                previous = self._owners.get(record_id)
+                if previous is not None and previous != username:
+                    self.remove([record_id])
+                if username in self._building:
+                    self._stale.add(username)
+                index = self._indexes.get(username)
+                if index is not None:
+                    index.upsert(record_id, vector)
+                    self._owners[record_id] = username
+                    touched.add(username)
+
+        for username in touched:
+            index = self._indexes.get(username)
+            if isinstance(index, UserVectorIndex) and len(index) >= Config.ANN_MIN_ROWS:
+                index = self._indexes[username] = self._wrap_ivf(index)
+            if isinstance(index, IVFIndex) and index.needs_compaction():
+                await self._compact(username, index)
+
+    def remove(self, record_ids: Iterable[str]) -> None:
+        """Bỏ vector của các bản ghi đã xóa (hàng SQLite được trigger xóa)."""
+        for record_id in record_ids:
+            username = self._owners.pop(record_id, None)
+            if username is None:
+                self._stale.update(self._building)
+                continue
+            index = self._indexes.get(username)
+            if index is not None:
+                index.remove(record_id)
+
+    def schedule_refresh(self, records: List[Dict], removed_ids: List[str]) -> None:
+        """Cập nhật vector ở nền để không chặn luồng ghi (có thể đang giữ writer)."""
+        if not self.enabled:
+            return
+        self.remove(removed_ids)
+        if not records:
+            return
+
+        async def run():
+            try:
+                await self.upsert_records(records)
+            except Exception as e:
+                logger.warning(f"Lỗi embed bản ghi QA, dựng lại ở lần dùng sau: {str(e)}")
+                self.invalidate()
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """Chờ các lượt embed nền hoàn tất (gọi trước khi dừng hàng đợi ghi)."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        """Bỏ ma trận của một user (hoặc tất cả) để dựng lại ở lần dùng sau."""
+        users = list(self._indexes) if username is None else [username]
+        for user in users:
+            index = self._indexes.pop(user, None)
+            if index is not None:
+                for record_id in index.record_ids():
+                    self._owners.pop(record_id, None)
+        self._stale.update(self._building if username is None else self._building & {username})
+
+    async def benchmark(self, username: str, queries: int = 100, limit: int = 10) -> Dict[str, Any]:
+        """Đo recall@limit và độ trễ của chỉ mục ANN của user so với tìm kiếm chính xác.
+
+        Truy vấn là các vector ngẫu nhiên lấy từ chính phần nền của chỉ mục.
+        """
+        index = await self.get(username)
+        if not isinstance(index, IVFIndex) or not index.base_size:
+            return {"error": f"{username} chưa có chỉ mục ANN (cần từ {Config.ANN_MIN_ROWS} bản ghi)"}
+        rng = np.random.default_rng()
+        rows = rng.choice(index.base_size, min(queries, index.base_size), replace=False)
+        sample = np.asarray(index.vectors[np.sort(rows)])
+        result = await asyncio.to_thread(benchmark, index, index.vectors, sample, limit)
+        return {"success": True, **result}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "model": self.embedder.name if self.embedder else None,
+            "users": len(self._indexes),
+            "ann_users": sum(1 for index in self._indexes.values() if isinstance(index, IVFIndex)),
+            "vectors": len(self._owners),
+            "embedded": self.embedded,
+            "builds": self.builds,
+            "compactions": self.compactions,
+            "searches": self.searches
+        }